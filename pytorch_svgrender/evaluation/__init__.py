@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: batch evaluation of rendering results
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'feature_cache': ['FeatureCache'],
+        'metrics': ['EvalMetric', 'METRICS', 'frechet_distance'],
+        'harness': ['scan_result_dirs', 'rasterize_items', 'evaluate', 'reference_statistics', 'leaderboard',
+                    'write_table']
+    }
+)
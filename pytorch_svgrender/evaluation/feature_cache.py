@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: on-disk cache of per-image metric values and features
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import pathlib
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from pytorch_svgrender.utils.misc import AnyPath
+
+
+class FeatureCache:
+    """
+    A sqlite table of (metric, key) -> (value, feature).
+
+    The key hashes the content of the evaluated file (and of the prompt or reference, if the metric
+    depends on them), so a file is only evaluated once, whatever run dir it is found in.
+    The features are stored as flat float32 vectors, e.g. the Inception activations of FID.
+    """
+
+    def __init__(self, cache_path: AnyPath):
+        self.cache_path = pathlib.Path(cache_path)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.cache_path.as_posix(), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "metric TEXT NOT NULL, key TEXT NOT NULL, value REAL, feature BLOB, "
+            "PRIMARY KEY (metric, key))"
+        )
+        self._conn.commit()
+
+    def get_many(self, metric: str, keys: Iterable[str]) -> Dict[str, Tuple[Optional[float], Optional[np.ndarray]]]:
+        keys, found = list(set(keys)), {}
+        with self._lock:
+            # sqlite limits the number of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, feature FROM features WHERE metric = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})", [metric, *chunk]
+                ).fetchall()
+                for key, value, feature in rows:
+                    found[key] = (value, None if feature is None else np.frombuffer(feature, dtype=np.float32))
+        return found
+
+    def put_many(self, metric: str, rows: List[Tuple[str, Optional[float], Optional[np.ndarray]]]) -> None:
+        records = [
+            (metric, key, None if value is None else float(value),
+             None if feature is None else np.asarray(feature, dtype=np.float32).reshape(-1).tobytes())
+            for key, value, feature in rows
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?)", records)
+            self._conn.commit()
+
+    def count(self, metric: str = None) -> int:
+        with self._lock:
+            if metric is None:
+                return self._conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM features WHERE metric = ?", [metric]).fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: batch evaluation of the results of many runs
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import re
+import csv
+import json
+import pathlib
+import hashlib
+import multiprocessing as mp
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import omegaconf
+
+from pytorch_svgrender.utils.misc import AnyPath
+from pytorch_svgrender.utils.result_cache import file_digest, collect_artifacts
+from .feature_cache import FeatureCache
+from .metrics import METRICS, frechet_distance
+
+_SEED_DIR = re.compile(r"sd(\d+)")
+
+
+def scan_result_dirs(roots: Sequence[AnyPath], pattern: str = '*final*.svg') -> List[Dict]:
+    """
+    Find the final SVGs of the Hydra run dirs under `roots`.
+    A run dir is recognized by its `.hydra/config.yaml`, which gives the method, prompt, target and seed.
+    """
+    items = []
+    for root in roots:
+        for hydra_cfg in sorted(pathlib.Path(root).rglob('.hydra/config.yaml')):
+            run_dir = hydra_cfg.parent.parent
+            cfg = omegaconf.OmegaConf.load(hydra_cfg)
+            for rel in collect_artifacts(run_dir):
+                if rel.suffix != '.svg' or rel.name.endswith('.min.svg') or not rel.match(pattern):
+                    continue
+                # the seed of a multirun is in the name of its sub dir
+                seed = next((int(m.group(1)) for p in rel.parts[:-1] for m in [_SEED_DIR.search(p)] if m),
+                            cfg.get('seed', None))
+                target = cfg.get('target', None)
+                if target is not None and not pathlib.Path(target).is_absolute():
+                    # the relative paths were relative to the project root of that run
+                    target = (run_dir / target) if (run_dir / target).exists() else pathlib.Path(target)
+                items.append({
+                    'run_dir': run_dir.as_posix(),
+                    'svg': (run_dir / rel).as_posix(),
+                    'method': cfg.x.method,
+                    'style': cfg.x.get('style', None),
+                    'prompt': cfg.get('prompt', None),
+                    'seed': seed,
+                    'target': None if target is None else pathlib.Path(target).as_posix(),
+                })
+    return items
+
+
+def _rasterize(task):
+    svg_path, png_path, size = task
+    try:
+        import cairosvg
+        cairosvg.svg2png(url=svg_path, write_to=png_path, output_width=size, output_height=size,
+                         background_color='white')
+        return png_path, None
+    except Exception as e:
+        return png_path, f"{type(e).__name__}: {e}"
+
+
+def rasterize_items(items: List[Dict], raster_dir: AnyPath, size: int = 512, n_workers: int = 8) -> None:
+    """rasterize the SVGs in worker processes, the PNGs are shared by identical files"""
+    raster_dir = pathlib.Path(raster_dir)
+    raster_dir.mkdir(parents=True, exist_ok=True)
+    tasks = {}
+    for item in items:
+        item['png'] = (raster_dir / f"{item['digest']}-{size}.png").as_posix()
+        if not pathlib.Path(item['png']).exists():
+            tasks[item['png']] = (item['svg'], item['png'], size)
+    if len(tasks) == 0:
+        return
+
+    errors = {}
+    if n_workers > 1:
+        with mp.get_context('spawn').Pool(n_workers) as pool:
+            for png_path, error in pool.imap_unordered(_rasterize, tasks.values(), chunksize=16):
+                if error is not None:
+                    errors[png_path] = error
+    else:
+        for task in tasks.values():
+            png_path, error = _rasterize(task)
+            if error is not None:
+                errors[png_path] = error
+    for item in items:
+        item['error'] = errors.get(item['png'], None)
+    print(f"-> rasterized {len(tasks) - len(errors)} SVGs, {len(errors)} failed")
+
+
+def _load_images(paths: List[str], size: int):
+    import torch
+    from PIL import Image
+    from torchvision import transforms
+
+    transform = transforms.Compose([transforms.Resize((size, size)), transforms.ToTensor()])
+    return torch.stack([transform(Image.open(p).convert('RGB')) for p in paths])
+
+
+def _metric_key(metric, item: Dict, image_size: int) -> str:
+    """the value depends on the file, its inputs, the raster size and the model settings of the metric"""
+    settings = json.dumps({'image_size': image_size, **metric.settings}, sort_keys=True)
+    parts = [item['digest'], settings]
+    if metric.needs_prompt:
+        parts.append(item['prompt'] or '')
+    if metric.needs_reference:
+        parts.append(item['target_digest'] or '')
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def evaluate(items: List[Dict],
+             metric_names: Sequence[str],
+             cache: FeatureCache,
+             raster_dir: AnyPath,
+             device=None,
+             image_size: int = 512,
+             batch_size: int = 64,
+             n_workers: int = 8) -> List[Dict]:
+    """
+    Fill `item[metric]` for all items, only the files that are not in `cache` are rasterized and evaluated.
+    The features of the set-level metrics (FID) are kept in `item['features'][metric]`.
+    """
+    import torch
+
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    for item in items:
+        item['digest'] = file_digest(item['svg'])
+        item['target_digest'] = file_digest(item['target']) \
+            if item.get('target') and pathlib.Path(item['target']).is_file() else None
+        item['features'] = {}
+
+    metric_classes = [METRICS[name] for name in metric_names]
+    # look the cache up first, the metrics only run on the misses
+    todo = {}
+    for cls in metric_classes:
+        valid = [it for it in items
+                 if (not cls.needs_prompt or it['prompt']) and (not cls.needs_reference or it['target_digest'])]
+        cached = cache.get_many(cls.name, [_metric_key(cls, it, image_size) for it in valid])
+        for it in valid:
+            hit = cached.get(_metric_key(cls, it, image_size), None)
+            if hit is not None:
+                it[cls.name], it['features'][cls.name] = hit
+            else:
+                todo.setdefault(cls.name, []).append(it)
+        print(f"-> {cls.name}: {len(valid) - len(todo.get(cls.name, []))} cached, "
+              f"{len(todo.get(cls.name, []))} to evaluate")
+
+    pending = list({id(it): it for its in todo.values() for it in its}.values())
+    rasterize_items(pending, raster_dir, size=image_size, n_workers=n_workers)
+
+    for cls in metric_classes:
+        its = [it for it in todo.get(cls.name, []) if it.get('error') is None]
+        if len(its) == 0:
+            continue
+        metric = cls(device, **cls.settings)
+        for i in range(0, len(its), batch_size):
+            batch = its[i:i + batch_size]
+            images = _load_images([it['png'] for it in batch], image_size)
+            prompts = [it['prompt'] for it in batch] if cls.needs_prompt else None
+            references = _load_images([it['target'] for it in batch], image_size) \
+                if cls.needs_reference else None
+            values, features = metric.compute(images, prompts, references)
+            rows = []
+            for k, it in enumerate(batch):
+                feature = None if features is None else features[k]
+                it[cls.name], it['features'][cls.name] = values[k], feature
+                rows.append((_metric_key(cls, it, image_size), values[k], feature))
+            cache.put_many(cls.name, rows)
+            print(f"-> {cls.name}: [{min(i + batch_size, len(its))}/{len(its)}]")
+        del metric
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    return items
+
+
+def reference_statistics(ref_dir: AnyPath,
+                         stats_dir: AnyPath,
+                         device=None,
+                         batch_size: int = 64,
+                         num_workers: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The FID (mu, sigma) of the real images in `ref_dir`, accumulated in a stream.
+    They are saved in `stats_dir` by the hash of the dir, so later evaluations reuse them.
+    """
+    import torch
+    from pytorch_svgrender.libs.metric.pytorch_fid.inception import InceptionV3
+    from pytorch_svgrender.libs.metric.pytorch_fid.fid_score import compute_statistics_of_path
+
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = InceptionV3([InceptionV3.BLOCK_INDEX_BY_DIM[2048]]).to(device)
+    return compute_statistics_of_path(ref_dir, model, batch_size, 2048, device,
+                                      num_workers=num_workers, cache_dir=stats_dir)
+
+
+def leaderboard(items: List[Dict],
+                metric_names: Sequence[str],
+                group_by: Sequence[str] = ('method',),
+                ref_stats: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[Dict]:
+    """mean of each metric per group, and the FID of each group against `ref_stats`"""
+    groups: Dict[tuple, List[Dict]] = {}
+    for it in items:
+        groups.setdefault(tuple(it.get(k, None) for k in group_by), []).append(it)
+
+    rows = []
+    for key, its in sorted(groups.items(), key=lambda kv: str(kv[0])):
+        row = dict(zip(group_by, key))
+        row['n'] = len(its)
+        for name in metric_names:
+            if name == 'fid':
+                feats = [it['features'].get('fid') for it in its if it['features'].get('fid') is not None]
+                row['fid'] = frechet_distance(np.stack(feats), ref_stats) \
+                    if ref_stats is not None and len(feats) > 1 else None
+            else:
+                values = [it[name] for it in its if it.get(name) is not None]
+                row[name] = float(np.mean(values)) if len(values) > 0 else None
+        rows.append(row)
+    return rows
+
+
+def write_table(rows: List[Dict], out_path: AnyPath) -> None:
+    """CSV, or Parquet if `out_path` ends with `.parquet` (needs pandas and pyarrow)"""
+    out_path = pathlib.Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    columns = list(dict.fromkeys(k for row in rows for k in row))
+    if out_path.suffix == '.parquet':
+        import pandas as pd  # optional dependency
+        pd.DataFrame(rows, columns=columns).to_parquet(out_path, index=False)
+        return
+    with open(out_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: batched metrics of the evaluation harness
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+class EvalMetric:
+    """
+    A metric computed per image, in batches.
+
+    `compute` returns one value per image, and optionally one feature vector per image that is
+    cached together with the value (e.g. for the set-level FID).
+    `settings` are the keyword arguments the metric is built with, they are part of the cache key.
+    """
+    name: str = None
+    needs_prompt: bool = False
+    needs_reference: bool = False
+    settings: Dict = {}
+
+    def __init__(self, device: torch.device):
+        self.device = device
+
+    def compute(self,
+                images: torch.Tensor,
+                prompts: List[str] = None,
+                references: torch.Tensor = None) -> Tuple[List[Optional[float]], Optional[np.ndarray]]:
+        raise NotImplementedError
+
+
+class CLIPScoreMetric(EvalMetric):
+    """100 * cosine similarity of the CLIP embeddings of the image and the prompt"""
+    name = 'clip_score'
+    needs_prompt = True
+    settings = {'clip_model_name': 'ViT-B/32'}
+
+    def __init__(self, device: torch.device, clip_model_name: str = 'ViT-B/32'):
+        super().__init__(device)
+        from pytorch_svgrender.libs.metric.clip_score import CLIPScoreWrapper
+
+        self.clip = CLIPScoreWrapper(clip_model_name, device=device)
+        self._text_features: Dict[str, torch.Tensor] = {}
+
+    def _encode_text(self, prompts: List[str]) -> torch.Tensor:
+        for p in set(prompts) - set(self._text_features):
+            self._text_features[p] = self.clip.encode_text(p, norm=False)[0]
+        text_features = torch.stack([self._text_features[p] for p in prompts])
+        return text_features / text_features.norm(dim=-1, keepdim=True)
+
+    @torch.no_grad()
+    def compute(self, images, prompts=None, references=None):
+        image_features = self.clip.encode_image(self.clip.normalize(images.to(self.device)), norm=True)
+        text_features = self._encode_text(prompts)
+        scores = 100 * (image_features * text_features.to(image_features.dtype)).sum(dim=-1)
+        return scores.float().cpu().tolist(), None
+
+
+class ImageRewardMetric(EvalMetric):
+    """ImageReward score of the image given the prompt"""
+    name = 'image_reward'
+    needs_prompt = True
+    settings = {'model_name': 'ImageReward-v1.0'}
+
+    def __init__(self, device: torch.device, model_name: str = 'ImageReward-v1.0', download_root: str = None):
+        super().__init__(device)
+        import ImageReward as RM  # local import
+
+        self.reward_model = RM.load(model_name, device=device, download_root=download_root)
+
+    @torch.no_grad()
+    def compute(self, images, prompts=None, references=None):
+        from torchvision.transforms.functional import to_pil_image
+
+        scores: List[Optional[float]] = [None] * len(prompts)
+        # ImageReward ranks the images of one prompt at once
+        by_prompt: Dict[str, List[int]] = {}
+        for i, p in enumerate(prompts):
+            by_prompt.setdefault(p, []).append(i)
+        for p, idx in by_prompt.items():
+            pils = [to_pil_image(images[i].cpu()) for i in idx]
+            _, rewards = self.reward_model.inference_rank(p, pils)
+            rewards = rewards if isinstance(rewards, list) else [rewards]
+            for i, r in zip(idx, rewards):
+                scores[i] = float(r)
+        return scores, None
+
+
+class LPIPSMetric(EvalMetric):
+    """LPIPS distance to the target image, for the img2svg methods"""
+    name = 'lpips'
+    needs_reference = True
+    settings = {'net': 'vgg'}
+
+    def __init__(self, device: torch.device, net: str = 'vgg'):
+        super().__init__(device)
+        from pytorch_svgrender.libs.metric.lpips_origin import LPIPS
+
+        self.lpips = LPIPS(net=net).to(device).eval()
+
+    @torch.no_grad()
+    def compute(self, images, prompts=None, references=None):
+        dist = self.lpips(images.to(self.device), references.to(self.device), normalize=True)
+        return dist.reshape(-1).float().cpu().tolist(), None
+
+
+class InceptionMetric(EvalMetric):
+    """Inception pool features, the FID of each group is computed from the cached features"""
+    name = 'fid'
+    settings = {'dims': 2048}
+
+    def __init__(self, device: torch.device, dims: int = 2048):
+        super().__init__(device)
+        from pytorch_svgrender.libs.metric.pytorch_fid.inception import InceptionV3
+
+        self.inception = InceptionV3([InceptionV3.BLOCK_INDEX_BY_DIM[dims]]).to(device).eval()
+
+    @torch.no_grad()
+    def compute(self, images, prompts=None, references=None):
+        features = self.inception(images.to(self.device))[0].reshape(images.shape[0], -1)
+        return [None] * images.shape[0], features.float().cpu().numpy()
+
+
+METRICS = {
+    m.name: m for m in [CLIPScoreMetric, ImageRewardMetric, LPIPSMetric, InceptionMetric]
+}
+
+
+def frechet_distance(features: np.ndarray, ref_stats: Tuple[np.ndarray, np.ndarray]) -> float:
+    """FID of a set of Inception features against the (mu, sigma) of the real images"""
+    from pytorch_svgrender.libs.metric.pytorch_fid.fid_score import calculate_frechet_distance, RunningStatistics
+
+    mu1, sigma1 = RunningStatistics(features.shape[-1]).update(features).result()
+    mu2, sigma2 = ref_stats
+    return float(calculate_frechet_distance(mu1, sigma1, mu2, sigma2))
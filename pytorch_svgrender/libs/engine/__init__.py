@@ -3,6 +3,14 @@
 # Author: XiMing Xing
 # Description:
 
-from .model_state import ModelState
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = ['ModelState']
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'model_state': ['ModelState'],
+        'metric_tracker': ['MetricTracker'],
+        'precision': ['AutocastPolicy', 'fp32', 'cast_fp32']
+    }
+)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) XiMing Xing. All rights reserved.
+# Author: XiMing Xing
+# Description: deferred logging of the training metrics
+
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import torch
+
+
+class MetricTracker:
+    """
+    Accumulates the per-step metrics without synchronizing the device.
+
+    The tensors are kept on their device (detached) and reduced every `interval` steps,
+    all the means are then copied to the host in a single transfer.
+    At that cadence the progress bar is updated, a line is appended to a JSONL file
+    and the values are sent to the trackers of the accelerator (TensorBoard, wandb).
+
+    The pipelines restart their step counter in each stage (e.g. LIVE, then SDS). With `new_stage`,
+    the step of a stage is logged as `stage_step` and the trackers get a global step that keeps
+    increasing across the stages.
+    """
+
+    def __init__(self,
+                 interval: int = 10,
+                 jsonl_path: Optional[Union[str, Path]] = None,
+                 log_fn: Optional[Callable[[Dict, int], None]] = None):
+        self.interval = max(int(interval), 1)
+        self.jsonl_path = Path(jsonl_path) if jsonl_path is not None else None
+        self.log_fn = log_fn
+
+        self._tensors: Dict[str, List[torch.Tensor]] = {}
+        self._floats: Dict[str, List[float]] = {}
+        self._n_updates = 0
+        self._step = 0
+        self._pbar = None
+        self.last: Dict[str, float] = {}
+
+        self.stage: Optional[str] = None
+        self._step_offset = 0  # global step of the first step of the current stage
+        self._last_global_step = -1
+
+    @property
+    def global_step(self) -> int:
+        return self._step_offset + self._step
+
+    def new_stage(self, stage: Optional[str] = None) -> None:
+        """flush the current stage, the steps of the next one are logged after all the previous ones"""
+        self.flush()
+        self._n_updates = 0
+        self._step = 0
+        self._pbar = None
+        self.last = {}
+        self.stage = stage
+        self._step_offset = self._last_global_step + 1
+
+        if self.jsonl_path is not None:
+            self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def update(self, step: int, pbar=None, **metrics) -> None:
+        """record the metrics of `step`, tensors stay on device until the next flush"""
+        if step < self._step:  # the step counter was reset without `new_stage`
+            self.new_stage(self.stage)
+        for k, v in metrics.items():
+            if torch.is_tensor(v):
+                self._tensors.setdefault(k, []).append(v.detach().float().reshape(-1).mean())
+            elif v is not None:
+                self._floats.setdefault(k, []).append(float(v))
+        self._step, self._pbar = step, pbar if pbar is not None else self._pbar
+        self._n_updates += 1
+        if self._n_updates % self.interval == 0:
+            self.flush()
+
+    def flush(self) -> Dict[str, float]:
+        if len(self._tensors) == 0 and len(self._floats) == 0:
+            return self.last
+
+        values = {k: sum(v) / len(v) for k, v in self._floats.items()}
+        if len(self._tensors) > 0:
+            names = list(self._tensors.keys())
+            device = self._tensors[names[0]][0].device
+            means = torch.stack([torch.stack(self._tensors[k]).to(device).mean() for k in names])
+            # the only device-to-host copy of the interval
+            values.update(zip(names, means.cpu().tolist()))
+        # keep the order of the first update
+        order = list(dict.fromkeys([*self._tensors.keys(), *self._floats.keys()]))
+        self._tensors, self._floats = {}, {}
+        self.last = {k: values[k] for k in order if k in values}
+
+        if self._pbar is not None:
+            self._pbar.set_description(self.format(self.last))
+        global_step = self.global_step
+        self._last_global_step = max(self._last_global_step, global_step)
+        if self.jsonl_path is not None:
+            record = {'step': global_step}
+            if self.stage is not None:
+                record.update(stage=self.stage, stage_step=self._step)
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps({**record, **self.last}) + '\n')
+        if self.log_fn is not None:
+            self.log_fn(self.last, global_step)
+        return self.last
+
+    @staticmethod
+    def format(values: Dict[str, float]) -> str:
+        def fmt(v):
+            return f"{v:.3e}" if v != 0 and (abs(v) < 1e-3 or abs(v) >= 1e4) else f"{v:.4f}"
+
+        return ", ".join(f"{k}: {fmt(v)}" for k, v in values.items())
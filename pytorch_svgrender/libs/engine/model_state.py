@@ -14,6 +14,9 @@ from accelerate.utils import LoggerType
 from accelerate import Accelerator
 
 from pytorch_svgrender.libs.utils.logging import build_sysout_print_logger
+from pytorch_svgrender.utils.trajectory_log import build_trajectory_writer
+from .metric_tracker import MetricTracker
+from .precision import AutocastPolicy
 
 
 class ModelState:
@@ -21,11 +24,12 @@ class ModelState:
     Handling logger and `hugging face` accelerate training
 
     features:
-        - Precision
+        - Precision (and the autocast policy of the losses)
         - Device
         - Optimizer
         - Logger (default: python system print and logging)
         - Monitor (default: wandb, tensorboard)
+        - Metrics (deferred, reduced on device every `metric_log.interval` steps)
     """
 
     def __init__(
@@ -49,12 +53,11 @@ class ModelState:
         self.result_path = self.result_path / f"{log_path_suffix}"  # method results path
 
         """init visualized tracker"""
-        # TODO: monitor with WANDB or TENSORBOARD
         self.log_with = []
-        # if self.state_cfg.wandb:
-        #     self.log_with.append(LoggerType.WANDB)
-        # if self.state_cfg.tensorboard:
-        #     self.log_with.append(LoggerType.TENSORBOARD)
+        if self.state_cfg.get('wandb', False):
+            self.log_with.append(LoggerType.WANDB)
+        if self.state_cfg.get('tensorboard', False):
+            self.log_with.append(LoggerType.TENSORBOARD)
 
         """HuggingFace Accelerator"""
         self.accelerator = Accelerator(
@@ -65,6 +68,10 @@ class ModelState:
             project_dir=self.monitor_dir,
         )
 
+        """autocast of the losses, the rasterizer stays in fp32"""
+        self.precision = AutocastPolicy(args.state.get("mprec"), self.device.type,
+                                        enable=self.state_cfg.get('autocast', False))
+
         """logs"""
         if self.accelerator.is_local_main_process:
             # log results in a folder periodically
@@ -81,12 +88,25 @@ class ModelState:
 
             print("\n***** Model State *****")
             print(f"-> Weight Dtype:  {self.weight_dtype}")
+            print(f"-> Loss Autocast: {self.precision}")
 
             if self.accelerator.scaler_handler is not None and self.accelerator.scaler_handler.enabled:
                 print(f"-> Enabled GradScaler: {self.accelerator.scaler_handler.to_kwargs()}")
 
             print(f"-> Working Space: '{self.result_path}'")
 
+        if len(self.log_with) > 0:
+            self.accelerator.init_trackers(project_name=f"{args.x.method}")
+
+        """metrics"""
+        metric_cfg = args.get('metric_log', {})
+        self.metric_tracker = MetricTracker(
+            interval=metric_cfg.get('interval', 10),
+            jsonl_path=self.result_path / "metrics.jsonl"
+            if metric_cfg.get('jsonl', True) and self.accelerator.is_main_process else None,
+            log_fn=(lambda values, step: self.accelerator.log(values, step=step)) if len(self.log_with) > 0 else None
+        )
+
         """glob step"""
         self.step = 0
 
@@ -218,6 +238,23 @@ class ModelState:
         if self.accelerator.is_main_process:
             pprint(dict(msg))
 
+    def log_metrics(self, pbar=None, step: int = None, **metrics):
+        """
+        Record the metrics of a step, e.g. `self.log_metrics(pbar, lr=lr, L_total=loss)`.
+        Tensors are not synchronized here, the progress bar shows the means of the last interval.
+        """
+        self.metric_tracker.update(self.step if step is None else step, pbar, **metrics)
+
+    def start_metric_stage(self, stage: str):
+        """call when `self.step` restarts for a new stage, the logged steps stay monotonic"""
+        self.metric_tracker.new_stage(stage)
+
+    def trajectory_writer(self, log_dir: Union[str, Path]):
+        """a `TrajectoryWriter` in `log_dir` if `trajectory_log.enable`, otherwise None"""
+        if not self.accelerator.is_main_process:
+            return None
+        return build_trajectory_writer(self.args, log_dir)
+
     def close_tracker(self):
         self.accelerator.end_training()
 
@@ -226,6 +263,7 @@ class ModelState:
 
     def close(self, msg: str = "Training complete."):
         """Use in end of training."""
+        self.metric_tracker.flush()
         self.free_memory()
 
         if torch.cuda.is_available():
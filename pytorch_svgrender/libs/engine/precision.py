@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) XiMing Xing. All rights reserved.
+# Author: XiMing Xing
+# Description: mixed precision of the losses, with an fp32 boundary at the rasterizer
+
+import functools
+import contextlib
+from typing import Any, List
+
+import torch
+
+
+def cast_fp32(obj: Any) -> Any:
+    """the floating point tensors of `obj` (nested in lists, tuples and dicts) in fp32"""
+    if torch.is_tensor(obj):
+        return obj.float() if obj.is_floating_point() else obj
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cast_fp32(o) for o in obj)
+    if isinstance(obj, dict):
+        return {k: cast_fp32(v) for k, v in obj.items()}
+    return obj
+
+
+def _autocast_enabled(device_type: str) -> bool:
+    try:
+        return torch.is_autocast_enabled(device_type)
+    except TypeError:  # torch < 2.4, no device argument
+        return torch.is_autocast_enabled() if device_type == 'cuda' else torch.is_autocast_cpu_enabled()
+
+
+def _autocast_devices() -> List[str]:
+    return ['cpu', 'cuda'] if torch.cuda.is_available() else ['cpu']
+
+
+def fp32(fn):
+    """
+    Run `fn` outside of autocast, with its floating point tensor arguments in fp32.
+    For the rasterizer and the numerically sensitive parts of the losses (distance matrices, norms, covariances).
+    Autocast is disabled for every device type: the arguments do not tell on which device `fn` runs.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        enabled = [d for d in _autocast_devices() if _autocast_enabled(d)]
+        if len(enabled) == 0:
+            return fn(*args, **kwargs)
+        with contextlib.ExitStack() as stack:
+            for device_type in enabled:
+                stack.enter_context(torch.autocast(device_type=device_type, enabled=False))
+            return fn(*cast_fp32(args), **cast_fp32(kwargs))
+
+    return wrapper
+
+
+class AutocastPolicy:
+    """
+    Mixed precision of everything downstream of the rasterizer:
+    the augmentations, CLIP, LPIPS, DISTS, the VGG of STROTSS and the VAE encoder of SDS.
+
+    `with policy.autocast(): ...` around the losses runs them in `dtype`, the SVG parameters and
+    diffvg stay in fp32 (see `fp32`), and `policy.cast(loss)` brings the loss back to fp32 before backward.
+    Autocast only supports bf16 on CPU, fp16 falls back to it there.
+    """
+
+    def __init__(self, mprec: str = 'no', device_type: str = 'cuda', enable: bool = True):
+        self.device_type = device_type
+        self.enabled = enable and mprec in ('fp16', 'bf16')
+        if mprec == 'fp16' and device_type != 'cpu':
+            self.dtype = torch.float16
+        else:
+            self.dtype = torch.bfloat16
+        if self.enabled and self.dtype == torch.bfloat16 and device_type == 'cuda' \
+                and not torch.cuda.is_bf16_supported():
+            self.dtype = torch.float16
+
+    def autocast(self):
+        return torch.autocast(device_type=self.device_type, dtype=self.dtype, enabled=self.enabled)
+
+    @staticmethod
+    def cast(obj: Any) -> Any:
+        return cast_fp32(obj)
+
+    def __repr__(self):
+        return f"AutocastPolicy({self.dtype if self.enabled else 'disabled'}, {self.device_type})"
@@ -5,6 +5,7 @@ import os
 import torch
 import torch.nn as nn
 
+from pytorch_svgrender.libs.engine.precision import fp32
 from . import pretrained_networks as pretrained_torch_models
 
 
@@ -16,6 +17,7 @@ def upsample(x):
     return nn.Upsample(size=x.shape[2:], mode='bilinear', align_corners=False)(x)
 
 
+@fp32  # eps underflows in half precision
 def normalize_tensor(in_feat, eps=1e-10):
     norm_factor = torch.sqrt(torch.sum(in_feat ** 2, dim=1, keepdim=True))
     return in_feat / (norm_factor + eps)
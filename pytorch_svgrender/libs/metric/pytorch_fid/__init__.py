@@ -4,7 +4,7 @@ import torch
 from einops import rearrange, repeat
 
 from .inception import InceptionV3
-from .fid_score import calculate_frechet_distance
+from .fid_score import calculate_frechet_distance, compute_statistics_of_path, RunningStatistics
 
 
 class PytorchFIDFactory(torch.nn.Module):
@@ -13,41 +13,59 @@ class PytorchFIDFactory(torch.nn.Module):
    Args:
        channels:
        inception_block_idx:
+       batch_size: the samples go through Inception in chunks of `batch_size`, and only
+            their running mean and covariance are kept
 
     Examples:
     >>> fid_factory =  PytorchFIDFactory()
     >>> fid_score = fid_factory.score(real_samples=data, fake_samples=all_images)
     >>> print(fid_score)
+    >>> # the samples can also be iterables of batches, and the reference a cached `.npz` or a dir
+    >>> ref_stats = fid_factory.reference_statistics('./data/coco_val', cache_dir='./workspace/.fid_stats')
+    >>> fid_score = fid_factory.score(fake_samples=batch_iterator, real_stats=ref_stats)
    """
 
-    def __init__(self, channels: int = 3, inception_block_idx: int = 2048):
+    def __init__(self, channels: int = 3, inception_block_idx: int = 2048, batch_size: int = 64):
         super().__init__()
         self.channels = channels
+        self.dims = inception_block_idx
+        self.batch_size = batch_size
 
         # load models
         assert inception_block_idx in InceptionV3.BLOCK_INDEX_BY_DIM
         block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[inception_block_idx]
         self.inception_v3 = InceptionV3([block_idx])
 
+    def _batches(self, samples):
+        if torch.is_tensor(samples):
+            samples = samples.split(self.batch_size)
+        for batch in samples:
+            if self.channels == 1:
+                batch = repeat(batch, 'b 1 ... -> b c ...', c=3)
+            yield batch
+
     @torch.no_grad()
     def calculate_activation_statistics(self, samples):
-        features = self.inception_v3(samples)[0]
-        features = rearrange(features, '... 1 1 -> ...')
-
-        mu = torch.mean(features, dim=0).cpu()
-        sigma = torch.cov(features).cpu()
-        return mu, sigma
+        device = next(self.inception_v3.parameters()).device
+        stats = RunningStatistics(self.dims)
+        for batch in self._batches(samples):
+            features = self.inception_v3(batch.to(device))[0]
+            features = rearrange(features, '... 1 1 -> ...')
+            stats.update(features.double().cpu().numpy())
+        return stats.result()
 
-    def score(self, real_samples, fake_samples):
-        if self.channels == 1:
-            real_samples, fake_samples = map(
-                lambda t: repeat(t, 'b 1 ... -> b c ...', c=3), (real_samples, fake_samples)
-            )
+    def reference_statistics(self, path, cache_dir=None, num_workers=4):
+        """statistics of an image dir or a `.npz`, cached in `cache_dir` by the hash of the dir"""
+        device = next(self.inception_v3.parameters()).device
+        return compute_statistics_of_path(path, self.inception_v3, self.batch_size, self.dims, device,
+                                          num_workers=num_workers, cache_dir=cache_dir)
 
-        min_batch = min(real_samples.shape[0], fake_samples.shape[0])
-        real_samples, fake_samples = map(lambda t: t[:min_batch], (real_samples, fake_samples))
+    def score(self, real_samples=None, fake_samples=None, real_stats=None):
+        if real_stats is None and torch.is_tensor(real_samples) and torch.is_tensor(fake_samples):
+            min_batch = min(real_samples.shape[0], fake_samples.shape[0])
+            real_samples, fake_samples = map(lambda t: t[:min_batch], (real_samples, fake_samples))
 
-        m1, s1 = self.calculate_activation_statistics(real_samples)
+        m1, s1 = real_stats if real_stats is not None else self.calculate_activation_statistics(real_samples)
         m2, s2 = self.calculate_activation_statistics(fake_samples)
 
         fid_value = calculate_frechet_distance(m1, s1, m2, s2)
@@ -32,6 +32,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import os
+import hashlib
 import pathlib
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
 
@@ -63,6 +64,9 @@ parser.add_argument('--dims', type=int, default=2048,
                     choices=list(InceptionV3.BLOCK_INDEX_BY_DIM),
                     help=('Dimensionality of Inception features to use. '
                           'By default, uses pool3 features'))
+parser.add_argument('--stats-cache', type=str, default=None,
+                    help=('Directory of the cached statistics of image directories, '
+                          'keyed by the hash of the file list'))
 parser.add_argument('--save-stats', action='store_true',
                     help=('Generate an npz archive from a directory of samples. '
                           'The first path is used as input and the second as output.'))
@@ -90,26 +94,61 @@ class ImagePathDataset(torch.utils.data.Dataset):
         return img
 
 
-def get_activations(files, model, batch_size=50, dims=2048, device='cpu',
-                    num_workers=1):
-    """Calculates the activations of the pool_3 layer for all images.
+class RunningStatistics:
+    """Streaming mean and covariance of the activations.
 
-    Params:
-    -- files       : List of image files paths
-    -- model       : Instance of inception model
-    -- batch_size  : Batch size of images for the model to process at once.
-                     Make sure that the number of samples is a multiple of
-                     the batch size, otherwise some samples are ignored. This
-                     behavior is retained to match the original FID score
-                     implementation.
-    -- dims        : Dimensionality of features returned by Inception
-    -- device      : Device to run calculations
-    -- num_workers : Number of parallel dataloader workers
+    The batches are merged with the parallel update of Chan et al., in
+    float64, so the statistics of any number of images are computed in
+    O(dims^2) memory and match `np.mean` / `np.cov` of the whole set.
+    """
 
-    Returns:
-    -- A numpy array of dimension (num images, dims) that contains the
-       activations of the given tensor when feeding inception with the
-       query tensor.
+    def __init__(self, dims=2048):
+        self.dims = dims
+        self.n = 0
+        self.mu = np.zeros(dims, dtype=np.float64)
+        self.m2 = np.zeros((dims, dims), dtype=np.float64)
+
+    def update(self, act):
+        act = np.asarray(act, dtype=np.float64).reshape(-1, self.dims)
+        n_b = act.shape[0]
+        if n_b == 0:
+            return self
+        mu_b = act.mean(axis=0)
+        centered = act - mu_b
+        m2_b = centered.T @ centered
+
+        n = self.n + n_b
+        delta = mu_b - self.mu
+        self.mu += delta * (n_b / n)
+        self.m2 += m2_b + np.outer(delta, delta) * (self.n * n_b / n)
+        self.n = n
+        return self
+
+    def merge(self, other):
+        """merge the statistics of another disjoint set"""
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mu - self.mu
+        self.mu += delta * (other.n / n)
+        self.m2 += other.m2 + np.outer(delta, delta) * (self.n * other.n / n)
+        self.n = n
+        return self
+
+    @property
+    def sigma(self):
+        return self.m2 / max(self.n - 1, 1)
+
+    def result(self):
+        return self.mu.copy(), self.sigma
+
+
+def _activation_batches(files, model, batch_size=50, device='cpu',
+                        num_workers=1):
+    """Yields the pool_3 activations of `files` batch by batch.
+
+    The images are decoded by `num_workers` loader processes that prefetch
+    the next batches into pinned memory while the model runs.
     """
     model.eval()
 
@@ -118,19 +157,19 @@ def get_activations(files, model, batch_size=50, dims=2048, device='cpu',
                'Setting batch size to data size'))
         batch_size = len(files)
 
+    use_cuda = torch.device(device).type == 'cuda'
+    prefetch = {'prefetch_factor': 4} if num_workers > 0 else {}
     dataset = ImagePathDataset(files, transforms=TF.ToTensor())
     dataloader = torch.utils.data.DataLoader(dataset,
                                              batch_size=batch_size,
                                              shuffle=False,
                                              drop_last=False,
-                                             num_workers=num_workers)
-
-    pred_arr = np.empty((len(files), dims))
-
-    start_idx = 0
+                                             num_workers=num_workers,
+                                             pin_memory=use_cuda,
+                                             **prefetch)
 
     for batch in tqdm(dataloader):
-        batch = batch.to(device)
+        batch = batch.to(device, non_blocking=use_cuda)
 
         with torch.no_grad():
             pred = model(batch)[0]
@@ -140,8 +179,35 @@ def get_activations(files, model, batch_size=50, dims=2048, device='cpu',
         if pred.size(2) != 1 or pred.size(3) != 1:
             pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
 
-        pred = pred.squeeze(3).squeeze(2).cpu().numpy()
+        yield pred.squeeze(3).squeeze(2).cpu().numpy()
+
+
+def get_activations(files, model, batch_size=50, dims=2048, device='cpu',
+                    num_workers=1):
+    """Calculates the activations of the pool_3 layer for all images.
+
+    Params:
+    -- files       : List of image files paths
+    -- model       : Instance of inception model
+    -- batch_size  : Batch size of images for the model to process at once.
+                     Make sure that the number of samples is a multiple of
+                     the batch size, otherwise some samples are ignored. This
+                     behavior is retained to match the original FID score
+                     implementation.
+    -- dims        : Dimensionality of features returned by Inception
+    -- device      : Device to run calculations
+    -- num_workers : Number of parallel dataloader workers
+
+    Returns:
+    -- A numpy array of dimension (num images, dims) that contains the
+       activations of the given tensor when feeding inception with the
+       query tensor.
+    """
+    pred_arr = np.empty((len(files), dims))
+
+    start_idx = 0
 
+    for pred in _activation_batches(files, model, batch_size, device, num_workers):
         pred_arr[start_idx:start_idx + pred.shape[0]] = pred
 
         start_idx = start_idx + pred.shape[0]
@@ -225,28 +291,60 @@ def calculate_activation_statistics(files, model, batch_size=50, dims=2048,
     -- sigma : The covariance matrix of the activations of the pool_3 layer of
                the inception model.
     """
-    act = get_activations(files, model, batch_size, dims, device, num_workers)
-    mu = np.mean(act, axis=0)
-    sigma = np.cov(act, rowvar=False)
-    return mu, sigma
+    # the activations are never materialized, only the running statistics
+    stats = RunningStatistics(dims)
+    for pred in _activation_batches(files, model, batch_size, device, num_workers):
+        stats.update(pred)
+    return stats.result()
+
+
+def dataset_hash(files, dims=2048):
+    """Hash of an image set, from the names, sizes and mtimes of its files"""
+    h = hashlib.sha1(str(dims).encode())
+    for file in sorted(str(f) for f in files):
+        st = os.stat(file)
+        h.update(f"{file}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
 
 
 def compute_statistics_of_path(path, model, batch_size, dims, device,
-                               num_workers=1):
+                               num_workers=1, cache_dir=None):
+    """Statistics of a `.npz` file or of an image directory.
+
+    With `cache_dir`, the statistics of a directory are saved in
+    `cache_dir/<dataset_hash>.npz` and reused as long as its files are
+    unchanged.
+    """
+    path = str(path)
     if path.endswith('.npz'):
         with np.load(path) as f:
             m, s = f['mu'][:], f['sigma'][:]
-    else:
-        path = pathlib.Path(path)
-        files = sorted([file for ext in IMAGE_EXTENSIONS
-                        for file in path.glob('*.{}'.format(ext))])
-        m, s = calculate_activation_statistics(files, model, batch_size,
-                                               dims, device, num_workers)
+        return m, s
+
+    path = pathlib.Path(path)
+    files = sorted([file for ext in IMAGE_EXTENSIONS
+                    for file in path.glob('*.{}'.format(ext))])
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = pathlib.Path(cache_dir) / f"{dataset_hash(files, dims)}.npz"
+        if cache_file.exists():
+            with np.load(cache_file) as f:
+                return f['mu'][:], f['sigma'][:]
+
+    m, s = calculate_activation_statistics(files, model, batch_size,
+                                           dims, device, num_workers)
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix('.tmp.npz')
+        np.savez(tmp_file, mu=m, sigma=s, n=len(files), path=str(path))
+        os.replace(tmp_file, cache_file)
 
     return m, s
 
 
-def calculate_fid_given_paths(paths, batch_size, device, dims, num_workers=1):
+def calculate_fid_given_paths(paths, batch_size, device, dims, num_workers=1,
+                              cache_dir=None):
     """Calculates the FID of two paths"""
     for p in paths:
         if not os.path.exists(p):
@@ -257,9 +355,9 @@ def calculate_fid_given_paths(paths, batch_size, device, dims, num_workers=1):
     model = InceptionV3([block_idx]).to(device)
 
     m1, s1 = compute_statistics_of_path(paths[0], model, batch_size,
-                                        dims, device, num_workers)
+                                        dims, device, num_workers, cache_dir)
     m2, s2 = compute_statistics_of_path(paths[1], model, batch_size,
-                                        dims, device, num_workers)
+                                        dims, device, num_workers, cache_dir)
     fid_value = calculate_frechet_distance(m1, s1, m2, s2)
 
     return fid_value
@@ -314,7 +412,8 @@ def main():
                                           args.batch_size,
                                           device,
                                           args.dims,
-                                          num_workers)
+                                          num_workers,
+                                          args.stats_cache)
     print('FID: ', fid_value)
 
 
@@ -4,5 +4,16 @@
 # License: MPL-2.0 License
 # Description: model helpers
 
-from .diffvg_helper import DiffVGState
-from .diffusers_helper import init_StableDiffusion_pipeline, init_diffusers_unet, model2res
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'diffvg_helper': ['DiffVGState', 'SVGScene', 'clone_scene'],
+        'diffusers_helper': ['init_StableDiffusion_pipeline', 'init_diffusers_unet', 'model2res', 'expand_to_batch',
+                             'keep_pipelines_warm'],
+        'offload_helper': ['StageOffloadManager'],
+        'latent_proxy': ['LatentProxy', 'LatentProxySwitch', 'fit_latent_proxy', 'load_latent_proxy']
+    }
+)
@@ -3,7 +3,7 @@
 # Author: XiMing Xing
 # Description:
 
-from typing import AnyStr
+from typing import AnyStr, List, Union
 import pathlib
 from collections import OrderedDict
 from packaging import version
@@ -35,6 +35,35 @@ def model2res(model_id: str):
     return _model2resolution.get(model_id, 512)
 
 
+# pipelines kept in memory across jobs of a long-running process, see `keep_pipelines_warm`
+_warm_pipelines = None
+
+
+def keep_pipelines_warm(enable: bool = True):
+    """reuse the pipelines built by `init_StableDiffusion_pipeline` with the same arguments"""
+    global _warm_pipelines
+    _warm_pipelines = {} if enable else None
+
+
+def _has_meta_tensors(pipeline) -> bool:
+    for component in pipeline.components.values():
+        if isinstance(component, torch.nn.Module):
+            if any(p.is_meta for p in component.parameters()) or any(b.is_meta for b in component.buffers()):
+                return True
+    return False
+
+
+def expand_to_batch(prompt: Union[AnyStr, List, None], batch_size: int) -> Union[List, None]:
+    """broadcast one prompt (or negative prompt) to every sample of a batch of independent jobs"""
+    if prompt is None:
+        return None
+    prompt = [prompt] if isinstance(prompt, str) else list(prompt)
+    if len(prompt) == 1:
+        prompt = prompt * batch_size
+    assert len(prompt) == batch_size, f"got {len(prompt)} prompts for a batch of {batch_size} samples."
+    return prompt
+
+
 def init_StableDiffusion_pipeline(model_id: AnyStr,
                                   custom_pipeline: StableDiffusionPipeline,
                                   custom_scheduler: SchedulerMixin = None,
@@ -49,7 +78,8 @@ def init_StableDiffusion_pipeline(model_id: AnyStr,
                                   cpu_offload: bool = False,
                                   vae_slicing: bool = False,
                                   lora_path: AnyStr = None,
-                                  unet_path: AnyStr = None) -> StableDiffusionPipeline:
+                                  unet_path: AnyStr = None,
+                                  keep_warm: bool = True) -> StableDiffusionPipeline:
     """
     A tool for initial diffusers pipeline.
 
@@ -69,6 +99,8 @@ def init_StableDiffusion_pipeline(model_id: AnyStr,
         vae_slicing: enable sliced VAE decoding
         lora_path: load LoRA checkpoint
         unet_path: load unet checkpoint
+        keep_warm: reuse and keep the pipeline across jobs (see `keep_pipelines_warm`),
+                   False for callers that modify the pipeline modules in place
 
     Returns:
             diffusers.StableDiffusionPipeline
@@ -77,6 +109,20 @@ def init_StableDiffusion_pipeline(model_id: AnyStr,
     # get model id
     model_id = DiffusersModels.get(model_id, model_id)
 
+    # reuse a warm pipeline
+    warm_key = None
+    if _warm_pipelines is not None and keep_warm:
+        warm_key = (model_id, custom_pipeline.__name__, getattr(custom_scheduler, '__name__', None),
+                    str(device), str(torch_dtype), ldm_speed_up, enable_xformers, gradient_checkpoint,
+                    cpu_offload, vae_slicing, lora_path, unet_path)
+        if warm_key in _warm_pipelines:
+            if _has_meta_tensors(_warm_pipelines[warm_key]):
+                # left offloaded to disk by a previous job, rebuild it
+                del _warm_pipelines[warm_key]
+            else:
+                print(f"reuse warm diffusers pipeline: {model_id}")
+                return _warm_pipelines[warm_key]
+
     # process diffusion model
     if custom_scheduler is not None:
         pipeline = custom_pipeline.from_pretrained(
@@ -153,6 +199,9 @@ def init_StableDiffusion_pipeline(model_id: AnyStr,
         pipeline.enable_vae_slicing()
 
     print(pipeline.scheduler)
+
+    if warm_key is not None:
+        _warm_pipelines[warm_key] = pipeline
     return pipeline
 
 
@@ -182,6 +231,8 @@ def init_diffusers_unet(model_id: AnyStr,
         gradient_checkpoint: activates gradient checkpointing for the current model
         lora_path: load LoRA checkpoint
         unet_path: load unet checkpoint
+        keep_warm: reuse and keep the pipeline across jobs (see `keep_pipelines_warm`),
+                   False for callers that modify the pipeline modules in place
 
     Returns:
             diffusers.UNet
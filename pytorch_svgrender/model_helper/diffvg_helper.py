@@ -4,13 +4,17 @@
 # Copyright (c) 2023, XiMing Xing.
 # License: MPL-2.0 License
 
+import copy
 import pathlib
+from collections import namedtuple
 from typing import AnyStr, List, Union
 import xml.etree.ElementTree as etree
 
 import torch
 import pydiffvg
 
+from pytorch_svgrender.libs.engine.precision import fp32
+
 
 def init_pydiffvg(device: torch.device,
                   use_gpu: bool = torch.cuda.is_available(),
@@ -20,6 +24,49 @@ def init_pydiffvg(device: torch.device,
     pydiffvg.set_print_timing(print_timing)
 
 
+# a scene as returned by `pydiffvg.svg_to_scene`
+SVGScene = namedtuple('SVGScene', ['canvas_width', 'canvas_height', 'shapes', 'shape_groups'])
+
+
+def _detached_copy(obj, device=None):
+    if torch.is_tensor(obj):
+        obj = obj.detach().clone()
+        return obj if device is None else obj.to(device)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_detached_copy(o, device) for o in obj)
+    if hasattr(obj, '__dict__'):  # pydiffvg shapes, groups and gradients
+        new = copy.copy(obj)
+        for k, v in vars(obj).items():
+            setattr(new, k, _detached_copy(v, device))
+        return new
+    return obj
+
+
+def clone_scene(scene: SVGScene, device: torch.device = None) -> SVGScene:
+    """copy the shapes and groups of a scene with detached tensors, optionally moved to `device`"""
+    return SVGScene(scene.canvas_width,
+                    scene.canvas_height,
+                    _detached_copy(list(scene.shapes), device),
+                    _detached_copy(list(scene.shape_groups), device))
+
+
+def _tensors_of(obj):
+    """the tensors of a pydiffvg shape or group, colors and gradients included"""
+    for v in vars(obj).values():
+        if torch.is_tensor(v):
+            yield v
+        elif hasattr(v, '__dict__'):  # gradients
+            yield from _tensors_of(v)
+
+
+def over_premultiplied(top: torch.Tensor, bottom: torch.Tensor) -> torch.Tensor:
+    """
+    `top` over `bottom`, HWC RGBA with premultiplied colors.
+    pydiffvg renders straight (non-premultiplied) colors, see `DiffVGState.render_warp`.
+    """
+    return top + bottom * (1 - top[..., 3:4])
+
+
 class DiffVGState(torch.nn.Module):
 
     def __init__(self,
@@ -27,7 +74,8 @@ class DiffVGState(torch.nn.Module):
                  use_gpu: bool = torch.cuda.is_available(),
                  print_timing: bool = False,
                  canvas_width: int = None,
-                 canvas_height: int = None):
+                 canvas_height: int = None,
+                 frozen_layer_cache: bool = False):
         super(DiffVGState, self).__init__()
         # pydiffvg device setting
         self.device = device
@@ -49,24 +97,121 @@ class DiffVGState(torch.nn.Module):
         self.color_vars = []
         self.width_vars = []
 
+        # the shapes of the previous path groups, frozen under the new ones, are rendered once
+        self.frozen_layer_cache = frozen_layer_cache
+        self.n_frozen_shapes, self.n_frozen_groups = 0, 0
+        self._frozen_layer, self._frozen_key = None, None
+        # ids of the tensors updated by the optimizers in use, see `set_active_parameters`
+        self._active_params = None
+
     def clip_curve_shape(self, *args, **kwargs):
         raise NotImplementedError
 
-    def render_warp(self, seed=0):
-        self.clip_curve_shape()
+    def freeze_shapes(self):
+        """
+        Mark all the current shapes as frozen, below the ones added afterwards.
+        They are rendered once only if none of their tensors is updated by an active optimizer,
+        see `set_active_parameters`; otherwise the whole scene is rendered every step.
+        """
+        self.n_frozen_shapes, self.n_frozen_groups = len(self.shapes), len(self.shape_groups)
+        self._frozen_layer, self._frozen_key = None, None
+
+    def unfreeze_shapes(self):
+        self.n_frozen_shapes, self.n_frozen_groups = 0, 0
+        self._frozen_layer, self._frozen_key = None, None
+        self._active_params = None
 
+    def set_active_parameters(self, params):
+        """
+        The tensors the optimizers in use still update. Until it is set, a frozen tensor that
+        requires grad is assumed to be optimized.
+        """
+        self._active_params = {id(t) for t in params}
+
+    def _frozen_layer_key(self):
+        """
+        Identifies the frozen shapes, None if they can not be cached:
+        a parameter is optimized, or the frozen groups are not a prefix of the scene.
+        """
+        if not self.frozen_layer_cache or self.n_frozen_groups == 0 \
+                or self.n_frozen_groups > len(self.shape_groups) or self.n_frozen_shapes > len(self.shapes):
+            return None
+        key = [self.canvas_width, self.canvas_height]
+        for obj in self.shapes[:self.n_frozen_shapes] + self.shape_groups[:self.n_frozen_groups]:
+            key.append(id(obj))
+            for t in _tensors_of(obj):
+                if t.requires_grad and (self._active_params is None or id(t) in self._active_params):
+                    return None
+                # in-place updates bump the version, `.data` assignments change the storage
+                key.append((t.data_ptr(), t._version))
+        for i, group in enumerate(self.shape_groups):
+            below = group.shape_ids < self.n_frozen_shapes
+            if (i < self.n_frozen_groups and not below.all()) or (i >= self.n_frozen_groups and below.any()):
+                return None
+        return tuple(key)
+
+    def _render(self, shapes, shape_groups, seed):
         scene_args = pydiffvg.RenderFunction.serialize_scene(
-            self.canvas_width, self.canvas_height, self.shapes, self.shape_groups
+            self.canvas_width, self.canvas_height, shapes, shape_groups
         )
         _render = pydiffvg.RenderFunction.apply
-        img = _render(self.canvas_width,  # width
-                      self.canvas_height,  # height
-                      2,  # num_samples_x
-                      2,  # num_samples_y
-                      seed,  # seed
-                      None,
-                      *scene_args)
-        return img
+        return _render(self.canvas_width,  # width
+                       self.canvas_height,  # height
+                       2,  # num_samples_x
+                       2,  # num_samples_y
+                       seed,  # seed
+                       None,
+                       *scene_args)
+
+    def _render_over_frozen_layer(self, key, seed=0):
+        """render the active shapes only, over the cached premultiplied layer of the frozen ones"""
+        if key != self._frozen_key:
+            with torch.no_grad():
+                frozen = self._render(self.shapes[:self.n_frozen_shapes],
+                                      self.shape_groups[:self.n_frozen_groups], seed=0)
+            self._frozen_layer = torch.cat([frozen[..., :3] * frozen[..., 3:4], frozen[..., 3:4]], dim=-1)
+            self._frozen_key = key
+
+        active_groups = []
+        for group in self.shape_groups[self.n_frozen_groups:]:
+            group = copy.copy(group)
+            group.shape_ids = group.shape_ids - self.n_frozen_shapes
+            active_groups.append(group)
+        if len(active_groups) == 0:
+            img = self._frozen_layer
+        else:
+            active = self._render(self.shapes[self.n_frozen_shapes:], active_groups, seed)
+            active = torch.cat([active[..., :3] * active[..., 3:4], active[..., 3:4]], dim=-1)
+            img = over_premultiplied(active, self._frozen_layer)
+        # back to straight colors, as returned by pydiffvg
+        alpha = img[..., 3:4]
+        return torch.cat([img[..., :3] / alpha.clamp_min(1e-8), alpha], dim=-1)
+
+    @fp32
+    def render_warp(self, seed=0):
+        self.clip_curve_shape()
+
+        key = self._frozen_layer_key()
+        if key is not None:
+            return self._render_over_frozen_layer(key, seed)
+        return self._render(self.shapes, self.shape_groups, seed)
+
+    def export_scene(self, device: torch.device = None) -> SVGScene:
+        """
+        A detached copy of the current scene.
+        Used to hand the result of one stage over to the next without an SVG round-trip,
+        which loses precision and re-parses the whole file.
+        """
+        return clone_scene(SVGScene(self.canvas_width, self.canvas_height, self.shapes, self.shape_groups), device)
+
+    @fp32
+    def render_image(self, canvas_width, canvas_height, shapes, shape_groups, seed=0):
+        """rasterize a scene on a white background, returns a NCHW image"""
+        scene_args = pydiffvg.RenderFunction.serialize_scene(canvas_width, canvas_height, shapes, shape_groups)
+        _render = pydiffvg.RenderFunction.apply
+        img = _render(canvas_width, canvas_height, 2, 2, seed, None, *scene_args)
+        img = img[:, :, 3:4] * img[:, :, :3] + (1 - img[:, :, 3:4])
+        return img.permute(2, 0, 1).unsqueeze(0).to(self.device)  # HWC -> NCHW
 
     @staticmethod
     def load_svg(path_svg):
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Author: ximing xing
+# Copyright (c) 2025, XiMing Xing
+# License: MPL-2.0 License
+# Description: a cheap RGB-to-latent proxy of the VAE encoder for score distillation
+
+import re
+import math
+import pathlib
+from typing import AnyStr, Optional
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class LatentProxy(nn.Module):
+    """
+    A small convolutional stand-in for `vae.encode(2x - 1).latent_dist.mean * scaling_factor`.
+
+    The image is folded into 8x8 patches (`PixelUnshuffle`), so the output has the resolution
+    of the VAE latents. Input: RGB in [0, 1], (B, 3, H, W). Output: scaled latents, (B, C, H/8, W/8).
+    """
+
+    def __init__(self, latent_channels: int = 4, hidden: int = 128, downsample: int = 8):
+        super().__init__()
+        self.downsample = downsample
+        self.net = nn.Sequential(
+            nn.PixelUnshuffle(downsample),
+            nn.Conv2d(3 * downsample ** 2, hidden, kernel_size=1),
+            nn.SiLU(),
+            nn.Conv2d(hidden, hidden, kernel_size=3, padding=1),
+            nn.SiLU(),
+            nn.Conv2d(hidden, latent_channels, kernel_size=1),
+        )
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        dtype = self.net[1].weight.dtype
+        return self.net(images.clamp(0, 1).to(dtype))
+
+
+def _synthetic_batch(batch_size: int, size: int, device: torch.device, n_shapes: int = 12) -> torch.Tensor:
+    """
+    Renderings that look like the SVG outputs: flat-colour discs, boxes and strokes with soft edges,
+    over white or a smooth gradient. RGB in [0, 1], (B, 3, size, size).
+    """
+    t = (torch.arange(size, device=device).float() + 0.5) / size
+    gy, gx = torch.meshgrid(t, t, indexing='ij')
+    gx, gy = gx.expand(batch_size, 1, size, size), gy.expand(batch_size, 1, size, size)
+
+    # background: white for half of the batch, a linear gradient between two colours otherwise
+    c0, c1 = torch.rand(2, batch_size, 3, 1, 1, device=device)
+    angle = torch.rand(batch_size, 1, 1, 1, device=device) * 2 * math.pi
+    ramp = (gx * torch.cos(angle) + gy * torch.sin(angle)).add(1.5).div(3.)
+    canvas = c0 + (c1 - c0) * ramp
+    white = (torch.rand(batch_size, 1, 1, 1, device=device) < 0.5).float()
+    canvas = white + (1 - white) * canvas
+
+    softness = 1.5 / size
+    for _ in range(n_shapes):
+        cx, cy = torch.rand(2, batch_size, 1, 1, 1, device=device)
+        r = 0.02 + 0.25 * torch.rand(batch_size, 1, 1, 1, device=device)
+        kind = torch.randint(0, 3, (batch_size, 1, 1, 1), device=device)
+
+        disc = r - torch.sqrt((gx - cx) ** 2 + (gy - cy) ** 2)
+        box = r - torch.maximum((gx - cx).abs(), (gy - cy).abs())
+        # a straight stroke through (cx, cy), of random direction and width
+        theta = torch.rand(batch_size, 1, 1, 1, device=device) * math.pi
+        width = 0.002 + 0.02 * torch.rand(batch_size, 1, 1, 1, device=device)
+        along = (gx - cx) * torch.cos(theta) + (gy - cy) * torch.sin(theta)
+        across = -(gx - cx) * torch.sin(theta) + (gy - cy) * torch.cos(theta)
+        stroke = torch.minimum(width - across.abs(), r - along.abs())
+
+        sdf = torch.where(kind == 0, disc, torch.where(kind == 1, box, stroke))
+        alpha = torch.sigmoid(sdf / softness) * (0.5 + 0.5 * torch.rand(batch_size, 1, 1, 1, device=device))
+        color = torch.rand(batch_size, 3, 1, 1, device=device)
+        canvas = canvas * (1 - alpha) + color * alpha
+    return canvas.clamp(0, 1)
+
+
+def fit_latent_proxy(vae,
+                     proxy: Optional[LatentProxy] = None,
+                     steps: int = 1000,
+                     batch_size: int = 8,
+                     size: int = 256,
+                     lr: float = 1e-3,
+                     device: torch.device = "cuda") -> (LatentProxy, float):
+    """fit `proxy` to the (mean) latents of `vae` on synthetic renderings, returns (proxy, final mse)"""
+    scaling_factor = vae.config.scaling_factor
+    if proxy is None:
+        proxy = LatentProxy(latent_channels=vae.config.latent_channels)
+    proxy = proxy.to(device=device, dtype=torch.float32).train()
+    vae_dtype = next(vae.parameters()).dtype
+
+    optimizer = torch.optim.Adam(proxy.parameters(), lr=lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=max(steps, 1))
+    err = float('nan')
+    for _ in range(steps):
+        images = _synthetic_batch(batch_size, size, device)
+        with torch.no_grad():
+            target = vae.encode((2 * images - 1).to(vae_dtype)).latent_dist.mean * scaling_factor
+        loss = F.mse_loss(proxy(images), target.float())
+        optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        optimizer.step()
+        scheduler.step()
+        err = loss.item()
+    return proxy.eval().requires_grad_(False), err
+
+
+def load_latent_proxy(model_id: AnyStr,
+                      vae,
+                      cache_dir: AnyStr = './checkpoint/latent_proxy',
+                      device: torch.device = "cuda",
+                      fit_steps: int = 1000,
+                      hidden: int = 128) -> LatentProxy:
+    """the proxy of the VAE of `model_id`, fitted on the first call and cached in `cache_dir`"""
+    cache_dir = pathlib.Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(model_id)).strip('_')
+    path = cache_dir / f"{name}-h{hidden}-s{fit_steps}.pt"
+
+    latent_channels = vae.config.latent_channels
+    if path.exists():
+        ckpt = torch.load(path, map_location='cpu')
+        proxy = LatentProxy(latent_channels=latent_channels, hidden=hidden)
+        proxy.load_state_dict(ckpt['state_dict'])
+        print(f"-> latent proxy of '{model_id}' loaded from '{path}', mse: {ckpt['mse']:.4f}")
+    else:
+        proxy, err = fit_latent_proxy(vae, LatentProxy(latent_channels=latent_channels, hidden=hidden),
+                                      steps=fit_steps, device=device)
+        tmp_path = path.with_suffix('.tmp')
+        torch.save({'state_dict': proxy.state_dict(), 'mse': err, 'model_id': str(model_id)}, tmp_path)
+        tmp_path.replace(path)
+        print(f"-> latent proxy of '{model_id}' fitted in {fit_steps} steps, mse: {err:.4f}, saved in '{path}'")
+    return proxy.to(device).eval().requires_grad_(False)
+
+
+class LatentProxySwitch:
+    """
+    Sets `pipe.latent_proxy` for the SDS/VPSD pipelines: the proxy for most of the schedule,
+    the exact VAE encoder (None) for the last `exact_last` fraction of the steps.
+
+    Examples:
+        >>> switch = LatentProxySwitch.from_cfg(x_cfg.sds.get('latent_proxy', None), x_cfg.model_id, pipe, device)
+        >>> while step < total_step:
+        ...     switch.update(step, total_step)
+        ...     pipe.score_distillation_sampling(...)
+    """
+
+    def __init__(self, pipe, proxy: Optional[LatentProxy] = None, exact_last: float = 0.1):
+        self.pipe = pipe
+        self.proxy = proxy
+        self.exact_last = exact_last
+        self.pipe.latent_proxy = None
+
+    @classmethod
+    def from_cfg(cls, cfg, model_id: AnyStr, pipe, device: torch.device = "cuda"):
+        if cfg is None or not cfg.get('enable', False):
+            return cls(pipe)
+        proxy = load_latent_proxy(model_id, pipe.vae,
+                                  cache_dir=cfg.get('cache_dir', './checkpoint/latent_proxy'),
+                                  device=device,
+                                  fit_steps=cfg.get('fit_steps', 1000))
+        return cls(pipe, proxy, exact_last=cfg.get('exact_last', 0.1))
+
+    def update(self, step: int, total_step: int) -> bool:
+        """True if the proxy is used at `step`"""
+        use = self.proxy is not None and step < int(total_step * (1 - self.exact_last))
+        self.pipe.latent_proxy = self.proxy if use else None
+        return use
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# Author: ximing xing
+# Copyright (c) 2025, XiMing Xing
+# License: MPL-2.0 License
+# Description: stage-aware model offloading
+
+import pathlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import AnyStr, Dict, Iterable, List, Optional, Union
+
+import torch
+
+
+class StageOffloadManager:
+    """
+    Keep only the modules required by the current pipeline stage on the compute device.
+
+    Each stage declares the names of the modules it needs. On `enter(stage)`, the modules
+    that are not needed are moved to the offload target and the needed ones are moved back.
+    Modules that are never registered are left untouched.
+
+    offload targets:
+        - 'cpu': idle modules are kept in (pinned, if CUDA is used) host memory.
+        - 'disk': idle modules are saved to `offload_dir` and replaced by meta tensors,
+                  they are reloaded on demand.
+
+    Examples:
+        >>> offload = StageOffloadManager(device, target='cpu')
+        >>> offload.register('unet', pipe.unet)
+        >>> offload.declare_stage('live', needs=[])
+        >>> offload.declare_stage('sds', needs=['unet'])
+        >>> with offload.stage('live'):
+        ...     run_live()
+        >>> offload.prefetch('sds')  # start moving the unet back in the background
+    """
+
+    def __init__(self,
+                 device: torch.device,
+                 target: str = 'cpu',
+                 offload_dir: Optional[Union[AnyStr, pathlib.Path]] = None,
+                 verbose: bool = True):
+        assert target in ['cpu', 'disk'], f"offload target must be 'cpu' or 'disk', but got {target}."
+        if target == 'disk':
+            assert offload_dir is not None, "the disk offload requires `offload_dir`."
+
+        self.device = torch.device(device)
+        self.target = target
+        self.offload_dir = pathlib.Path(offload_dir) if offload_dir is not None else None
+        if self.offload_dir is not None:
+            self.offload_dir.mkdir(parents=True, exist_ok=True)
+        self.verbose = verbose
+
+        self.modules: Dict[str, torch.nn.Module] = {}
+        self.stages: Dict[str, List[str]] = {}
+        self.resident: Dict[str, bool] = {}
+        self.current_stage: Optional[str] = None
+
+        # the disk snapshot of a frozen module only has to be written once
+        self._saved_frozen: Dict[str, bool] = {}
+        # background loading of modules
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: Dict[str, Future] = {}
+
+    @property
+    def pin_memory(self) -> bool:
+        return self.device.type == 'cuda'
+
+    def register(self, name: str, module: Optional[torch.nn.Module]):
+        if module is None:
+            return
+        self.modules[name] = module
+        self.resident[name] = True
+
+    def register_pipeline(self, pipeline, prefix: str = ''):
+        """register all `torch.nn.Module` components of a diffusers pipeline"""
+        for name, component in pipeline.components.items():
+            if isinstance(component, torch.nn.Module):
+                self.register(f"{prefix}{name}", component)
+
+    def declare_stage(self, stage: str, needs: Iterable[str]):
+        needs = list(needs)
+        unknown = [n for n in needs if n not in self.modules]
+        assert len(unknown) == 0, f"stage '{stage}' needs unregistered modules: {unknown}"
+        self.stages[stage] = needs
+
+    def enter(self, stage: str):
+        assert stage in self.stages, f"undeclared stage: {stage}"
+        needs = self.stages[stage]
+        for name in self.modules:
+            if name not in needs:
+                self._offload(name)
+        for name in needs:
+            self._onload(name)
+        self.current_stage = stage
+        if self.verbose:
+            print(f"-> offload: enter stage '{stage}', resident modules: {self.resident_modules}")
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    @contextmanager
+    def stage(self, stage: str, restore: bool = True):
+        """run a block in `stage`, then go back to the previous stage if `restore`"""
+        previous = self.current_stage
+        self.enter(stage)
+        try:
+            yield self
+        finally:
+            if restore and previous is not None:
+                self.enter(previous)
+
+    def prefetch(self, stage: str):
+        """start moving the modules needed by `stage` to the device without blocking"""
+        for name in self.stages[stage]:
+            if self.resident[name] or name in self._pending:
+                continue
+            if self.target == 'cpu':
+                # with pinned host memory, the copy overlaps with the computation
+                self.modules[name].to(self.device, non_blocking=True)
+                self.resident[name] = True
+            else:
+                self._pending[name] = self._executor.submit(self._read_snapshot, name)
+
+    @property
+    def resident_modules(self) -> List[str]:
+        return [name for name, on_device in self.resident.items() if on_device]
+
+    def close(self, cleanup: bool = True, restore: bool = True):
+        """
+        Release the background loader and the disk snapshots.
+        With `restore`, every module is moved back to the device first, so that shared (warm) pipelines
+        are left usable; otherwise the disk-offloaded modules stay on the `meta` device.
+        """
+        if restore:
+            for name in self.modules:
+                self._onload(name)
+        self._executor.shutdown(wait=True)
+        if cleanup and self.target == 'disk':
+            for name in self.modules:
+                self._snapshot_path(name).unlink(missing_ok=True)
+
+    def _offload(self, name: str):
+        if not self.resident[name]:
+            return
+        module = self.modules[name]
+        if self.target == 'cpu':
+            module.to('cpu')
+            if self.pin_memory:
+                for t in _module_tensors(module).values():
+                    t.data = t.data.pin_memory()
+        else:
+            frozen = all(not p.requires_grad for p in module.parameters())
+            if not (frozen and self._saved_frozen.get(name, False)):
+                tensors = {k: t.detach().cpu() for k, t in _module_tensors(module).items()}
+                torch.save(tensors, self._snapshot_path(name))
+                self._saved_frozen[name] = frozen
+            module.to('meta')
+        self.resident[name] = False
+
+    def _onload(self, name: str):
+        if self.resident[name] and name not in self._pending:
+            return
+        module = self.modules[name]
+        if self.target == 'cpu':
+            module.to(self.device)
+        else:
+            future = self._pending.pop(name, None)
+            tensors = future.result() if future is not None else self._read_snapshot(name)
+            module.to_empty(device=self.device)
+            current = _module_tensors(module)
+            with torch.no_grad():
+                for k, t in tensors.items():
+                    current[k].copy_(t, non_blocking=True)
+        self.resident[name] = True
+
+    def _snapshot_path(self, name: str) -> pathlib.Path:
+        return self.offload_dir / f"{name}.pt"
+
+    def _read_snapshot(self, name: str) -> Dict[str, torch.Tensor]:
+        fpath = self._snapshot_path(name)
+        try:  # memory-mapped loading, torch >= 2.1
+            tensors = torch.load(fpath, map_location='cpu', mmap=True)
+        except TypeError:
+            tensors = torch.load(fpath, map_location='cpu')
+        if self.pin_memory:
+            tensors = {k: t.pin_memory() for k, t in tensors.items()}
+        return tensors
+
+
+def _module_tensors(module: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    """all parameters and buffers (including the non-persistent ones) of a module"""
+    tensors = dict(module.named_parameters())
+    tensors.update(dict(module.named_buffers()))
+    return tensors
@@ -3,10 +3,13 @@
 # Author: XiMing Xing
 # Description:
 
-from .loss import Loss
-from .painter_params import Painter, PainterOptimizer
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = [
-    'Painter', 'PainterOptimizer',
-    'Loss'
-]
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={'u2net_utils'},
+    submod_attrs={
+        'loss': ['Loss', 'SweepLoss'],
+        'painter_params': ['Painter', 'PainterOptimizer']
+    }
+)
@@ -1,11 +1,14 @@
 import collections
 import re
+from typing import Dict, List, Tuple
 
 import clip
 import torch
 import torch.nn as nn
 from torchvision import models, transforms
 
+from pytorch_svgrender.libs.engine.precision import fp32
+
 
 def compute_grad_norm_losses(losses_dict, model, points_mlp):
     '''
@@ -175,6 +178,105 @@ class Loss(nn.Module):
         return losses_dict, losses_dict_copy, losses_dict_original_detach
 
 
+class SweepLoss(nn.Module):
+    """
+    `Loss` of several abstraction levels of the same target.
+    The sketches of the levels are stacked in one batch together with the target, so the CLIP models are
+    loaded once and the target is encoded once per step for all the levels.
+
+    A level is a dict with its `layer_weights` (12 floats), `width_optim`, `ratio_loss` and `gradnorm`.
+    """
+
+    def __init__(self, args, mask=None, device="cpu"):
+        super(SweepLoss, self).__init__()
+        self.args = args
+        self.device = device
+        self.width_loss_weight = args.width_loss_weight
+
+        self.loss_mapper = {}
+        if args.clip_conv_loss:
+            self.loss_mapper["clip_conv_loss"] = CLIPConvLoss(args, mask, device)
+        if args.clip_mask_loss:
+            self.loss_mapper["clip_mask_loss"] = CLIPmaskLoss(args, mask, device)
+        self.width_loss = WidthLoss(args, device)
+        self.mse_loss = nn.MSELoss()
+        self.new_weights = {}
+
+    def forward(self, sketches, targets, levels: List[Dict], renderers, mode="train") -> List[Tuple[Dict, Dict]]:
+        """
+        sketches: (L, C, H, W), one per level, targets: (1, C, H, W)
+        Returns the weighted losses and the detached original losses of each level.
+        """
+        layer_weights = torch.tensor([level["layer_weights"] for level in levels],
+                                     dtype=torch.float32, device=self.device)
+        clip_terms = {}
+        for clip_loss in self.loss_mapper.values():
+            clip_terms.update(clip_loss.forward_levels(sketches, targets, layer_weights, mode))
+
+        outputs = []
+        for i, (level, renderer) in enumerate(zip(levels, renderers)):
+            losses_dict, loss_coeffs, clip_loss_names = {}, {}, []
+            for name, values in clip_terms.items():
+                digits = re.findall(r'\d+', name)
+                if len(digits) == 0:  # the fc term, weighted by `clip_fc_loss_weight` already
+                    losses_dict[name], loss_coeffs[name] = values[i], 1.
+                elif level["layer_weights"][int(digits[0])]:
+                    losses_dict[name] = values[i]
+                    loss_coeffs[name] = level["layer_weights"][int(digits[0])]
+                    clip_loss_names.append(name)
+            # as `Loss.update_losses_to_apply`, the width loss follows the switch of the width optimization
+            if level["width_optim"] and (mode == "eval" or renderer.width_optim):
+                losses_dict["width_loss"] = self.width_loss(renderer.get_widths(),
+                                                            renderer.get_strokes_in_canvas_count())
+                loss_coeffs["width_loss"] = self.width_loss_weight
+
+            losses_dict_original = losses_dict.copy()
+            if level["gradnorm"]:
+                if mode == "train":
+                    model = renderer.get_width_mlp() if level["width_optim"] else renderer.get_mlp()
+                    self.new_weights[i] = compute_grad_norm_losses(losses_dict, model, renderer.get_mlp())
+                for key in losses_dict.keys():
+                    losses_dict[key] = losses_dict[key] * self.new_weights[i][key]
+
+            for key in losses_dict.keys():
+                if loss_coeffs[key] == 0:
+                    losses_dict[key] = losses_dict[key].detach() * loss_coeffs[key]
+                else:
+                    losses_dict[key] = losses_dict[key] * loss_coeffs[key]
+
+            if level["ratio_loss"] and "width_loss" in losses_dict_original:
+                loss_clip = sum(losses_dict_original[name] for name in clip_loss_names) * level["ratio_loss"]
+                losses_dict["ratio_loss"] = self.mse_loss(losses_dict_original["width_loss"], loss_clip).mean()
+
+            outputs.append((losses_dict, {k: v.detach() for k, v in losses_dict_original.items()}))
+        return outputs
+
+
+def level_layers(conv_features, n_levels, loss_type):
+    """
+    The distances (n_levels,) of each layer between the sketches and the target of a stacked batch,
+    the batch is a sequence of augmentations of (sketch_1, ..., sketch_n, target).
+    """
+    distances = []
+    for features in conv_features:
+        features = features.reshape(-1, n_levels + 1, *features.shape[1:])
+        x, y = features[:, :n_levels], features[:, n_levels:].expand_as(features[:, :n_levels])
+        if loss_type == "L2":
+            d = torch.square(x - y)
+        elif loss_type == "L1":
+            d = torch.abs(x - y)
+        else:  # Cos, over the same dim as `cos_layers`
+            d = 1 - torch.cosine_similarity(x, y, dim=2)
+        distances.append(d.transpose(0, 1).reshape(n_levels, -1).mean(dim=1))
+    return distances
+
+
+def level_fc(fc_features, n_levels):
+    fc_features = fc_features.reshape(-1, n_levels + 1, fc_features.shape[-1])
+    x, y = fc_features[:, :n_levels], fc_features[:, n_levels:].expand_as(fc_features[:, :n_levels])
+    return (1 - torch.cosine_similarity(x, y, dim=-1)).mean(dim=0)
+
+
 class CLIPLoss(torch.nn.Module):
     def __init__(self, args, device):
         super(CLIPLoss, self).__init__()
@@ -251,6 +353,7 @@ class LPIPS(torch.nn.Module):
         self.feature_extractor = LPIPS._FeatureExtractor(
             pretrained, pre_relu).to(device)
 
+    @fp32
     def _l2_normalize_features(self, x, eps=1e-10):
         nrm = torch.sqrt(torch.sum(x * x, dim=1, keepdim=True))
         return x / (nrm + eps)
@@ -649,6 +752,39 @@ class CLIPConvLoss(torch.nn.Module):
         self.counter += 1
         return conv_loss_dict
 
+    def forward_levels(self, sketches, target, layer_weights, mode="train"):
+        """
+        The losses of a batch of sketches [L, C, H, W] to one target [1, C, H, W], each of shape (L,).
+        All sketches and the target go through the same augmentations, in a single forward pass.
+        """
+        n_levels = sketches.shape[0]
+        x = sketches.to(self.device)
+        if self.apply_mask:
+            x = x * self.mask
+        batch = torch.cat([x, target.to(self.device)])
+
+        augs = [self.normalize_transform(batch)]
+        if mode == "train":
+            for n in range(self.num_augs):
+                augs.append(self.augment_trans(batch))
+        batch = torch.cat(augs, dim=0)
+
+        if self.clip_model_name.startswith("RN"):
+            fc_features, conv_features = self.forward_inspection_clip_resnet(batch.contiguous())
+        else:
+            fc_features, conv_features = self.visual_encoder(batch, mode=mode)
+
+        conv_loss = level_layers(conv_features, n_levels, self.clip_conv_loss_type)
+        conv_loss_dict = {}
+        for layer in range(layer_weights.shape[1]):
+            if layer_weights[:, layer].any():
+                conv_loss_dict[f"clip_{self.loss_log_name}_l{layer}"] = conv_loss[layer]
+        if self.clip_fc_loss_weight:
+            conv_loss_dict[f"fc_{self.loss_log_name}"] = level_fc(fc_features, n_levels) * self.clip_fc_loss_weight
+
+        self.counter += 1
+        return conv_loss_dict
+
     def forward_inspection_clip_resnet(self, x):
         def stem(m, x):
             for conv, bn in [(m.conv1, m.bn1), (m.conv2, m.bn2), (m.conv3, m.bn3)]:
@@ -787,6 +923,40 @@ class CLIPmaskLoss(torch.nn.Module):
         self.counter += 1
         return conv_loss_dict
 
+    def forward_levels(self, sketches, target, layer_weights, mode="train"):
+        """
+        The losses of a batch of sketches [L, C, H, W] to one target [1, C, H, W], each of shape (L,),
+        weighted by the `layer_weights` (L, 12) of the levels as `forward` does.
+        The sketches, the target and the mask go through the same augmentations.
+        """
+        n_levels = sketches.shape[0]
+        batch = torch.cat([sketches.to(self.device), target.to(self.device), self.mask])
+        augs = [batch]
+        if mode == "train":
+            for n in range(self.num_augs):
+                augs.append(self.augment_trans(batch))
+        batch = torch.stack(augs)  # (A, L + 2, C, H, W)
+
+        xs, ys = batch[:, :n_levels], batch[:, n_levels:n_levels + 1]
+        masks = (batch[:, n_levels + 1:] >= 0.5).float()
+        if self.apply_mask and "latent" not in self.loss_mask:
+            xs = xs * masks
+        batch = self.normalize_transform(torch.cat([xs, ys], dim=1).flatten(0, 1))
+        if "latent" in self.loss_mask:
+            masks = masks.expand(-1, n_levels + 1, -1, -1, -1).flatten(0, 1)
+        else:
+            masks = None
+
+        fc_features, conv_features = self.visual_encoder(batch, masks, mode=mode)
+        conv_loss = level_layers(conv_features, n_levels, self.clip_conv_loss_type)
+        conv_loss_dict = {}
+        for layer in range(layer_weights.shape[1]):
+            if layer_weights[:, layer].any():
+                conv_loss_dict[f"clip_vit_l{layer}"] = conv_loss[layer] * layer_weights[:, layer]
+
+        self.counter += 1
+        return conv_loss_dict
+
     def forward_inspection_clip_resnet(self, x):
         def stem(m, x):
             for conv, bn in [(m.conv1, m.bn1), (m.conv2, m.bn2), (m.conv3, m.bn3)]:
@@ -8,6 +8,7 @@ import torch
 import torch.nn as nn
 from PIL import Image
 from pytorch_svgrender.model_helper import DiffVGState
+from pytorch_svgrender.libs.engine.precision import fp32
 from pytorch_svgrender.libs.modules.edge_map.DoG import XDoG
 from pytorch_svgrender.painter.clipasso import modified_clip as clip
 from pytorch_svgrender.painter.clipasso.grad_cam import gradCAM
@@ -24,7 +25,8 @@ class Painter(DiffVGState):
             canvas_size: int = 224,
             device=None,
             target_im=None,
-            mask=None
+            mask=None,
+            saliency=None
     ):
         super(Painter, self).__init__(device, print_timing=diffvg_cfg.print_timing,
                                       canvas_width=canvas_size, canvas_height=canvas_size)
@@ -60,10 +62,13 @@ class Painter(DiffVGState):
 
         self.text_target = method_cfg.text_target  # for clip gradients
         self.saliency_clip_model = method_cfg.saliency_clip_model
-        self.image2clip_input = self.clip_preprocess(target_im)
-
         self.mask = mask
-        self.attention_map = self.set_attention_map() if self.attention_init else None
+        # the painters of the same target can share its CLIP input and attention map, see `get_saliency`
+        if saliency is not None:
+            self.image2clip_input, self.attention_map = saliency['image2clip_input'], saliency['attention_map']
+        else:
+            self.image2clip_input = self.clip_preprocess(target_im)
+            self.attention_map = self.set_attention_map() if self.attention_init else None
 
         self.thresh = self.set_attention_threshold_map() if self.attention_init else None
         self.strokes_counter = 0  # counts the number of calls to "get_path"
@@ -147,6 +152,7 @@ class Painter(DiffVGState):
                 self.shape_groups.append(path_group)
             self.optimize_flag = [True for i in range(len(self.shapes))]
 
+    @fp32
     def get_image(self, mode="train"):
         if self.mlp_train:
             img = self.mlp_pass(mode)
@@ -579,6 +585,9 @@ class Painter(DiffVGState):
     def get_attn(self):
         return self.attention_map
 
+    def get_saliency(self):
+        return {'image2clip_input': self.image2clip_input, 'attention_map': self.attention_map}
+
     def get_thresh(self):
         return self.thresh
 
@@ -73,6 +73,15 @@ def get_ratios_dict(path_to_initial_sketches, folder_name_l, layer, im_name, obj
     path_li = path_to_initial_sketches / folder_name_l / f"{folder_name_l}_seed{seed}"
     best_iter, loss_clip_layer = get_clip_loss2(path_li, layer, object_or_background)
     best_lclip_layer = loss_clip_layer[best_iter]
+    ratios_li, new_xs_layer_l = get_ratios(best_lclip_layer, step_size_l, num_ratios)
+    ratios_str = ratios_to_str(ratios_li)
+    xs_layer_l_str = ratios_to_str(new_xs_layer_l)
+    print(f"layer {layer} r_1_k {1 / best_lclip_layer} \n new {ratios_str} \n x {xs_layer_l_str}\n")
+    return ratios_str
+
+
+def get_ratios(best_lclip_layer, step_size_l, num_ratios=8):
+    """the ratios of the simplicity levels of a layer, from the CLIP loss of its initial sketch"""
     r_1_k = 1 / best_lclip_layer
 
     # get the next ratios by jumping by 2
@@ -93,10 +102,7 @@ def get_ratios_dict(path_to_initial_sketches, folder_name_l, layer, im_name, obj
     new_xs_layer_l = np.linspace(start_, end - step_size + start_, num_steps)
     # print("new_xs_layer_l", new_xs_layer_l)
     ratios_li = func(new_xs_layer_l, *popt)
-    ratios_str = ratios_to_str(ratios_li)
-    xs_layer_l_str = ratios_to_str(new_xs_layer_l)
-    print(f"layer {layer} r_1_k {r_1_k} \n new {ratios_str} \n x {xs_layer_l_str}\n")
-    return ratios_str
+    return ratios_li, new_xs_layer_l
 
 
 def read_svg(path_svg, multiply=0, resize_obj=False, params=None, opacity=1, device=None):
@@ -3,10 +3,13 @@
 # Author: XiMing Xing
 # Description:
 
-from .painter_params import Painter, PainterOptimizer
-from .loss import Loss
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = [
-    'Painter', 'PainterOptimizer',
-    'Loss'
-]
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={'modified_clip'},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'loss': ['Loss']
+    }
+)
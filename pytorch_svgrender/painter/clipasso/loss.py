@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 from torchvision import models, transforms
 
+from pytorch_svgrender.libs.engine.precision import fp32
+
 from . import modified_clip as clip
 
 
@@ -150,6 +152,7 @@ class LPIPS(torch.nn.Module):
         self.augment_trans = transforms.Compose(augemntations)
         self.feature_extractor = LPIPS._FeatureExtractor(pretrained, pre_relu).to(device)
 
+    @fp32
     def _l2_normalize_features(self, x, eps=1e-10):
         nrm = torch.sqrt(torch.sum(x * x, dim=1, keepdim=True))
         return x / (nrm + eps)
@@ -9,6 +9,7 @@ from torch.optim.lr_scheduler import LambdaLR
 from torchvision import transforms
 
 from pytorch_svgrender.model_helper import DiffVGState
+from pytorch_svgrender.libs.engine.precision import fp32
 from pytorch_svgrender.libs.modules.edge_map.DoG import XDoG
 from .grad_cam import gradCAM
 from . import modified_clip as clip
@@ -105,6 +106,7 @@ class Painter(DiffVGState):
 
         return img
 
+    @fp32
     def get_image(self):
         img = self.render_warp()
         opacity = img[:, :, 3:4]
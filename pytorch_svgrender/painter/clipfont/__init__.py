@@ -4,5 +4,14 @@
 # Copyright (c) 2023, XiMing Xing.
 # License: MIT License
 
-from .template import imagenet_templates, compose_text_with_templates
-from .painter_params import Painter, PainterOptimizer
\ No newline at end of file
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'template': ['imagenet_templates', 'compose_text_with_templates'],
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'patch_sampler': ['PatchSampler']
+    }
+)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: batched random patches for the CLIPFont directional losses
+# Copyright (c) 2023, XiMing Xing.
+# License: MIT License
+
+import torch
+import torch.nn.functional as F
+
+
+class PatchSampler:
+    """
+    Random crops followed by a random perspective, all drawn at once and extracted
+    with a single `grid_sample` straight to the CLIP resolution.
+
+    It replaces `RandomCrop` -> `RandomPerspective(fill=0)` -> `Resize(512)` applied to
+    one crop at a time. As with `RandomCrop(padding=p, fill=255)`, the part of a crop
+    outside the image is white, the part of the output outside the warped crop is black.
+    """
+
+    def __init__(self, out_size: int = 224, distortion_scale: float = 0.3):
+        self.out_size = out_size
+        self.distortion_scale = distortion_scale
+
+    def _perspectives(self, n: int, device: torch.device) -> torch.Tensor:
+        """homographies (n, 3, 3) from the output square to the crop square, both in [0, 1]^2"""
+        half = self.distortion_scale / 2
+        src = torch.tensor([[0., 0.], [1., 0.], [1., 1.], [0., 1.]], device=device).expand(n, 4, 2)
+        # the corners of the output move inwards, like `RandomPerspective.get_params`
+        jitter = torch.rand(n, 4, 2, device=device) * half
+        inward = torch.tensor([[1., 1.], [-1., 1.], [-1., -1.], [1., -1.]], device=device)
+        dst = src + jitter * inward
+
+        # solve the 8 unknowns of the homography mapping `dst` to `src`
+        u, v = dst[..., 0], dst[..., 1]
+        x, y = src[..., 0], src[..., 1]
+        zeros, ones = torch.zeros_like(u), torch.ones_like(u)
+        rows_x = torch.stack([u, v, ones, zeros, zeros, zeros, -u * x, -v * x], dim=-1)
+        rows_y = torch.stack([zeros, zeros, zeros, u, v, ones, -u * y, -v * y], dim=-1)
+        A = torch.cat([rows_x, rows_y], dim=1)  # (n, 8, 8)
+        b = torch.cat([x, y], dim=1).unsqueeze(-1)  # (n, 8, 1)
+        h = torch.linalg.solve(A, b).squeeze(-1)
+        return torch.cat([h, ones[:, :1]], dim=-1).reshape(n, 3, 3)
+
+    @torch.no_grad()
+    def sample_grid(self, n: int, height: int, width: int, crop_size: int, padding: int = 0,
+                    device: torch.device = None):
+        """the sampling grid (n, S, S, 2) of `grid_sample` and the mask of the warped crops"""
+        S = self.out_size
+        # crop boxes, in pixels of the image padded by `padding`
+        x0 = torch.randint(0, width + 2 * padding - crop_size + 1, (n,), device=device).float() - padding
+        y0 = torch.randint(0, height + 2 * padding - crop_size + 1, (n,), device=device).float() - padding
+
+        # pixel centers of the output, then through the perspective into the crop square
+        t = (torch.arange(S, device=device).float() + 0.5) / S
+        gy, gx = torch.meshgrid(t, t, indexing='ij')
+        pts = torch.stack([gx, gy, torch.ones_like(gx)], dim=-1).reshape(1, -1, 3)  # (1, S*S, 3)
+        warped = pts @ self._perspectives(n, device).transpose(1, 2)  # (n, S*S, 3)
+        crop_xy = warped[..., :2] / warped[..., 2:]
+        mask = ((crop_xy >= 0) & (crop_xy <= 1)).all(dim=-1).reshape(n, 1, S, S)
+
+        # crop square -> image pixels -> normalized coordinates of `grid_sample`
+        px = x0[:, None] + crop_xy[..., 0] * crop_size
+        py = y0[:, None] + crop_xy[..., 1] * crop_size
+        grid = torch.stack([2 * px / width - 1, 2 * py / height - 1], dim=-1).reshape(n, S, S, 2)
+        return grid, mask
+
+    def __call__(self, img: torch.Tensor, n: int, crop_size: int, padding: int = 0) -> torch.Tensor:
+        """`n` patches (n, C, S, S) of the image (1, C, H, W), differentiable w.r.t. `img`"""
+        _, C, H, W = img.shape
+        grid, mask = self.sample_grid(n, H, W, crop_size, padding, device=img.device)
+        # zeros padding of `img - 1` fills the outside of the image with white
+        patches = F.grid_sample((img - 1).expand(n, C, H, W), grid,
+                                mode='bilinear', padding_mode='zeros', align_corners=False) + 1
+        return patches * mask.to(patches.dtype)
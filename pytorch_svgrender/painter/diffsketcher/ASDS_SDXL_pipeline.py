@@ -17,6 +17,7 @@ from diffusers.pipelines.stable_diffusion_xl import StableDiffusionXLPipeline
 
 from pytorch_svgrender.token2attn.attn_control import AttentionStore
 from pytorch_svgrender.token2attn.ptp_utils import text_under_image, view_images
+from pytorch_svgrender.model_helper.diffusers_helper import expand_to_batch
 
 
 class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
@@ -387,7 +388,8 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
             )
         augment_compose = transforms.Compose(augment_list)
 
-        return augment_compose(sketch)
+        # sample the augmentation independently for each image of the batch
+        return torch.cat([augment_compose(x_i) for x_i in sketch.split(1)], dim=0)
 
     def score_distillation_sampling(self,
                                     pred_rgb: torch.Tensor,
@@ -413,7 +415,12 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
         original_size = original_size or (height, width)
         target_size = target_size or (height, width)
 
-        batch_size = 1 if isinstance(prompt, str) else len(prompt)
+        # a batch may stack several independent jobs, one (negative) prompt per sample
+        batch_size = pred_rgb.shape[0]
+        prompt = expand_to_batch(prompt, batch_size)
+        prompt_2 = expand_to_batch(prompt_2, batch_size)
+        negative_prompt = expand_to_batch(negative_prompt, batch_size)
+        negative_prompt_2 = expand_to_batch(negative_prompt_2, batch_size)
 
         num_train_timesteps = self.scheduler.config.num_train_timesteps
         min_step = int(num_train_timesteps * t_range[0])
@@ -456,7 +463,8 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
             )
 
         # timestep ~ U(0.05, 0.95) to avoid very high/low noise level
-        t = torch.randint(min_step, max_step + 1, [1], dtype=torch.long, device=self.device)
+        t = torch.randint(min_step, max_step + 1, [batch_size], dtype=torch.long, device=self.device)
+        t_model_input = torch.cat([t] * 2) if do_classifier_free_guidance else t
 
         # 7. Prepare added time ids & embeddings
         add_text_embeddings = pooled_text_embeddings
@@ -484,7 +492,7 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
             added_cond_kwargs = {"text_embeds": add_text_embeddings, "time_ids": add_time_ids}
             noise_pred = self.unet(
                 latent_model_input,
-                t,
+                t_model_input,
                 encoder_hidden_states=text_embeddings,
                 added_cond_kwargs=added_cond_kwargs
             ).sample
@@ -495,7 +503,7 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
             noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_pos - noise_pred_uncond)
 
         # w(t), sigma_t^2
-        w = (1 - alphas[t])
+        w = (1 - alphas[t]).view(-1, 1, 1, 1)
         grad = grad_scale * w * (noise_pred - noise)
         grad = torch.nan_to_num(grad)
 
@@ -559,11 +567,13 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
                             res: int,
                             from_where: List[str],
                             select: int = 0,
-                            save_path=None):
+                            save_path=None,
+                            attention_maps: torch.Tensor = None):
         tokens = self.tokenizer.encode(prompts[select])
         decoder = self.tokenizer.decode
         # shape: [res ** 2, res ** 2, seq_len]
-        attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, True, select)
+        if attention_maps is None:  # otherwise, reuse the cached maps
+            attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, True, select)
 
         images = []
         for i in range(len(tokens)):
@@ -587,8 +597,10 @@ class Token2AttnMixinASDSSDXLPipeline(StableDiffusionXLPipeline):
                                 img_size: int = 224,
                                 max_com=10,
                                 select: int = 0,
-                                save_path: AnyStr = None):
-        attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, False, select)
+                                save_path: AnyStr = None,
+                                attention_maps: torch.Tensor = None):
+        if attention_maps is None:  # otherwise, reuse the cached maps
+            attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, False, select)
         attention_maps = attention_maps.numpy().reshape((res ** 2, res ** 2))
         # shape: [res ** 2, res ** 2]
         u, s, vh = np.linalg.svd(attention_maps - np.mean(attention_maps, axis=1, keepdims=True))
@@ -17,6 +17,7 @@ from diffusers.pipelines.stable_diffusion import StableDiffusionPipeline
 
 from pytorch_svgrender.token2attn.attn_control import AttentionStore
 from pytorch_svgrender.token2attn.ptp_utils import text_under_image, view_images
+from pytorch_svgrender.model_helper.diffusers_helper import expand_to_batch
 
 
 class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
@@ -219,11 +220,16 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
         return StableDiffusionPipelineOutput(images=image, nsfw_content_detected=has_nsfw_concept)
 
     def encode_(self, images):
-        images = (2 * images - 1).clamp(-1.0, 1.0)  # images: [B, 3, H, W]
+        # the learned proxy of the encoder, if the owner set one (see `model_helper.latent_proxy`)
+        latent_proxy = getattr(self, 'latent_proxy', None)
+        if latent_proxy is not None:
+            latents = latent_proxy(images).to(images.dtype)
+        else:
+            images = (2 * images - 1).clamp(-1.0, 1.0)  # images: [B, 3, H, W]
 
-        # encode images
-        latents = self.vae.encode(images).latent_dist.sample()
-        latents = self.vae.config.scaling_factor * latents
+            # encode images
+            latents = self.vae.encode(images).latent_dist.sample()
+            latents = self.vae.config.scaling_factor * latents
 
         # scale the initial noise by the standard deviation required by the scheduler
         latents = latents * self.scheduler.init_noise_sigma
@@ -250,7 +256,8 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
             )
         augment_compose = transforms.Compose(augment_list)
 
-        return augment_compose(sketch)
+        # sample the augmentation independently for each image of the batch
+        return torch.cat([augment_compose(x_i) for x_i in sketch.split(1)], dim=0)
 
     def score_distillation_sampling(self,
                                     pred_rgb: torch.Tensor,
@@ -267,6 +274,11 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
         max_step = int(num_train_timesteps * t_range[1])
         alphas = self.scheduler.alphas_cumprod.to(self.device)  # for convenience
 
+        # a batch may stack several independent jobs, one (negative) prompt per sample
+        batch_size = pred_rgb.shape[0]
+        prompt = expand_to_batch(prompt, batch_size)
+        negative_prompt = expand_to_batch(negative_prompt, batch_size)
+
         # sketch augmentation
         pred_rgb_a = self.S_aug(pred_rgb, crop_size, augments)
 
@@ -286,7 +298,8 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
         )
 
         # timestep ~ U(0.02, 0.98) to avoid very high/low noise level
-        t = torch.randint(min_step, max_step + 1, [1], dtype=torch.long, device=self.device)
+        t = torch.randint(min_step, max_step + 1, [batch_size], dtype=torch.long, device=self.device)
+        t_model_input = torch.cat([t] * 2) if do_classifier_free_guidance else t
 
         # predict the noise residual with unet, stop gradient
         with torch.no_grad():
@@ -295,7 +308,7 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
             latents_noisy = self.scheduler.add_noise(latents, noise, t)
             # pred noise
             latent_model_input = torch.cat([latents_noisy] * 2) if do_classifier_free_guidance else latents_noisy
-            noise_pred = self.unet(latent_model_input, t, encoder_hidden_states=text_embeddings).sample
+            noise_pred = self.unet(latent_model_input, t_model_input, encoder_hidden_states=text_embeddings).sample
 
         # perform guidance (high scale from paper!)
         if do_classifier_free_guidance:
@@ -303,7 +316,7 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
             noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_pos - noise_pred_uncond)
 
         # w(t), sigma_t^2
-        w = (1 - alphas[t])
+        w = (1 - alphas[t]).view(-1, 1, 1, 1)
         grad = grad_scale * w * (noise_pred - noise)
         grad = torch.nan_to_num(grad)
 
@@ -367,11 +380,13 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
                             res: int,
                             from_where: List[str],
                             select: int = 0,
-                            save_path=None):
+                            save_path=None,
+                            attention_maps: torch.Tensor = None):
         tokens = self.tokenizer.encode(prompts[select])
         decoder = self.tokenizer.decode
         # shape: [res ** 2, res ** 2, seq_len]
-        attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, True, select)
+        if attention_maps is None:  # otherwise, reuse the cached maps
+            attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, True, select)
 
         images = []
         for i in range(len(tokens)):
@@ -395,8 +410,10 @@ class Token2AttnMixinASDSPipeline(StableDiffusionPipeline):
                                 img_size: int = 224,
                                 max_com=10,
                                 select: int = 0,
-                                save_path: AnyStr = None):
-        attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, False, select)
+                                save_path: AnyStr = None,
+                                attention_maps: torch.Tensor = None):
+        if attention_maps is None:  # otherwise, reuse the cached maps
+            attention_maps = self.aggregate_attention(prompts, attention_store, res, from_where, False, select)
         attention_maps = attention_maps.numpy().reshape((res ** 2, res ** 2))
         # shape: [res ** 2, res ** 2]
         u, s, vh = np.linalg.svd(attention_maps - np.mean(attention_maps, axis=1, keepdims=True))
@@ -3,12 +3,14 @@
 # Author: XiMing Xing
 # Description:
 
-from .painter_params import Painter, SketchPainterOptimizer
-from .ASDS_pipeline import Token2AttnMixinASDSPipeline
-from .ASDS_SDXL_pipeline import Token2AttnMixinASDSSDXLPipeline
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = [
-    'Painter', 'SketchPainterOptimizer',
-    'Token2AttnMixinASDSPipeline',
-    'Token2AttnMixinASDSSDXLPipeline'
-]
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'SketchPainterOptimizer'],
+        'ASDS_pipeline': ['Token2AttnMixinASDSPipeline'],
+        'ASDS_SDXL_pipeline': ['Token2AttnMixinASDSSDXLPipeline']
+    }
+)
@@ -37,9 +37,10 @@ def paths_pruning(svg_file_path, output_file_path, opacity_delta=0.2):
             if opacity is not None and float(opacity) < median_opacity:
                 paths_to_remove.append(path)
 
-        # Remove paths from the root element
+        # Remove paths from their parent element
+        parents = {child: parent for parent in root.iter() for child in parent}
         for path in paths_to_remove:
-            path.set('stroke-opacity', '0')
+            parents[path].remove(path)
 
         print(f"n_path: {len(paths)}, "
               f"opacity_thresh: {median_opacity}, "
@@ -4,4 +4,12 @@
 # Copyright (c) 2024, XiMing Xing.
 # License: MPL-2.0 License
 
-from .painter_params import Painter, PainterOptimizer
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer']
+    }
+)
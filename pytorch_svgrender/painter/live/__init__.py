@@ -3,5 +3,13 @@
 # Author: XiMing Xing
 # Description:
 
-from .painter_params import Painter, PainterOptimizer
-from .xing_loss import xing_loss_fn
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'xing_loss': ['xing_loss_fn']
+    }
+)
@@ -33,7 +33,8 @@ class Painter(DiffVGState):
             device: torch.device = None,
     ):
         super(Painter, self).__init__(device, print_timing=diffvg_cfg.print_timing,
-                                      canvas_width=canvas_size, canvas_height=canvas_size)
+                                      canvas_width=canvas_size, canvas_height=canvas_size,
+                                      frozen_layer_cache=diffvg_cfg.get('frozen_layer_cache', False))
 
         self.target_img = target_img
 
@@ -75,6 +76,9 @@ class Painter(DiffVGState):
 
     def init_image(self, num_paths=0):
         self.cur_shapes, self.cur_shape_groups = [], []
+        if self.frozen_layer_cache and len(self.shapes) > 0:
+            # the previous paths can be rendered once, under the new ones
+            self.freeze_shapes()
 
         for i in range(num_paths):
             path, color_ref = self.get_path()
@@ -438,3 +442,7 @@ class PainterOptimizer:
 
     def get_lr(self):
         return self.optimizer.param_groups[0]['lr']
+
+    def parameters(self):
+        """the tensors updated by `step_`"""
+        return [p for group in self.optimizer.param_groups for p in group['params']]
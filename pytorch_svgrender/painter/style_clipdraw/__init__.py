@@ -3,10 +3,13 @@
 # Author: XiMing Xing
 # Description:
 
-from .painter_params import Painter, PainterOptimizer
-from .strotss import StyleLoss, VGG16Extractor, sample_indices
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = [
-    'Painter', 'PainterOptimizer',
-    'StyleLoss', 'VGG16Extractor', 'sample_indices'
-]
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'strotss': ['StyleLoss', 'VGG16Extractor', 'sample_indices', 'load_style_statistics']
+    }
+)
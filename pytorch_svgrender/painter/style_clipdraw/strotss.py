@@ -4,11 +4,16 @@
 # Description:
 
 import math
+import hashlib
+from pathlib import Path
+from typing import Dict, Union
 
 import torch
 import torch.nn as nn
 import torchvision
-import numpy as np
+from torch.utils.checkpoint import checkpoint
+
+from pytorch_svgrender.libs.engine.precision import fp32
 
 
 class VGG16Extractor(nn.Module):
@@ -40,19 +45,15 @@ class VGG16Extractor(nn.Module):
         feat = self.forward_base(x)
         return feat
 
-    def forward_samples_hypercolumn(self, X, samps=100):
+    def forward_samples_hypercolumn(self, X, samps=100, generator=None):
         feat = self.forward(X)
 
-        xx, xy = np.meshgrid(np.arange(X.shape[2]), np.arange(X.shape[3]))
-        xx = np.expand_dims(xx.flatten(), 1)
-        xy = np.expand_dims(xy.flatten(), 1)
-        xc = np.concatenate([xx, xy], 1)
-
-        samples = min(samps, xc.shape[0])
-
-        np.random.shuffle(xc)
-        xx = xc[:samples, 0]
-        yy = xc[:samples, 1]
+        # `samps` distinct (x, y) locations in a random order
+        num_locations = X.shape[2] * X.shape[3]
+        samples = min(samps, num_locations)
+        perm = torch.randperm(num_locations, generator=generator)[:samples].to(X.device)
+        xx = torch.div(perm, X.shape[3], rounding_mode='floor')
+        yy = perm % X.shape[3]
 
         feat_samples = []
         for i in range(len(feat)):
@@ -61,13 +62,13 @@ class VGG16Extractor(nn.Module):
 
             # hack to detect lower resolution
             if i > 0 and feat[i].size(2) < feat[i - 1].size(2):
-                xx = xx / 2.0
-                yy = yy / 2.0
+                xx = torch.div(xx, 2, rounding_mode='floor')
+                yy = torch.div(yy, 2, rounding_mode='floor')
 
-            xx = np.clip(xx, 0, layer_feat.shape[2] - 1).astype(np.int32)
-            yy = np.clip(yy, 0, layer_feat.shape[3] - 1).astype(np.int32)
+            xx = xx.clamp(0, layer_feat.shape[2] - 1)
+            yy = yy.clamp(0, layer_feat.shape[3] - 1)
 
-            features = layer_feat[:, :, xx[range(samples)], yy[range(samples)]]
+            features = layer_feat[:, :, xx, yy]
             feat_samples.append(features.clone().detach())
 
         feat = torch.cat(feat_samples, 1)
@@ -75,15 +76,27 @@ class VGG16Extractor(nn.Module):
 
 
 class StyleLoss:
+    """
+    STROTSS style loss: relaxed EMD of the hypercolumns, moment matching and palette matching.
+
+    The style side only depends on the style image, `style_statistics` computes it once
+    (see `load_style_statistics` to persist it). The distance matrices of the relaxed EMD
+    are computed `chunk_size` rows at a time and recomputed in backward.
+    """
+
+    feat_max = 3 + 2 * 64 + 128 * 2 + 256 * 3 + 512 * 2  # (sum of all extracted channels)
+
+    def __init__(self, num_locations: int = 1024, chunk_size: int = 256):
+        self.num_locations = num_locations
+        self.chunk_size = chunk_size
 
     def spatial_feature_extract(self, feat_result, feat_content, xx, xy):
         l2, l3 = [], []
-        device = feat_result[0].device
+        xx, xy = xx.float(), xy.float()
 
         # for each extracted layer
         for i in range(len(feat_result)):
             fr = feat_result[i]
-            fc = feat_content[i]
 
             # hack to detect reduced scale
             if i > 0 and feat_result[i - 1].size(2) > feat_result[i].size(2):
@@ -91,42 +104,41 @@ class StyleLoss:
                 xy = xy / 2.0
 
             # go back to ints and get residual
-            xxm = np.floor(xx).astype(np.float32)
+            xxm = torch.floor(xx)
             xxr = xx - xxm
 
-            xym = np.floor(xy).astype(np.float32)
+            xym = torch.floor(xy)
             xyr = xy - xym
 
             # do bilinear resample
-            w00 = torch.from_numpy((1. - xxr) * (1. - xyr)).float().view(1, 1, -1, 1).to(device)
-            w01 = torch.from_numpy((1. - xxr) * xyr).float().view(1, 1, -1, 1).to(device)
-            w10 = torch.from_numpy(xxr * (1. - xyr)).float().view(1, 1, -1, 1).to(device)
-            w11 = torch.from_numpy(xxr * xyr).float().view(1, 1, -1, 1).to(device)
+            w00 = ((1. - xxr) * (1. - xyr)).view(1, 1, -1, 1)
+            w01 = ((1. - xxr) * xyr).view(1, 1, -1, 1)
+            w10 = (xxr * (1. - xyr)).view(1, 1, -1, 1)
+            w11 = (xxr * xyr).view(1, 1, -1, 1)
 
-            xxm = np.clip(xxm.astype(np.int32), 0, fr.size(2) - 1)
-            xym = np.clip(xym.astype(np.int32), 0, fr.size(3) - 1)
+            xxm = xxm.long().clamp(0, fr.size(2) - 1)
+            xym = xym.long().clamp(0, fr.size(3) - 1)
+            xxp = (xxm + 1).clamp(0, fr.size(2) - 1)
+            xyp = (xym + 1).clamp(0, fr.size(3) - 1)
 
             s00 = xxm * fr.size(3) + xym
-            s01 = xxm * fr.size(3) + np.clip(xym + 1, 0, fr.size(3) - 1)
-            s10 = np.clip(xxm + 1, 0, fr.size(2) - 1) * fr.size(3) + (xym)
-            s11 = np.clip(xxm + 1, 0, fr.size(2) - 1) * fr.size(3) + np.clip(xym + 1, 0, fr.size(3) - 1)
-
-            fr = fr.view(1, fr.size(1), fr.size(2) * fr.size(3), 1)
-            fr = fr[:, :, s00, :].mul_(w00).add_(fr[:, :, s01, :].mul_(w01)).add_(fr[:, :, s10, :].mul_(w10)).add_(
-                fr[:, :, s11, :].mul_(w11))
+            s01 = xxm * fr.size(3) + xyp
+            s10 = xxp * fr.size(3) + xym
+            s11 = xxp * fr.size(3) + xyp
 
-            fc = fc.view(1, fc.size(1), fc.size(2) * fc.size(3), 1)
-            fc = fc[:, :, s00, :].mul_(w00).add_(fc[:, :, s01, :].mul_(w01)).add_(fc[:, :, s10, :].mul_(w10)).add_(
-                fc[:, :, s11, :].mul_(w11))
+            def resample(f):
+                f = f.view(1, f.size(1), f.size(2) * f.size(3), 1)
+                return f[:, :, s00, :] * w00 + f[:, :, s01, :] * w01 + f[:, :, s10, :] * w10 + f[:, :, s11, :] * w11
 
-            l2.append(fr)
-            l3.append(fc)
+            l2.append(resample(fr))
+            # the pipelines pass the same features as result and content
+            l3.append(l2[-1] if feat_content is feat_result else resample(feat_content[i]))
 
         x_st = torch.cat([li.contiguous() for li in l2], 1)
-        c_st = torch.cat([li.contiguous() for li in l3], 1)
+        c_st = x_st if feat_content is feat_result else torch.cat([li.contiguous() for li in l3], 1)
 
-        xx = torch.from_numpy(xx).view(1, 1, x_st.size(2), 1).float().to(device)
-        yy = torch.from_numpy(xy).view(1, 1, x_st.size(2), 1).float().to(device)
+        xx = xx.view(1, 1, x_st.size(2), 1)
+        yy = xy.view(1, 1, x_st.size(2), 1)
 
         x_st = torch.cat([x_st, xx, yy], 1)
         c_st = torch.cat([c_st, xx, yy], 1)
@@ -160,73 +172,106 @@ class StyleLoss:
             M = torch.sqrt(self.pairwise_distances_sq_l2(x, y))
         return M
 
-    def style_loss(self, X, Y):
+    def _as_rows(self, X):
+        """(1, d, N, 1) -> (N, d), in YUV for the palette"""
         d = X.shape[1]
-
-        if d == 3:
-            X = self.rgb_to_yuv(X.transpose(0, 1).contiguous().view(d, -1)).transpose(0, 1)
-            Y = self.rgb_to_yuv(Y.transpose(0, 1).contiguous().view(d, -1)).transpose(0, 1)
-        else:
-            X = X.transpose(0, 1).contiguous().view(d, -1).transpose(0, 1)
-            Y = Y.transpose(0, 1).contiguous().view(d, -1).transpose(0, 1)
-
-        # Relaxed EMD
-        CX_M = self.distmat(X, Y, cos_d=True)
-
+        X = X.transpose(0, 1).contiguous().view(d, -1)
         if d == 3:
-            CX_M = CX_M + self.distmat(X, Y, cos_d=False)
+            X = self.rgb_to_yuv(X)
+        return X.transpose(0, 1)
+
+    def style_side(self, Y) -> Dict[str, torch.Tensor]:
+        """the terms of the relaxed EMD that only depend on the style features"""
+        Y = self._as_rows(Y)
+        return {'Y': Y, 'Y_unit': Y / Y.norm(dim=1, keepdim=True), 'Y_sq': (Y ** 2).sum(1)}
+
+    def _remd_chunk(self, X, Y, Y_unit, Y_sq):
+        # cosine distance, plus the L2 distance of the palette
+        M = 1. - torch.mm(X / X.norm(dim=1, keepdim=True), Y_unit.t())
+        if X.shape[1] == 3:
+            sq_l2 = (X ** 2).sum(1, keepdim=True) + Y_sq.view(1, -1) - 2.0 * torch.mm(X, Y.t())
+            M = M + torch.sqrt(torch.clamp(sq_l2, 1e-5, 1e5) / X.size(1))
+        return M.min(1)[0], M.min(0)[0]
 
-        m1, m1_inds = CX_M.min(1)
-        m2, m2_inds = CX_M.min(0)
-
-        remd = torch.max(m1.mean(), m2.mean())
+    def style_loss(self, X, Y):
+        """Relaxed EMD, `Y` is the style features or their `style_side`"""
+        Y = Y if isinstance(Y, dict) else self.style_side(Y)
+        X = self._as_rows(X)
+
+        m1, m2 = [], None
+        chunked = X.shape[0] > self.chunk_size
+        for X_c in X.split(self.chunk_size):
+            if chunked and X_c.requires_grad:
+                row_min, col_min = checkpoint(self._remd_chunk, X_c, Y['Y'], Y['Y_unit'], Y['Y_sq'],
+                                              use_reentrant=False)
+            else:
+                row_min, col_min = self._remd_chunk(X_c, Y['Y'], Y['Y_unit'], Y['Y_sq'])
+            m1.append(row_min)
+            m2 = col_min if m2 is None else torch.minimum(m2, col_min)
+
+        remd = torch.max(torch.cat(m1).mean(), m2.mean())
 
         return remd
 
-    def moment_loss(self, X, Y, moments=[1, 2]):
-        loss = 0.
-        X = X.squeeze().t()
+    @staticmethod
+    def moments(Y):
         Y = Y.squeeze().t()
-
-        mu_x = torch.mean(X, 0, keepdim=True)
         mu_y = torch.mean(Y, 0, keepdim=True)
+        Y_c = Y - mu_y
+        Y_cov = torch.mm(Y_c.t(), Y_c) / (Y.shape[0] - 1)
+        return mu_y, Y_cov
+
+    def moment_loss(self, X, Y, moments=[1, 2]):
+        """`Y` is the style features or their `moments`"""
+        loss = 0.
+        mu_x, X_cov = self.moments(X)
+        mu_y, Y_cov = Y if isinstance(Y, tuple) else self.moments(Y)
         mu_d = torch.abs(mu_x - mu_y).mean()
 
         if 1 in moments:
             loss = loss + mu_d
 
         if 2 in moments:
-            X_c = X - mu_x
-            Y_c = Y - mu_y
-            X_cov = torch.mm(X_c.t(), X_c) / (X.shape[0] - 1)
-            Y_cov = torch.mm(Y_c.t(), Y_c) / (Y.shape[0] - 1)
-
             D_cov = torch.abs(X_cov - Y_cov).mean()
             loss = loss + D_cov
 
         return loss
 
+    @torch.no_grad()
+    def style_statistics(self, feat_style) -> Dict:
+        """everything the loss needs from the style features, computed once per style image"""
+        d = feat_style.shape[1]
+        spatial_style = feat_style.view(1, d, -1, 1)
+        mu_y, Y_cov = self.moments(spatial_style)
+        return {
+            'remd': self.style_side(spatial_style[:, :self.feat_max, :, :]),
+            'palette': self.style_side(spatial_style[:, :3, :, :]),
+            'moments': (mu_y, Y_cov),
+        }
+
+    @fp32
     def forward(self, feat_result, feat_content, feat_style, indices, content_weight, moment_weight=1.0):
+        """
+        `feat_style` is the sampled style features, or their `style_statistics`.
+        The VGG features may come from autocast, the distances and covariances are computed in fp32.
+        """
+        style = feat_style if isinstance(feat_style, dict) else self.style_statistics(feat_style)
+
         # spatial feature extract
-        num_locations = 1024
         spatial_result, spatial_content = self.spatial_feature_extract(
-            feat_result, feat_content, indices[0][:num_locations], indices[1][:num_locations]
+            feat_result, feat_content, indices[0][:self.num_locations], indices[1][:self.num_locations]
         )
 
         # loss_content = content_loss(spatial_result, spatial_content)
 
-        d = feat_style.shape[1]
-        spatial_style = feat_style.view(1, d, -1, 1)
-        feat_max = 3 + 2 * 64 + 128 * 2 + 256 * 3 + 512 * 2  # (sum of all extracted channels)
-
-        loss_remd = self.style_loss(spatial_result[:, :feat_max, :, :], spatial_style[:, :feat_max, :, :])
+        loss_remd = self.style_loss(spatial_result[:, :self.feat_max, :, :], style['remd'])
 
         loss_moment = self.moment_loss(spatial_result[:, :-2, :, :],
-                                       spatial_style,
+                                       style['moments'],
                                        moments=[1, 2])  # -2 is so that it can fit?
         # palette matching
         content_weight_frac = 1. / max(content_weight, 1.)
-        loss_moment += content_weight_frac * self.style_loss(spatial_result[:, :3, :, :], spatial_style[:, :3, :, :])
+        loss_moment += content_weight_frac * self.style_loss(spatial_result[:, :3, :, :], style['palette'])
 
         loss_style = loss_remd + moment_weight * loss_moment
         # print(f'Style: {loss_style.item():.3f}, Content: {loss_content.item():.3f}')
@@ -236,18 +281,66 @@ class StyleLoss:
         return loss_total
 
 
-def sample_indices(feat_content, feat_style):
+def sample_indices(feat_content, feat_style=None, generator=None, shuffle=True):
+    """
+    A strided grid of the feature locations, on the device of `feat_content`.
+    With `shuffle`, the x and y coordinates are permuted independently.
+    """
     const = 128 ** 2  # 32k or so
     big_size = feat_content.shape[2] * feat_content.shape[3]  # num feaxels
+    device = feat_content.device
 
     stride_x = int(max(math.floor(math.sqrt(big_size // const)), 1))
-    offset_x = np.random.randint(stride_x)
+    offset_x = int(torch.randint(stride_x, (1,)))
     stride_y = int(max(math.ceil(math.sqrt(big_size // const)), 1))
-    offset_y = np.random.randint(stride_y)
-    xx, xy = np.meshgrid(
-        np.arange(feat_content.shape[2])[offset_x::stride_x],
-        np.arange(feat_content.shape[3])[offset_y::stride_y]
+    offset_y = int(torch.randint(stride_y, (1,)))
+    xx, xy = torch.meshgrid(
+        torch.arange(feat_content.shape[2], device=device)[offset_x::stride_x],
+        torch.arange(feat_content.shape[3], device=device)[offset_y::stride_y],
+        indexing='xy'
     )
     xx = xx.flatten()
     xy = xy.flatten()
+    if shuffle:
+        xx = xx[torch.randperm(xx.shape[0], device=device, generator=generator)]
+        xy = xy[torch.randperm(xy.shape[0], device=device, generator=generator)]
     return xx, xy
+
+
+@torch.no_grad()
+def load_style_statistics(extractor: VGG16Extractor,
+                          style_loss: StyleLoss,
+                          style_img: torch.Tensor,
+                          cache_dir: Union[str, Path] = None,
+                          samps: int = 1000,
+                          n_draws: int = 5) -> Dict:
+    """
+    Sample the hypercolumns of the style image (`n_draws` x `samps` locations) and compute their
+    `style_statistics`. The draws are seeded by the content of the (preprocessed) style image,
+    so the statistics are reproducible and can be saved in `cache_dir`, one file per style image.
+    """
+    style_cpu = style_img.detach().float().cpu().contiguous()
+    digest = hashlib.sha1(style_cpu.numpy().tobytes())
+    digest.update(f"{extractor.space}-{samps}-{n_draws}-{style_loss.feat_max}".encode())
+    digest = digest.hexdigest()
+
+    cache_file = Path(cache_dir) / f"{digest}.pt" if cache_dir is not None else None
+    if cache_file is not None and cache_file.exists():
+        stats = torch.load(cache_file, map_location=style_img.device)
+        stats['moments'] = tuple(stats['moments'])
+        return stats
+
+    generator = torch.Generator().manual_seed(int(digest[:15], 16))
+    feat_style = torch.cat([
+        extractor.forward_samples_hypercolumn(style_img, samps=samps, generator=generator)
+        for _ in range(n_draws)
+    ], dim=2)
+    stats = style_loss.style_statistics(feat_style)
+    stats['feat_style'] = feat_style
+
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix('.tmp')
+        torch.save(stats, tmp_file)
+        tmp_file.replace(cache_file)
+    return stats
@@ -42,10 +42,13 @@ class VectorizedParticleSDSPipeline(torch.nn.Module):
         }
 
         # load pretrained model
+        # the LoRA attention processors of a single-unet phi model are installed in place,
+        # the pipeline must not be shared with later jobs
         self.sd_pipeline = init_StableDiffusion_pipeline(
             args.x.model_id,
             custom_pipeline=StableDiffusionPipeline,
             custom_scheduler=DDIMScheduler,
+            keep_warm=not (guidance_cfg.phi_model == 'lora' and guidance_cfg.phi_single),
             **pipe_kwargs
         )
         # disable grads
@@ -70,8 +73,8 @@ class VectorizedParticleSDSPipeline(torch.nn.Module):
                 unet_ = init_diffusers_unet(args.x.model_id, **pipe_kwargs)
 
             # set correct LoRA layers
-            self.unet_phi, phi_model_layers = self.set_lora_layers(unet_)
-            self.phi_params = list(phi_model_layers.parameters())
+            self.unet_phi, self.phi_layers = self.set_lora_layers(unet_)
+            self.phi_params = list(self.phi_layers.parameters())
             self.lora_cross_attention_kwargs = {"scale": guidance_cfg.lora_attn_scale} \
                 if guidance_cfg.use_attn_scale else {}
             self.vae_phi = self.vae
@@ -98,6 +101,7 @@ class VectorizedParticleSDSPipeline(torch.nn.Module):
                 ),
                 cross_attention_dim=self.unet.config.cross_attention_dim
             ).to(device)
+            self.phi_layers = self.unet_phi
             self.phi_params = list(self.unet_phi.parameters())
             self.vae_phi = self.vae
             # reset lora
@@ -135,6 +139,14 @@ class VectorizedParticleSDSPipeline(torch.nn.Module):
         self.text_embeddings_phi = None
         self.t = None
 
+    def phi_state_dict(self):
+        """the trained weights of the phi model, LoRA layers or `unet_simple`"""
+        return {k: v.detach().float().cpu() for k, v in self.phi_layers.state_dict().items()}
+
+    def load_phi_state_dict(self, state_dict):
+        dtype = self.phi_params[0].dtype
+        self.phi_layers.load_state_dict({k: v.to(dtype) for k, v in state_dict.items()})
+
     def set_lora_layers(self, unet):  # set correct lora layers
         lora_attn_procs = {}
         for name in unet.attn_processors.keys():
@@ -350,6 +362,10 @@ class VectorizedParticleSDSPipeline(torch.nn.Module):
                              output_type=output_type)
 
     def encode2latent(self, images):
+        # the learned proxy of the encoder, if the owner set one (see `model_helper.latent_proxy`)
+        latent_proxy = getattr(self, 'latent_proxy', None)
+        if latent_proxy is not None:
+            return latent_proxy(images).to(images.dtype)
         images = (2 * images - 1).clamp(-1.0, 1.0)  # images: [B, 3, H, W]
         # encode images
         latents = self.vae.encode(images).latent_dist.sample()
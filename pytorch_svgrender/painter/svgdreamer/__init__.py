@@ -4,6 +4,15 @@
 # Copyright (c) 2024, XiMing Xing.
 # License: MPL-2.0 License
 
-from .painter_params import Painter, PainterOptimizer
-from .loss import channel_saturation_penalty_loss
-from .VPSD_pipeline import VectorizedParticleSDSPipeline
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'loss': ['channel_saturation_penalty_loss'],
+        'VPSD_pipeline': ['VectorizedParticleSDSPipeline'],
+        'phi_warm_start': ['PhiWarmStart']
+    }
+)
@@ -16,7 +16,7 @@ import pydiffvg
 import torch
 from torch.optim.lr_scheduler import LambdaLR
 
-from pytorch_svgrender.model_helper import DiffVGState
+from pytorch_svgrender.model_helper import DiffVGState, SVGScene, clone_scene
 from pytorch_svgrender.libs.solver.optim import get_optimizer
 from pytorch_svgrender.utils import AnyPath
 
@@ -35,6 +35,7 @@ class Painter(DiffVGState):
             trainable_bg: bool = False,
             stroke_width: int = 3,
             path_svg=None,
+            init_scene: SVGScene = None,
             device=None,
     ):
         super().__init__(device, print_timing=diffvg_cfg.print_timing,
@@ -55,6 +56,7 @@ class Painter(DiffVGState):
         self.color_ref = None
 
         self.path_svg = path_svg
+        self.init_scene = init_scene  # the scene handed over by the previous stage
         self.optimize_flag = []
 
         self.strokes_counter = 0  # counts the number of calls to "get_path"
@@ -162,10 +164,16 @@ class Painter(DiffVGState):
                     self.cur_shape_groups.append(path_group)
         else:
             num_paths_exists = 0
-            if self.path_svg is not None and pathlib.Path(self.path_svg).exists():
+            scene = None
+            if self.init_scene is not None:
+                print("-> init svg from the previous stage ...")
+                scene = clone_scene(self.init_scene)
+            elif self.path_svg is not None and pathlib.Path(self.path_svg).exists():
                 print(f"-> init svg from `{self.path_svg}` ...")
+                scene = self.load_svg(self.path_svg)
 
-                self.canvas_width, self.canvas_height, self.shapes, self.shape_groups = self.load_svg(self.path_svg)
+            if scene is not None:
+                self.canvas_width, self.canvas_height, self.shapes, self.shape_groups = scene
                 # if you want to add more strokes to existing ones and optimize on all of them
                 num_paths_exists = len(self.shapes)
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: warm start of the VPSD phi model from the weights of previous runs
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import json
+import hashlib
+import pathlib
+from typing import Optional, Tuple
+
+import omegaconf
+import torch
+
+from pytorch_svgrender.utils.prompt_index import PromptIndex, PromptWarmStart
+
+
+class PhiWarmStart(PromptWarmStart):
+    """
+    Start the phi model (LoRA layers or `unet_simple`) from the one trained for the closest previous prompt.
+
+    The weights are indexed per (model_id, phi model config), by the CLIP text embedding of the prompt
+    and restricted to the same style. If no prompt is similar enough, the latest weights of the style are
+    used when `style_fallback` is set, whatever their prompt.
+
+    Examples:
+        >>> phi_warm_start = PhiWarmStart(cfg.x.phi_warm_start, style, device, model_id, cfg.x.guidance)
+        >>> hit = phi_warm_start.lookup(prompt)  # None, or (similarity, weights path)
+        >>> ...
+        >>> phi_warm_start.register(prompt, phi_weights_path)
+    """
+
+    def __init__(self,
+                 cfg: omegaconf.DictConfig,
+                 style: str,
+                 device: torch.device,
+                 model_id: str,
+                 guidance_cfg: omegaconf.DictConfig):
+        import hydra
+
+        key = self.phi_key(model_id, guidance_cfg)
+        index = PromptIndex(pathlib.Path(hydra.utils.to_absolute_path(cfg.index_dir)) / f"{model_id}-{key}",
+                            cfg.clip_model,
+                            file_dir="phi")
+        super().__init__(cfg, method=style, device=device, index=index)
+
+    @staticmethod
+    def phi_key(model_id: str, guidance_cfg: omegaconf.DictConfig) -> str:
+        """the weights are only interchangeable between runs of the same model and phi model"""
+        payload = {
+            'model_id': model_id,
+            'phi_model': guidance_cfg.phi_model,
+            'phi_single': guidance_cfg.phi_single,
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def lookup(self, prompt: str) -> Optional[Tuple[float, str]]:
+        if len(self.index) == 0:
+            return None
+        results = self.index.search(self.embed(prompt), k=len(self.index), method=self.method)
+        if len(results) == 0:
+            return None
+        similarity, entry = results[0]
+        if similarity >= self.cfg.min_similarity:
+            return similarity, entry[self.index.file_dir]
+        if self.cfg.get('style_fallback', False):
+            # the most recent weights of the style
+            order = {e['id']: i for i, e in enumerate(self.index.entries)}
+            similarity, entry = max(results, key=lambda r: order[r[1]['id']])
+            return similarity, entry[self.index.file_dir]
+        return None
+
+    def shorten_warmup(self, warmup_steps: int) -> int:
+        return int(warmup_steps * self.cfg.get('warmup_ratio', 1.0))
@@ -12,6 +12,8 @@ from torchvision import transforms
 from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
 from diffusers.pipelines.stable_diffusion import StableDiffusionPipeline
 
+from pytorch_svgrender.model_helper.diffusers_helper import expand_to_batch
+
 
 class LSDSPipeline(StableDiffusionPipeline):
     r"""
@@ -202,24 +204,39 @@ class LSDSPipeline(StableDiffusionPipeline):
 
         return StableDiffusionPipelineOutput(images=image, nsfw_content_detected=has_nsfw_concept)
 
-    def encode_(self, images):
-        images = (2 * images - 1).clamp(-1.0, 1.0)  # images: [B, 3, H, W]
+    def encode_(self, images, generator: List[torch.Generator] = None):
+        # the learned proxy of the encoder, if the owner set one (see `model_helper.latent_proxy`)
+        latent_proxy = getattr(self, 'latent_proxy', None)
+        if latent_proxy is not None:
+            latents = latent_proxy(images).to(images.dtype)
+        else:
+            images = (2 * images - 1).clamp(-1.0, 1.0)  # images: [B, 3, H, W]
 
-        # encode images
-        latents = self.vae.encode(images).latent_dist.sample()
-        latents = self.vae.config.scaling_factor * latents
+            # encode images
+            latents = self.vae.encode(images).latent_dist.sample(generator=generator)
+            latents = self.vae.config.scaling_factor * latents
 
         # scale the initial noise by the standard deviation required by the scheduler
         latents = latents * self.scheduler.init_noise_sigma
 
         return latents
 
-    def x_augment(self, x: torch.Tensor, img_size: int = 512):
+    def x_augment(self, x: torch.Tensor, img_size: int = 512, generator: List[torch.Generator] = None):
         augment_compose = transforms.Compose([
             transforms.RandomPerspective(distortion_scale=0.5, p=0.7),
             transforms.RandomCrop(size=(img_size, img_size), pad_if_needed=True, padding_mode='reflect')
         ])
-        return augment_compose(x)
+        # sample the augmentation independently for each image of the batch
+        if generator is None:
+            return torch.cat([augment_compose(x_i) for x_i in x.split(1)], dim=0)
+
+        # torchvision transforms draw from the global RNG: seed it from the generator of each sample
+        augmented = []
+        for x_i, g in zip(x.split(1), generator):
+            with torch.random.fork_rng(devices=[]):
+                torch.manual_seed(int(torch.randint(2 ** 62, (1,), generator=g)))
+                augmented.append(augment_compose(x_i))
+        return torch.cat(augmented, dim=0)
 
     def score_distillation_sampling(self,
                                     pred_rgb: torch.Tensor,
@@ -230,21 +247,33 @@ class LSDSPipeline(StableDiffusionPipeline):
                                     input_augment: bool = True,
                                     as_latent: bool = False,
                                     grad_scale: float = 1,
-                                    t_range: Union[List[float], Tuple[float]] = (0.05, 0.95)):
+                                    t_range: Union[List[float], Tuple[float]] = (0.05, 0.95),
+                                    generator: List[torch.Generator] = None):
+        """
+        `generator`: one (CPU) generator per sample, the timestep, the noise and the augmentation of
+        each sample are then drawn from its own generator instead of the global RNG.
+        """
         num_train_timesteps = self.scheduler.config.num_train_timesteps
         min_step = int(num_train_timesteps * t_range[0])
         max_step = int(num_train_timesteps * t_range[1])
         alphas = self.scheduler.alphas_cumprod.to(self.device)  # for convenience
 
+        # a batch may stack several independent jobs, one (negative) prompt per sample
+        batch_size = pred_rgb.shape[0]
+        prompt = expand_to_batch(prompt, batch_size)
+        negative_prompt = expand_to_batch(negative_prompt, batch_size)
+        if generator is not None:
+            assert len(generator) == batch_size, f"got {len(generator)} generators for {batch_size} samples."
+
         # input augmentation
-        pred_rgb_a = self.x_augment(pred_rgb, im_size) if input_augment else pred_rgb
+        pred_rgb_a = self.x_augment(pred_rgb, im_size, generator) if input_augment else pred_rgb
 
         # the input is intercepted to im_size x im_size and then fed to the vae
         if as_latent:
             latents = F.interpolate(pred_rgb_a, (64, 64), mode='bilinear', align_corners=False) * 2 - 1
         else:
             # encode image into latents with vae, requires grad!
-            latents = self.encode_(pred_rgb_a)
+            latents = self.encode_(pred_rgb_a, generator)
 
         #  Encode input prompt
         num_images_per_prompt = 1  # the number of images to generate per prompt
@@ -256,16 +285,25 @@ class LSDSPipeline(StableDiffusionPipeline):
         )
 
         # timestep ~ U(0.05, 0.95) to avoid very high/low noise level
-        t = torch.randint(min_step, max_step + 1, [1], dtype=torch.long, device=self.device)
+        if generator is None:
+            t = torch.randint(min_step, max_step + 1, [batch_size], dtype=torch.long, device=self.device)
+        else:
+            t = torch.cat([torch.randint(min_step, max_step + 1, [1], dtype=torch.long, generator=g)
+                           for g in generator]).to(self.device)
+        t_model_input = torch.cat([t] * 2) if do_classifier_free_guidance else t
 
         # predict the noise residual with unet, stop gradient
         with torch.no_grad():
             # add noise
-            noise = torch.randn_like(latents)
+            if generator is None:
+                noise = torch.randn_like(latents)
+            else:
+                noise = torch.stack([torch.randn(latents.shape[1:], generator=g) for g in generator])
+                noise = noise.to(device=latents.device, dtype=latents.dtype)
             latents_noisy = self.scheduler.add_noise(latents, noise, t)
             # pred noise
             latent_model_input = torch.cat([latents_noisy] * 2) if do_classifier_free_guidance else latents_noisy
-            noise_pred = self.unet(latent_model_input, t, encoder_hidden_states=text_embeddings).sample
+            noise_pred = self.unet(latent_model_input, t_model_input, encoder_hidden_states=text_embeddings).sample
 
         # perform guidance (high scale from paper!)
         if do_classifier_free_guidance:
@@ -273,7 +311,7 @@ class LSDSPipeline(StableDiffusionPipeline):
             noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_pos - noise_pred_uncond)
 
         # w(t), sigma_t^2
-        w = (1 - alphas[t])
+        w = (1 - alphas[t]).view(-1, 1, 1, 1)
         grad = grad_scale * w * (noise_pred - noise)
         grad = torch.nan_to_num(grad)
 
@@ -3,7 +3,15 @@
 # Author: XiMing Xing
 # Description:
 
-from .LSDS_pipeline import LSDSPipeline
-from .LSDS_SDXL_pipeline import LSDSSDXLPipeline
-from .painter_params import Painter, PainterOptimizer
-from .loss import channel_saturation_penalty_loss
\ No newline at end of file
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'LSDS_pipeline': ['LSDSPipeline'],
+        'LSDS_SDXL_pipeline': ['LSDSSDXLPipeline'],
+        'painter_params': ['Painter', 'PainterOptimizer'],
+        'loss': ['channel_saturation_penalty_loss']
+    }
+)
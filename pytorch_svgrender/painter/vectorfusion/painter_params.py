@@ -6,7 +6,7 @@ import math
 import copy
 import random
 import pathlib
-from typing import Dict
+from typing import Dict, List
 
 from shapely.geometry.polygon import Polygon
 import omegaconf
@@ -16,7 +16,7 @@ import pydiffvg
 import torch
 from torch.optim.lr_scheduler import LambdaLR
 
-from pytorch_svgrender.model_helper import DiffVGState
+from pytorch_svgrender.model_helper import DiffVGState, SVGScene, clone_scene
 from pytorch_svgrender.libs.solver.optim import get_optimizer
 from pytorch_svgrender.utils import AnyPath
 
@@ -35,10 +35,12 @@ class Painter(DiffVGState):
             trainable_bg: bool = False,
             stroke_width: int = 3,
             path_svg=None,
+            init_scene: SVGScene = None,
             device=None,
     ):
         super().__init__(device, print_timing=diffvg_cfg.print_timing,
-                         canvas_width=canvas_size, canvas_height=canvas_size)
+                         canvas_width=canvas_size, canvas_height=canvas_size,
+                         frozen_layer_cache=diffvg_cfg.get('frozen_layer_cache', False))
 
         self.style = style
 
@@ -55,6 +57,7 @@ class Painter(DiffVGState):
         self.color_ref = None
 
         self.path_svg = path_svg
+        self.init_scene = init_scene  # the scene handed over by the previous stage
         self.optimize_flag = []
 
         self.strokes_counter = 0  # counts the number of calls to "get_path"
@@ -95,6 +98,9 @@ class Painter(DiffVGState):
             # Noting: if multi stages training than add new strokes on existing ones
             # don't optimize on previous strokes
             self.optimize_flag = [False for i in range(len(self.shapes))]
+            if self.frozen_layer_cache:
+                # the previous strokes can be rendered once, under the new ones
+                self.freeze_shapes()
             for i in range(num_paths):
                 if self.style == 'iconography':
                     path = self.get_path()
@@ -161,11 +167,22 @@ class Painter(DiffVGState):
                     self.shape_groups.append(path_group)
                     self.cur_shape_groups.append(path_group)
         else:
+            if self.frozen_layer_cache and len(self.shapes) > 0:
+                # a new path group of the LIVE stage, the previous groups can be rendered once, under it
+                self.freeze_shapes()
+            else:
+                self.unfreeze_shapes()
             num_paths_exists = 0
-            if self.path_svg is not None and pathlib.Path(self.path_svg).exists():
+            scene = None
+            if self.init_scene is not None:
+                print("-> init svg from the previous stage ...")
+                scene = clone_scene(self.init_scene)
+            elif self.path_svg is not None and pathlib.Path(self.path_svg).exists():
                 print(f"-> init svg from `{self.path_svg}` ...")
+                scene = self.load_svg(self.path_svg)
 
-                self.canvas_width, self.canvas_height, self.shapes, self.shape_groups = self.load_svg(self.path_svg)
+            if scene is not None:
+                self.canvas_width, self.canvas_height, self.shapes, self.shape_groups = scene
                 # if you want to add more strokes to existing ones and optimize on all of them
                 num_paths_exists = len(self.shapes)
 
@@ -776,6 +793,14 @@ class PainterOptimizer:
         if self.point_scheduler is not None:
             self.point_scheduler.step()
 
+    def parameters(self) -> List[torch.Tensor]:
+        """the tensors updated by `step_`"""
+        params = []
+        for optimizer in [self.point_optimizer, self.color_optimizer, self.width_optimizer, self.bg_optimizer]:
+            if optimizer is not None:
+                params.extend(p for group in optimizer.param_groups for p in group['params'])
+        return params
+
     def zero_grad_(self):
         if self.point_optimizer is not None:
             self.point_optimizer.zero_grad()
@@ -1,104 +1,155 @@
-from typing import Dict
-
-import torch
-import torch.nn as nn
-from torch.nn import functional as nnf
-import torchvision
-import numpy as np
-from scipy.spatial import Delaunay
-from shapely.geometry import Point
-from shapely.geometry.polygon import Polygon
-
-
-class ToneLoss(nn.Module):
-    def __init__(self, cfg):
-        super(ToneLoss, self).__init__()
-        self.dist_loss_weight = cfg.dist_loss_weight
-        self.im_init = None
-        self.mse_loss = nn.MSELoss()
-        self.blur = torchvision.transforms.GaussianBlur(
-            kernel_size=(cfg.pixel_dist_kernel_blur,
-                         cfg.pixel_dist_kernel_blur),
-            sigma=(cfg.pixel_dist_sigma, cfg.pixel_dist_sigma)
-        )
-        self.init_blurred = None
-
-    def set_image_init(self, im_init):
-        self.im_init = im_init
-        self.init_blurred = self.blur(self.im_init)
-
-    def get_scheduler(self, step=None):
-        if step is not None:
-            return self.dist_loss_weight * np.exp(-(1 / 5) * ((step - 300) / (20)) ** 2)
-        else:
-            return self.dist_loss_weight
-
-    def forward(self, cur_raster, step=None):
-        blurred_cur = self.blur(cur_raster)
-        return self.mse_loss(self.init_blurred.detach(), blurred_cur) * self.get_scheduler(step)
-
-
-class ConformalLoss:
-    def __init__(self, parameters, shape_groups, target_letter: str, device: torch.device):
-        self.parameters = parameters
-        self.device = device
-        self.target_letter = target_letter
-        self.shape_groups = shape_groups
-        self.faces = self.init_faces(device)
-        self.faces_roll_a = [torch.roll(self.faces[i], 1, 1) for i in range(len(self.faces))]
-
-        with torch.no_grad():
-            self.angles = []
-            self.reset(device)
-
-    def get_angles(self, points: torch.Tensor) -> torch.Tensor:
-        angles_ = []
-        for i in range(len(self.faces)):
-            triangles = points[self.faces[i]]
-            triangles_roll_a = points[self.faces_roll_a[i]]
-            edges = triangles_roll_a - triangles
-            length = edges.norm(dim=-1)
-            edges = edges / (length + 1e-1)[:, :, None]
-            edges_roll = torch.roll(edges, 1, 1)
-            cosine = torch.einsum('ned,ned->ne', edges, edges_roll)
-            angles = torch.arccos(cosine)
-            angles_.append(angles)
-        return angles_
-
-    def get_letter_inds(self, letter_to_insert):
-        for group, l in zip(self.shape_groups, self.target_letter):
-            if l == letter_to_insert:
-                letter_inds = group.shape_ids
-                return letter_inds[0], letter_inds[-1], len(letter_inds)
-
-    def reset(self, device):
-        points = torch.cat([point.to(device) for point in self.parameters])
-        self.angles = self.get_angles(points)
-
-    def init_faces(self, device: torch.device) -> torch.tensor:
-        faces_ = []
-        for j, c in enumerate(self.target_letter):
-            points_np = [
-                self.parameters[i].clone().detach().cpu().numpy()
-                for i in range(len(self.parameters))
-            ]
-            start_ind, end_ind, shapes_per_letter = self.get_letter_inds(c)
-            print(c, "start_ind: ", start_ind.item(), ", end_ind: ", end_ind.item())
-            holes = []
-            if shapes_per_letter > 1:
-                holes = points_np[start_ind + 1:end_ind]
-            poly = Polygon(points_np[start_ind], holes=holes)
-            poly = poly.buffer(0)
-            points_np = np.concatenate(points_np)
-            faces = Delaunay(points_np).simplices
-            is_intersect = np.array([poly.contains(Point(points_np[face].mean(0))) for face in faces], dtype=bool)
-            faces_.append(torch.from_numpy(faces[is_intersect]).to(device, dtype=torch.int64))
-        return faces_
-
-    def __call__(self) -> torch.Tensor:
-        loss_angles = 0
-        points = torch.cat(self.parameters).to(self.device)
-        angles = self.get_angles(points)
-        for i in range(len(self.faces)):
-            loss_angles += (nnf.mse_loss(angles[i], self.angles[i]))
-        return loss_angles
+from typing import Dict, List, Optional, Sequence
+from pathlib import Path
+import hashlib
+
+import torch
+import torch.nn as nn
+import torchvision
+import numpy as np
+from scipy.spatial import Delaunay
+from shapely.geometry import Point
+from shapely.geometry.polygon import Polygon
+
+try:
+    from shapely import contains_xy  # shapely >= 2.0
+except ImportError:
+    contains_xy = None
+
+
+class ToneLoss(nn.Module):
+    def __init__(self, cfg):
+        super(ToneLoss, self).__init__()
+        self.dist_loss_weight = cfg.dist_loss_weight
+        self.im_init = None
+        self.mse_loss = nn.MSELoss()
+        self.blur = torchvision.transforms.GaussianBlur(
+            kernel_size=(cfg.pixel_dist_kernel_blur,
+                         cfg.pixel_dist_kernel_blur),
+            sigma=(cfg.pixel_dist_sigma, cfg.pixel_dist_sigma)
+        )
+        self.init_blurred = None
+
+    def set_image_init(self, im_init):
+        self.im_init = im_init
+        self.init_blurred = self.blur(self.im_init)
+
+    def get_scheduler(self, step=None):
+        if step is not None:
+            return self.dist_loss_weight * np.exp(-(1 / 5) * ((step - 300) / (20)) ** 2)
+        else:
+            return self.dist_loss_weight
+
+    def forward(self, cur_raster, step=None):
+        blurred_cur = self.blur(cur_raster)
+        return self.mse_loss(self.init_blurred.detach(), blurred_cur) * self.get_scheduler(step)
+
+
+def points_in_polygon(poly: Polygon, points: np.ndarray) -> np.ndarray:
+    """vectorized `poly.contains(Point(p))` of the (N, 2) points"""
+    if contains_xy is not None:
+        return np.asarray(contains_xy(poly, points[:, 0], points[:, 1]), dtype=bool)
+    from shapely.prepared import prep
+    prepared = prep(poly)
+    return np.array([prepared.contains(Point(p)) for p in points], dtype=bool)
+
+
+class ConformalLoss:
+    """
+    Keeps the angles of the triangulation of each letter.
+
+    The faces of all the letters are concatenated into one index tensor, so the angles and
+    the loss come from a single gather. Each face is weighted by 1 / (3 * faces of its letter),
+    which is the sum over the letters of the per-letter MSE.
+    The triangulation can be cached in `cache_dir`, by `cache_key` (e.g. font, word, letter,
+    level of control points) and the initial points.
+    """
+
+    def __init__(self,
+                 parameters,
+                 shape_groups,
+                 target_letter: str,
+                 device: torch.device,
+                 cache_dir: Optional[str] = None,
+                 cache_key: Optional[Sequence] = None):
+        self.parameters = parameters
+        self.device = device
+        self.target_letter = target_letter
+        self.shape_groups = shape_groups
+
+        faces = self.load_faces(cache_dir, cache_key)
+        self.faces = torch.from_numpy(np.concatenate(faces)).to(device, dtype=torch.int64)
+        self.faces_roll_a = torch.roll(self.faces, 1, 1)
+        n_faces = [len(f) for f in faces]
+        self.face_weights = torch.cat([
+            torch.full((n,), 1. / (3 * n)) for n in n_faces if n > 0
+        ] or [torch.zeros(0)]).to(device)
+
+        with torch.no_grad():
+            self.angles = None
+            self.reset(device)
+
+    def get_angles(self, points: torch.Tensor) -> torch.Tensor:
+        triangles = points[self.faces]
+        triangles_roll_a = points[self.faces_roll_a]
+        edges = triangles_roll_a - triangles
+        length = edges.norm(dim=-1)
+        edges = edges / (length + 1e-1)[:, :, None]
+        edges_roll = torch.roll(edges, 1, 1)
+        cosine = torch.einsum('ned,ned->ne', edges, edges_roll)
+        angles = torch.arccos(cosine)
+        return angles
+
+    def get_letter_inds(self, letter_to_insert):
+        for group, l in zip(self.shape_groups, self.target_letter):
+            if l == letter_to_insert:
+                letter_inds = group.shape_ids
+                return letter_inds[0], letter_inds[-1], len(letter_inds)
+
+    def reset(self, device):
+        points = torch.cat([point.to(device) for point in self.parameters])
+        self.angles = self.get_angles(points)
+
+    def load_faces(self, cache_dir: Optional[str], cache_key: Optional[Sequence]) -> List[np.ndarray]:
+        if cache_dir is None:
+            return self.init_faces()
+
+        digest = hashlib.sha1(repr(tuple(cache_key or ())).encode())
+        for p in self.parameters:
+            digest.update(p.detach().cpu().numpy().astype(np.float32).tobytes())
+        cache_file = Path(cache_dir) / f"{digest.hexdigest()}.npz"
+        if cache_file.exists():
+            with np.load(cache_file) as f:
+                return [f[f"faces_{j}"] for j in range(len(self.target_letter))]
+
+        faces = self.init_faces()
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_file, **{f"faces_{j}": f for j, f in enumerate(faces)})
+        return faces
+
+    def init_faces(self) -> List[np.ndarray]:
+        points_list = [
+            self.parameters[i].clone().detach().cpu().numpy()
+            for i in range(len(self.parameters))
+        ]
+        points_np = np.concatenate(points_list)
+        # the triangulation of the word, shared by all the letters
+        all_faces = Delaunay(points_np).simplices
+        centers = points_np[all_faces].mean(1)
+
+        faces_ = []
+        for j, c in enumerate(self.target_letter):
+            start_ind, end_ind, shapes_per_letter = self.get_letter_inds(c)
+            print(c, "start_ind: ", int(start_ind), ", end_ind: ", int(end_ind))
+            holes = []
+            if shapes_per_letter > 1:
+                holes = points_list[start_ind + 1:end_ind]
+            poly = Polygon(points_list[start_ind], holes=holes)
+            poly = poly.buffer(0)
+            is_intersect = points_in_polygon(poly, centers)
+            faces_.append(all_faces[is_intersect].astype(np.int64))
+        return faces_
+
+    def __call__(self) -> torch.Tensor:
+        points = torch.cat(self.parameters).to(self.device)
+        angles = self.get_angles(points)
+        return torch.einsum('n,ne->', self.face_weights, (angles - self.angles) ** 2)
@@ -8,6 +8,7 @@ import torch
 from torch.optim.lr_scheduler import LambdaLR
 
 from methods.diffvg_warp import DiffVGState
+from pytorch_svgrender.svgtools.glyph_cache import GlyphCache
 from .ttf import font_string_to_beziers, write_letter_svg
 
 
@@ -99,7 +100,7 @@ class Painter(DiffVGState):
     def get_width_parameters(self):
         return self.width_vars
 
-    def preprocess_font(self, word, letter, level_of_cc=1, font_path=None, init_path=None):
+    def preprocess_font(self, word, letter, level_of_cc=1, font_path=None, init_path=None, cache_dir=None):
         if level_of_cc == 0:
             target_cp = None
         else:
@@ -120,28 +121,56 @@ class Painter(DiffVGState):
             target_cp = {k: v * level_of_cc for k, v in target_cp.items()}
 
         print("init_path: ", init_path)
+        glyph_cache = GlyphCache(cache_dir) if cache_dir is not None else None
 
         subdivision_thresh = None
-        self.font_string_to_svgs(init_path,
-                                 font_path,
-                                 word,
-                                 target_control=target_cp,
-                                 subdivision_thresh=subdivision_thresh)
-        self.normalize_letter_size(init_path, font_path, word)
+        self.font_string_to_scaled_svgs(init_path,
+                                        font_path,
+                                        word,
+                                        target_control=target_cp,
+                                        subdivision_thresh=subdivision_thresh,
+                                        glyph_cache=glyph_cache)
 
         # optimize two adjacent letters
         print("letter: ", letter)
         if len(letter) > 1:
             subdivision_thresh = None
-            self.font_string_to_svgs(init_path,
-                                     font_path,
-                                     letter,
-                                     target_control=target_cp,
-                                     subdivision_thresh=subdivision_thresh)
-            self.normalize_letter_size(init_path, font_path, letter)
+            self.font_string_to_scaled_svgs(init_path,
+                                            font_path,
+                                            letter,
+                                            target_control=target_cp,
+                                            subdivision_thresh=subdivision_thresh,
+                                            glyph_cache=glyph_cache)
 
         print("preprocess_font done.")
 
+    def font_string_to_scaled_svgs(self, dest_path, font, txt, target_control=None, subdivision_thresh=None,
+                                   glyph_cache=None):
+        """
+        `font_string_to_svgs` then `normalize_letter_size`.
+        With `glyph_cache`, the scaled SVGs are written from the cached outlines, without FreeType.
+        """
+        key = None
+        if glyph_cache is not None:
+            key = glyph_cache.key(font, txt, target_control=target_control,
+                                  subdivision_thresh=subdivision_thresh, fontname=self.args.font)
+            scenes = glyph_cache.load(key)
+            if scenes is not None:
+                for name, (canvas_width, canvas_height, shapes, shape_groups) in scenes.items():
+                    self.save_svg(f"{dest_path}/{name}", canvas_width, canvas_height, shapes, shape_groups)
+                print(f"-> glyph outlines of '{txt}' loaded from cache")
+                return
+
+        self.font_string_to_svgs(dest_path, font, txt,
+                                 target_control=target_control,
+                                 subdivision_thresh=subdivision_thresh)
+        self.normalize_letter_size(dest_path, font, txt)
+
+        if glyph_cache is not None:
+            fontname = os.path.splitext(os.path.basename(font))[0]
+            names = [f"{fontname}_{c}_scaled.svg".replace(" ", "_") for c in [*txt, txt]]
+            glyph_cache.save(key, {name: pydiffvg.svg_to_scene(f"{dest_path}/{name}") for name in names})
+
     def font_string_to_svgs(self, dest_path, font, txt, size=30, spacing=1.0, target_control=None,
                             subdivision_thresh=None):
         fontname = self.args.font
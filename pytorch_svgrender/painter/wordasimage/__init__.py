@@ -3,4 +3,12 @@
 # Author: XiMing Xing
 # Description:
 
-from .painter_params import Painter, PainterOptimizer
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'painter_params': ['Painter', 'PainterOptimizer']
+    }
+)
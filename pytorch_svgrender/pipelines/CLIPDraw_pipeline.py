@@ -95,10 +95,7 @@ class CLIPDrawPipeline(ModelState):
                 for n in range(self.x_cfg.num_aug):
                     loss -= torch.cosine_similarity(text_features, aug_svg_batch[n:n + 1], dim=1).mean()
 
-                pbar.set_description(
-                    f"lr: {optimizer.get_lr():.3f}, "
-                    f"L_train: {loss.item():.4f}"
-                )
+                self.log_metrics(pbar, lr=optimizer.get_lr(), L_train=loss)
 
                 # optimization
                 optimizer.zero_grad_()
@@ -8,6 +8,7 @@ import pathlib
 
 import torch
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 from torchvision import transforms
 from tqdm.auto import tqdm
 from svgutils.transform import fromfile
@@ -15,7 +16,7 @@ from svgutils.transform import fromfile
 from pytorch_svgrender.libs.engine import ModelState
 from pytorch_svgrender.plt import plot_img, plot_couple, plot_img_title
 from pytorch_svgrender.painter.clipfont import (imagenet_templates, compose_text_with_templates, Painter,
-                                                PainterOptimizer)
+                                                PainterOptimizer, PatchSampler)
 from pytorch_svgrender.libs.metric.clip_score import CLIPScoreWrapper
 from pytorch_svgrender.libs.metric.piq.perceptual import LPIPS
 
@@ -44,6 +45,9 @@ class CLIPFontPipeline(ModelState):
 
         # init clip model
         self.clip_wrapper = CLIPScoreWrapper(self.x_cfg.clip.model_name, device=self.device)
+        # random patches of the directional losses, sampled at the resolution of CLIP
+        self.patch_sampler = PatchSampler(out_size=self.clip_wrapper.input_resolution, distortion_scale=0.3)
+        self.clip_chunk_size = self.x_cfg.get('clip_chunk_size', None) or 0
         # init LPIPS
         self.lam_lpips = 0 if self.x_cfg.get('lam_lpips', None) is None else self.x_cfg.lam_lpips
         self.lpips_fn = LPIPS()
@@ -61,18 +65,15 @@ class CLIPFontPipeline(ModelState):
         target_img = process_comp(tar_pil)  # preprocess
         return target_img.to(self.device)
 
-    def cropper(self, x: torch.Tensor) -> torch.Tensor:
-        return transforms.RandomCrop(self.x_cfg.crop_size)(x)
-
-    def padding_cropper(self, x: torch.Tensor) -> torch.Tensor:
-        return transforms.RandomCrop(size=500, padding=100, fill=255, padding_mode='constant')(x)
-
-    def affine_to512(self, x: torch.Tensor) -> torch.Tensor:
-        comp = transforms.Compose([
-            transforms.RandomPerspective(fill=0, p=1, distortion_scale=0.3),
-            transforms.Resize(512)
+    def encode_patches(self, patches: torch.Tensor) -> torch.Tensor:
+        """CLIP features of the patches, in chunks whose activations are recomputed in backward"""
+        patches = self.clip_wrapper.norm_(patches)
+        if self.clip_chunk_size <= 0 or patches.shape[0] <= self.clip_chunk_size:
+            return self.clip_wrapper.encode_image(patches)
+        return torch.cat([
+            checkpoint(self.clip_wrapper.encode_image, chunk, use_reentrant=False)
+            for chunk in patches.split(self.clip_chunk_size)
         ])
-        return comp(x)
 
     def resize224_norm(self, x: torch.Tensor) -> torch.Tensor:
         x = torch.nn.functional.interpolate(x, size=224, mode='bicubic')
@@ -125,54 +126,41 @@ class CLIPFontPipeline(ModelState):
                     plot_img(img_t, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                # style loss
-                # directional loss 1
-                img_proc = []
-                for n in range(self.x_cfg.num_crops):
-                    target_crop = self.cropper(img_t)
-                    target_crop = self.affine_to512(target_crop)
-                    img_proc.append(target_crop)
-                img_aug = torch.cat(img_proc, dim=0)
-                image_features = self.clip_wrapper.encode_image(self.resize224_norm(img_aug))
-
-                loss_patch = self.x_cfg.lam_patch * self.clip_wrapper.directional_loss(text_source,
-                                                                                       source_image_feats,
-                                                                                       text_features,
-                                                                                       image_features,
-                                                                                       self.x_cfg.thresh)
-
-                # directional loss 2
-                img_proc2 = []
-                for n in range(32):
-                    target_crop = self.padding_cropper(img_t)
-                    target_crop = self.affine_to512(target_crop)
-                    img_proc2.append(target_crop)
-                img_aug2 = torch.cat(img_proc2, dim=0)
-                glob_features = self.clip_wrapper.encode_image(self.resize224_norm(img_aug2))
-
-                loss_glob = self.x_cfg.lam_dir * self.clip_wrapper.directional_loss(text_source,
-                                                                                    source_image_feats,
-                                                                                    text_features, glob_features)
-
-                # LPIPS
-                loss_lpips = self.lam_lpips * self.lpips_fn(img_t, source_image)
-
-                # L2
-                loss_l2 = self.lam_l2 * F.mse_loss(img_t, source_image)
-
-                # total loss
-                loss = loss_patch + loss_glob + loss_lpips + loss_l2
+                with self.precision.autocast():
+                    # style loss
+                    # directional loss 1
+                    img_aug = self.patch_sampler(img_t, self.x_cfg.num_crops, self.x_cfg.crop_size)
+                    image_features = self.encode_patches(img_aug)
+
+                    loss_patch = self.x_cfg.lam_patch * self.clip_wrapper.directional_loss(text_source,
+                                                                                           source_image_feats,
+                                                                                           text_features,
+                                                                                           image_features,
+                                                                                           self.x_cfg.thresh)
+
+                    # directional loss 2
+                    img_aug2 = self.patch_sampler(img_t, self.x_cfg.get('num_glob_crops', 32), crop_size=500, padding=100)
+                    glob_features = self.encode_patches(img_aug2)
+
+                    loss_glob = self.x_cfg.lam_dir * self.clip_wrapper.directional_loss(text_source,
+                                                                                        source_image_feats,
+                                                                                        text_features, glob_features)
+
+                    # LPIPS
+                    loss_lpips = self.lam_lpips * self.lpips_fn(img_t, source_image)
+
+                    # L2
+                    loss_l2 = self.lam_l2 * F.mse_loss(img_t, source_image)
+
+                    # total loss
+                    loss = loss_patch + loss_glob + loss_lpips + loss_l2
+                loss = self.precision.cast(loss)
 
                 # log
                 p_lr, c_lr = optimizer.get_lr()
-                pbar.set_description(
-                    f"point_lr: {p_lr}, color_lr: {c_lr}, "
-                    f"L_total: {loss.item():.4f}, "
-                    f"L_patch: {loss_patch.item():.4f}, "
-                    f"L_glob: {loss_glob.item():.4f}, "
-                    f"L_lpips: {loss_lpips.item():.4f}, "
-                    f"L_l2: {loss_l2.item():.4f}."
-                )
+                self.log_metrics(pbar, point_lr=p_lr, color_lr=c_lr,
+                                 L_total=loss, L_patch=loss_patch, L_glob=loss_glob,
+                                 L_lpips=loss_lpips, L_l2=loss_l2)
 
                 # backward and optimization
                 optimizer.zero_grad_()
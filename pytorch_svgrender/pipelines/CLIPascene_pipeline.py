@@ -1,6 +1,10 @@
+import queue
 import shutil
+import hashlib
+import traceback
 from PIL import Image
 from pathlib import Path
+from typing import Dict, List
 
 from tqdm.auto import tqdm
 import imageio
@@ -9,30 +13,103 @@ from skimage.transform import resize
 import torch
 from torchvision import transforms
 from torchvision.transforms import InterpolationMode
+from torchvision.utils import save_image
+from omegaconf import OmegaConf
 
 from pytorch_svgrender.libs.engine import ModelState
-from pytorch_svgrender.painter.clipascene import Painter, PainterOptimizer, Loss
+from pytorch_svgrender.painter.clipascene import Painter, PainterOptimizer, Loss, SweepLoss
 from pytorch_svgrender.painter.clipascene.lama_utils import apply_inpaint
-from pytorch_svgrender.painter.clipascene.scripts_utils import read_svg
+from pytorch_svgrender.painter.clipascene.scripts_utils import read_svg, get_ratios
 from pytorch_svgrender.painter.clipascene.sketch_utils import plot_attn, get_mask_u2net, fix_image_scale
 from pytorch_svgrender.plt import plot_img, plot_couple
 from pytorch_svgrender.svgtools import merge_svg_files
+from pytorch_svgrender.utils.multirun import worker_resources, pin_worker
+from pytorch_svgrender.utils.result_cache import file_digest
 
 
 class CLIPascenePipeline(ModelState):
-    def __init__(self, args):
+    def __init__(self, args, branch: str = None):
         logdir_ = f"sd{args.seed}" \
                   f"-im{args.x.image_size}" \
                   f"-P{args.x.num_paths}W{args.x.width}"
+        # a branch worker logs in its own sub dir, see `run_branches_parallel`
+        if branch is not None:
+            logdir_ = f"{logdir_}/{branch}"
         super().__init__(args, log_path_suffix=logdir_)
 
     def painterly_rendering(self, image_path):
-        foreground_target, background_target = self.preprocess_image(image_path)
-        background_output_dir = self.run_background(background_target)
-        foreground_output_dir = self.run_foreground(foreground_target)
+        foreground_target, mask_path = self.preprocess_image(image_path)
+        if self.x_cfg.get('parallel_branches', False) and self.accelerator.num_processes == 1:
+            background_output_dir, foreground_output_dir = self.run_branches_parallel(foreground_target, mask_path)
+        else:
+            background_target = self.inpaint_background(foreground_target, mask_path)
+            background_output_dir = self.run_background(background_target)
+            foreground_output_dir = self.run_foreground(foreground_target)
         self.combine(background_output_dir, foreground_output_dir, self.device)
         self.close(msg="painterly rendering complete.")
 
+    def run_branches_parallel(self, scaled_path: Path, mask_path: Path):
+        """
+        The background (LaMa inpainting + sketch) and the foreground sketch in two worker processes,
+        each with its own share of the cores and a device in round-robin.
+        The scaled target is shared with the workers through shared memory. Each worker is seeded with
+        `seed` and writes its logs and results under `{result_path}/{branch}/`.
+        """
+        import torch.multiprocessing as tmp
+        from hydra.core.hydra_config import HydraConfig
+
+        ctx = tmp.get_context('spawn')  # CUDA can not be used in forked processes
+        result_queue = ctx.Queue()
+
+        im = Image.open(scaled_path)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+        scene = {
+            'image': torch.from_numpy(np.array(im)).share_memory_(),
+            'scaled_path': scaled_path.as_posix(),
+            'mask_path': mask_path.as_posix(),
+        }
+
+        branches = ['background', 'foreground']
+        resources = worker_resources(len(branches), self.args.get('worker_threads', None))
+        hydra_cfg = HydraConfig.instance().cfg
+        workers = {}
+        for i, branch in enumerate(branches):
+            p = ctx.Process(target=_branch_worker,
+                            args=(branch, resources[i], self.args, hydra_cfg, scene, result_queue),
+                            name=f"clipascene-{branch}")
+            p.start()
+            workers[branch] = p
+            print(f"-> {branch} worker: cores {resources[i]['cores']}, "
+                  f"threads {resources[i]['threads']}, device {resources[i]['device']}")
+
+        output_dirs: Dict[str, Path] = {}
+        errors: Dict[str, str] = {}
+        try:
+            while len(output_dirs) + len(errors) < len(branches):
+                try:
+                    branch, output_dir, error = result_queue.get(timeout=1.0)
+                    if error is None:
+                        output_dirs[branch] = Path(output_dir)
+                    else:
+                        errors[branch] = error
+                    continue
+                except queue.Empty:
+                    pass
+                for branch, p in workers.items():
+                    if not p.is_alive() and branch not in output_dirs and branch not in errors and \
+                            result_queue.empty():
+                        errors[branch] = f"{branch} worker exited with code {p.exitcode}"
+        finally:
+            for p in workers.values():
+                p.join(timeout=60)
+                if p.is_alive():
+                    p.terminate()
+
+        if len(errors) > 0:
+            raise RuntimeError("\n".join(f"CLIPascene {b} failed:\n{e}" for b, e in errors.items()))
+        return output_dirs['background'], output_dirs['foreground']
+
     def preprocess_image(self, image_path):
         image_path = Path(image_path)
         scene_path = self.result_path / "scene"
@@ -54,24 +131,46 @@ class CLIPascenePipeline(ModelState):
         mask = get_mask_u2net(scaled_img, scene_path, self.args.x.u2net_path, preprocess=True, device=self.device)
         masked_path = scene_path / f"{image_path.stem}_mask.png"
         imageio.imsave(masked_path, mask.astype(np.uint8) * 255)
+        return scaled_path, masked_path
 
-        apply_inpaint(scene_path, background_path, self.device)
-        return scaled_path, background_path / f"{image_path.stem}_mask.png"
+    def inpaint_background(self, scaled_path: Path, mask_path: Path) -> Path:
+        """LaMa inpainting of the object, cached by the hash of the image and its mask"""
+        background_path = self.result_path / "background"
+        background_path.mkdir(parents=True, exist_ok=True)
+        inpainted_path = background_path / f"{scaled_path.stem}_mask.png"
+
+        cache_file = None
+        cache_dir = self.x_cfg.get('inpaint_cache_dir', None)
+        if cache_dir is not None:
+            key = hashlib.sha1(f"{file_digest(scaled_path)}-{file_digest(mask_path)}".encode()).hexdigest()
+            cache_file = Path(cache_dir) / f"{key}.png"
+            if cache_file.exists():
+                shutil.copyfile(cache_file, inpainted_path)
+                print(f"-> inpainted background loaded from '{cache_file}'")
+                return inpainted_path
+
+        apply_inpaint(scaled_path.parent, background_path, self.device)
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(inpainted_path, cache_file)
+        return inpainted_path
 
     def run_background(self, target_file):
         print("=====Start background=====")
         self.args.x.resize_obj = 0
         self.args.x.mask_object = 0
 
-        clip_conv_layer_weights_int = [0 for _ in range(12)]
-        clip_conv_layer_weights_int[self.args.x.background_layer] = 1
+        clip_conv_layer_weights_int = self.layer_weights("background", self.args.x.background_layer)
         clip_conv_layer_weights_str = [str(j) for j in clip_conv_layer_weights_int]
         self.args.x.clip_conv_layer_weights = ','.join(clip_conv_layer_weights_str)
 
         output_dir = self.result_path / "background"
         if self.accelerator.is_main_process:
             output_dir.mkdir(parents=True, exist_ok=True)
-        self.paint(target_file, output_dir, self.args.x.background_num_iter)
+        if self.x_cfg.get('sweep', {}).get('enable', False):
+            self.paint_sweep(target_file, output_dir, "background", self.args.x.background_num_iter)
+        else:
+            self.paint(target_file, output_dir, self.args.x.background_num_iter)
         print("=====End background=====")
         return output_dir
 
@@ -82,19 +181,154 @@ class CLIPascenePipeline(ModelState):
             self.args.x.gradnorm = 1
         self.args.x.mask_object = 1
 
-        clip_conv_layer_weights_int = [0 for _ in range(12)]
-        clip_conv_layer_weights_int[4] = 0.5
-        clip_conv_layer_weights_int[self.args.x.foreground_layer] = 1
+        clip_conv_layer_weights_int = self.layer_weights("foreground", self.args.x.foreground_layer)
         clip_conv_layer_weights_str = [str(j) for j in clip_conv_layer_weights_int]
         self.args.x.clip_conv_layer_weights = ','.join(clip_conv_layer_weights_str)
 
         output_dir = self.result_path / "object"
         if self.accelerator.is_main_process:
             output_dir.mkdir(parents=True, exist_ok=True)
-        self.paint(target_file, output_dir, self.args.x.foreground_num_iter)
+        if self.x_cfg.get('sweep', {}).get('enable', False):
+            self.paint_sweep(target_file, output_dir, "foreground", self.args.x.foreground_num_iter)
+        else:
+            self.paint(target_file, output_dir, self.args.x.foreground_num_iter)
         print("=====End foreground=====")
         return output_dir
 
+    @staticmethod
+    def layer_weights(branch: str, layer: int) -> List[float]:
+        """the weights of the CLIP layers for the fidelity `layer` of a branch"""
+        weights = [0 for _ in range(12)]
+        if branch == "foreground":
+            weights[4] = 0.5
+        weights[layer] = 1
+        return weights
+
+    def paint_sweep(self, target, output_dir, branch, num_iter):
+        """
+        The abstraction grid of a branch in one process: the rows are the fidelity levels (the CLIP layer),
+        the columns the simplicity levels (the ratio of the width loss, from the initial sketch of the row).
+        The levels share the target, its mask, its saliency and the CLIP models, their sketches are
+        optimized together with one batched loss per step.
+        """
+        assert self.x_cfg.mlp_train, "the simplicity levels start from the MLP of the initial sketches."
+        sweep_cfg = self.x_cfg.sweep
+        layers = list(sweep_cfg.layers)
+        step_size = self.x_cfg.background_div if branch == "background" else self.x_cfg.foreground_div
+
+        inputs, mask = self.get_target(target,
+                                       self.args.x.image_size,
+                                       output_dir,
+                                       self.args.x.resize_obj,
+                                       self.args.x.u2net_path,
+                                       self.args.x.mask_object,
+                                       self.args.x.fix_scale,
+                                       self.device)
+        plot_img(inputs, output_dir, fname="target")
+        loss_func = SweepLoss(self.x_cfg, mask, self.device)
+
+        # fidelity: the initial sketch of each layer, without the width optimization
+        levels, renderers = [], []
+        saliency = None
+        for layer in layers:
+            levels.append({
+                "name": f"l{layer}_initial",
+                "layer": layer,
+                "layer_weights": self.layer_weights(branch, layer),
+                "width_optim": False,
+                "ratio_loss": 0,
+                "gradnorm": branch == "foreground" and layer != 4,
+            })
+            renderer = self.load_renderer(inputs, mask, saliency=saliency)
+            renderer.init_image(stage=0)
+            saliency = renderer.get_saliency()
+            renderers.append(renderer)
+        initial = self.train_levels(levels, renderers, inputs, loss_func, output_dir, num_iter)
+
+        # simplicity: the ratios of each layer, the sketches start from the MLP of the initial sketch
+        ratio_levels, ratio_renderers = [], []
+        for level, renderer, best in zip(levels, renderers, initial):
+            # L_clip of the layer (plus layer 4 for the object) at the best iteration
+            clip_loss = sum(v for k, v in best["losses"].items()
+                            if k.endswith(f"_l{level['layer']}") or (branch == "foreground" and k.endswith("_l4")))
+            ratios, _ = get_ratios(clip_loss, step_size, sweep_cfg.num_ratios)
+            for j, ratio in enumerate(ratios):
+                ratio_levels.append({**level, "name": f"l{level['layer']}_ratio{j}",
+                                     "width_optim": True, "ratio_loss": float(ratio)})
+                cfg = OmegaConf.merge(self.x_cfg, {"width_optim": 1, "ratio_loss": float(ratio)})
+                ratio_renderer = self.load_renderer(inputs, mask, cfg=cfg, saliency=saliency)
+                ratio_renderer.init_image(stage=0)
+                ratio_renderer.points_init = [p.clone() for p in renderer.points_init]
+                ratio_renderer.mlp.load_state_dict(renderer.mlp.state_dict())
+                ratio_renderers.append(ratio_renderer)
+        simplified = self.train_levels(ratio_levels, ratio_renderers, inputs, loss_func, output_dir,
+                                       sweep_cfg.get('num_iter', None) or num_iter)
+
+        # the grid, one row per layer
+        n_cols = sweep_cfg.num_ratios + 1
+        grid = []
+        for i in range(len(layers)):
+            grid.append(initial[i]["sketch"])
+            grid.extend(best["sketch"] for best in simplified[i * sweep_cfg.num_ratios:(i + 1) * sweep_cfg.num_ratios])
+        save_image(torch.cat(grid), output_dir / "abstraction_grid.png", nrow=n_cols, padding=2, pad_value=1.)
+
+        # the sketch of the configured layer is the output of the branch
+        layer = self.x_cfg.background_layer if branch == "background" else self.x_cfg.foreground_layer
+        row = layers.index(layer) if layer in layers else 0
+        shutil.copyfile(output_dir / levels[row]["name"] / "best_iter.svg", output_dir / "best_iter.svg")
+
+    def train_levels(self, levels, renderers, inputs, loss_func, output_dir, num_iter) -> List[Dict]:
+        """optimize the sketches of `levels` together, returns the best sketch and its losses of each level"""
+        optimizers = []
+        for level, renderer in zip(levels, renderers):
+            (output_dir / level["name"]).mkdir(parents=True, exist_ok=True)
+            optimizer = PainterOptimizer(renderer.args, renderer)
+            renderer.set_random_noise(0)
+            optimizer.init_optimizers()
+            if self.args.x.switch_loss:
+                renderer.turn_off_points_optim()
+                optimizer.turn_off_points_optim()
+            with torch.no_grad():
+                renderer.get_image("init")
+            optimizers.append(optimizer)
+
+        best = [{"loss": 100, "sketch": None, "losses": None} for _ in levels]
+        min_delta = 1e-7
+        with tqdm(initial=0, total=num_iter, disable=not self.accelerator.is_main_process) as pbar:
+            for step in range(num_iter):
+                for optimizer in optimizers:
+                    optimizer.zero_grad_()
+                sketches = torch.cat([renderer.get_image().to(self.device) for renderer in renderers])
+                with self.precision.autocast():
+                    outputs = loss_func(sketches, inputs.detach(), levels, renderers, mode="train")
+                    loss = sum(sum(losses.values()) for losses, _ in outputs)
+                loss = self.precision.cast(loss)
+                loss.backward()
+                for optimizer in optimizers:
+                    optimizer.step_()
+
+                if step % self.args.x.eval_step == 0:
+                    with torch.no_grad(), self.precision.autocast():
+                        outputs = loss_func(sketches, inputs, levels, renderers, mode="eval")
+                        # one transfer for the eval losses of all the levels
+                        loss_eval = torch.stack([sum(losses.values()) for losses, _ in outputs]).cpu().tolist()
+                    for i, (level, renderer) in enumerate(zip(levels, renderers)):
+                        cur_delta = loss_eval[i] - best[i]["loss"]
+                        if abs(cur_delta) > min_delta and cur_delta < 0:
+                            best[i] = {"loss": loss_eval[i],
+                                       "sketch": sketches[i:i + 1].detach().clone(),
+                                       "losses": {k: v.item() for k, v in outputs[i][1].items()}}
+                            renderer.save_svg((output_dir / level["name"]).as_posix(), "best_iter")
+
+                if self.args.x.switch_loss and step > 0 and step % self.args.x.switch_loss == 0:
+                    for renderer, optimizer in zip(renderers, optimizers):
+                        renderer.switch_opt()
+                        optimizer.switch_opt()
+
+                self.log_metrics(pbar, step=step, loss=loss)
+                pbar.update(1)
+        return best
+
     def paint(self, target, output_dir, num_iter):
         png_log_dir = output_dir / "png_logs"
         svg_log_dir = output_dir / "svg_logs"
@@ -151,11 +385,13 @@ class CLIPascenePipeline(ModelState):
                     plot_img(sketches, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                losses_dict_weighted, _, _ = loss_func(sketches, inputs.detach(), step,
-                                                       renderer.get_widths(), renderer,
-                                                       optimizer, mode="train",
-                                                       width_opt=renderer.width_optim)
-                loss = sum(list(losses_dict_weighted.values()))
+                with self.precision.autocast():
+                    losses_dict_weighted, _, _ = loss_func(sketches, inputs.detach(), step,
+                                                           renderer.get_widths(), renderer,
+                                                           optimizer, mode="train",
+                                                           width_opt=renderer.width_optim)
+                    loss = sum(list(losses_dict_weighted.values()))
+                loss = self.precision.cast(loss)
                 loss.backward()
                 optimizer.step_()
 
@@ -168,7 +404,7 @@ class CLIPascenePipeline(ModelState):
                     renderer.save_svg(svg_log_dir.as_posix(), f"svg_iter{step}")
 
                 if step % self.args.x.eval_step == 0:
-                    with torch.no_grad():
+                    with torch.no_grad(), self.precision.autocast():
                         losses_dict_weighted_eval, _, _ = loss_func(
                             sketches,
                             inputs,
@@ -217,14 +453,16 @@ class CLIPascenePipeline(ModelState):
                 (output_dir / f"clipascene_sketch.mp4").as_posix()
             ])
 
-    def load_renderer(self, target_im=None, mask=None):
-        renderer = Painter(method_cfg=self.x_cfg,
+    def load_renderer(self, target_im=None, mask=None, cfg=None, saliency=None):
+        cfg = cfg or self.x_cfg
+        renderer = Painter(method_cfg=cfg,
                            diffvg_cfg=self.args.diffvg,
-                           num_strokes=self.x_cfg.num_paths,
-                           canvas_size=self.x_cfg.image_size,
+                           num_strokes=cfg.num_paths,
+                           canvas_size=cfg.image_size,
                            device=self.device,
                            target_im=target_im,
-                           mask=mask)
+                           mask=mask,
+                           saliency=saliency)
         return renderer
 
     def get_target(self,
@@ -237,7 +475,8 @@ class CLIPascenePipeline(ModelState):
                    fix_scale,
                    device):
 
-        target = Image.open(target_file)
+        # a path, or an image already in memory
+        target = target_file if isinstance(target_file, Image.Image) else Image.open(target_file)
 
         if target.mode == "RGBA":
             # Create a white rgba background
@@ -294,3 +533,21 @@ class CLIPascenePipeline(ModelState):
         raster_b[raster_o != 1] = raster_o[raster_o != 1]
         raster_b = torch.from_numpy(raster_b).unsqueeze(0).permute(0, 3, 1, 2).to(device)
         plot_img(raster_b, self.result_path, fname="combined")
+
+
+def _branch_worker(branch: str, resources: Dict, cfg, hydra_cfg, scene: Dict, result_queue):
+    """one branch of `CLIPascenePipeline.run_branches_parallel`"""
+    try:
+        pin_worker(resources, hydra_cfg)
+        from accelerate.utils import set_seed
+
+        set_seed(cfg.seed)
+        pipe = CLIPascenePipeline(cfg, branch=branch)
+        if branch == 'background':
+            target = pipe.inpaint_background(Path(scene['scaled_path']), Path(scene['mask_path']))
+            output_dir = pipe.run_background(target)
+        else:
+            output_dir = pipe.run_foreground(Image.fromarray(scene['image'].numpy()))
+        result_queue.put((branch, output_dir.as_posix(), None))
+    except Exception:
+        result_queue.put((branch, None, traceback.format_exc()))
@@ -79,13 +79,15 @@ class CLIPassoPipeline(ModelState):
                     plot_img(sketches, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                losses_dict = loss_func(sketches,
-                                        inputs.detach(),
-                                        renderer.get_color_parameters(),
-                                        renderer,
-                                        self.step,
-                                        optimizer)
-                loss = sum(list(losses_dict.values()))
+                with self.precision.autocast():
+                    losses_dict = loss_func(sketches,
+                                            inputs.detach(),
+                                            renderer.get_color_parameters(),
+                                            renderer,
+                                            self.step,
+                                            optimizer)
+                    loss = sum(list(losses_dict.values()))
+                loss = self.precision.cast(loss)
 
                 optimizer.zero_grad_()
                 loss.backward()
@@ -94,7 +96,7 @@ class CLIPassoPipeline(ModelState):
                 if self.x_cfg.lr_schedule:
                     optimizer.update_lr()
 
-                pbar.set_description(f"L_train: {loss.item():.5f}")
+                self.log_metrics(pbar, L_train=loss)
 
                 if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
                     plot_couple(inputs,
@@ -105,7 +107,7 @@ class CLIPassoPipeline(ModelState):
                     renderer.save_svg(self.svg_logs_dir.as_posix(), f"svg_iter{self.step}")
 
                 if self.step % self.args.eval_step == 0 and self.accelerator.is_main_process:
-                    with torch.no_grad():
+                    with torch.no_grad(), self.precision.autocast():
                         losses_dict_eval = loss_func(
                             sketches,
                             inputs,
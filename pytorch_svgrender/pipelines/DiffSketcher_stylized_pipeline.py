@@ -18,8 +18,6 @@ from skimage.color import rgb2gray
 import diffusers
 
 from pytorch_svgrender.libs.engine import ModelState
-from pytorch_svgrender.libs.metric.lpips_origin import LPIPS
-from pytorch_svgrender.libs.metric.piq.perceptual import DISTS as DISTS_PIQ
 from pytorch_svgrender.libs.metric.clip_score import CLIPScoreWrapper
 from pytorch_svgrender.painter.diffsketcher import (
     Painter, SketchPainterOptimizer, Token2AttnMixinASDSPipeline, Token2AttnMixinASDSSDXLPipeline)
@@ -28,9 +26,11 @@ from pytorch_svgrender.plt import plot_img
 from pytorch_svgrender.painter.diffsketcher.sketch_utils import plt_attn
 from pytorch_svgrender.painter.clipasso.sketch_utils import get_mask_u2net, fix_image_scale
 from pytorch_svgrender.token2attn.attn_control import AttentionStore, EmptyControl
+from pytorch_svgrender.token2attn.attn_cache import AttentionCache
 from pytorch_svgrender.token2attn.ptp_utils import view_images
-from pytorch_svgrender.painter.style_clipdraw import sample_indices, StyleLoss, VGG16Extractor
-from pytorch_svgrender.model_helper import init_StableDiffusion_pipeline, model2res
+from pytorch_svgrender.painter.style_clipdraw import sample_indices, StyleLoss, VGG16Extractor, \
+    load_style_statistics
+from pytorch_svgrender.model_helper import init_StableDiffusion_pipeline, model2res, LatentProxySwitch
 
 
 class StylizedDiffSketcherPipeline(ModelState):
@@ -93,6 +93,10 @@ class StylizedDiffSketcherPipeline(ModelState):
 
         self.g_device = torch.Generator(device=self.device).manual_seed(args.seed)
 
+        # aggregated attention maps of the LDM sampling pass, reused for logging and across runs
+        self.attn_cache = AttentionCache(self.x_cfg.get('attn_cache_dir', None))
+        self.cross_attn_maps, self.attn_tokens = None, None
+
         # init clip model and clip score wrapper
         self.cargs = self.x_cfg.clip
         self.clip_score_fn = CLIPScoreWrapper(self.cargs.model_name,
@@ -115,17 +119,39 @@ class StylizedDiffSketcherPipeline(ModelState):
         controller = AttentionStore() if self.x_cfg.attention_init else EmptyControl()
 
         height = width = model2res(self.x_cfg.model_id)
-        outputs = self.diffusion(prompt=[prompt],
-                                 negative_prompt=[self.args.neg_prompt],
-                                 height=height,
-                                 width=width,
-                                 controller=controller,
-                                 num_inference_steps=self.x_cfg.num_inference_steps,
-                                 guidance_scale=self.x_cfg.guidance_scale,
-                                 generator=self.g_device)
+        cache_key = AttentionCache.make_key(prompt,
+                                            self.args.neg_prompt,
+                                            self.args.seed,
+                                            self.x_cfg.model_id,
+                                            height,
+                                            self.x_cfg.num_inference_steps,
+                                            self.x_cfg.guidance_scale,
+                                            self.x_cfg.cross_attn_res,
+                                            self.x_cfg.self_attn_res)
+        cached = self.attn_cache.load(cache_key)
+        if cached is not None and (cached["image_path"] is None or
+                                   (self.x_cfg.attention_init and cached["cross_attn"] is None)):
+            cached = None  # incomplete entry, e.g. stored by a run without attention init
 
         target_file = self.result_path / "ldm_generated_image.png"
-        view_images([np.array(img) for img in outputs.images], save_image=True, fp=target_file)
+        if cached is not None:
+            self.print(f"-> reuse the cached LDM sampling: {cache_key}")
+            if pathlib.Path(cached["image_path"]) != target_file:
+                shutil.copyfile(cached["image_path"], target_file)
+        else:
+            # the sampling only draws from `g_device`, the global RNG state is restored afterwards,
+            # so that the rest of the run is the same on a cache hit and on a miss
+            rng_devices = [self.device] if self.device.type == 'cuda' else []
+            with torch.random.fork_rng(devices=rng_devices):
+                outputs = self.diffusion(prompt=[prompt],
+                                         negative_prompt=[self.args.neg_prompt],
+                                         height=height,
+                                         width=width,
+                                         controller=controller,
+                                         num_inference_steps=self.x_cfg.num_inference_steps,
+                                         guidance_scale=self.x_cfg.guidance_scale,
+                                         generator=self.g_device)
+            view_images([np.array(img) for img in outputs.images], save_image=True, fp=target_file)
 
         if self.x_cfg.attention_init:
             """ldm cross-attention map"""
@@ -134,7 +160,9 @@ class StylizedDiffSketcherPipeline(ModelState):
                                                    controller,
                                                    res=self.x_cfg.cross_attn_res,
                                                    from_where=("up", "down"),
-                                                   save_path=self.result_path / "cross_attn.png")
+                                                   save_path=self.result_path / "cross_attn.png",
+                                                   attention_maps=None if cached is None else cached["cross_attn"])
+            self.cross_attn_maps, self.attn_tokens = cross_attention_maps, tokens
 
             self.print(f"the length of tokens is {len(tokens)}, select {self.x_cfg.token_ind}-th token")
             # [res, res, seq_len]
@@ -166,7 +194,8 @@ class StylizedDiffSketcherPipeline(ModelState):
                                                        from_where=("up", "down"),
                                                        img_size=self.x_cfg.image_size,
                                                        max_com=self.x_cfg.max_com,
-                                                       save_path=self.result_path)
+                                                       save_path=self.result_path,
+                                                       attention_maps=None if cached is None else cached["self_attn"])
 
             # comp self-attention map
             if self.x_cfg.mean_comp:
@@ -193,6 +222,15 @@ class StylizedDiffSketcherPipeline(ModelState):
             self.print(f"-> fusion attn_map: {attn_map.shape}")
         else:
             attn_map = None
+            self_attention_maps = None
+
+        if cached is None:
+            self.attn_cache.save(cache_key,
+                                 cross_attn=self.cross_attn_maps,
+                                 self_attn=None if self_attention_maps is None else torch.from_numpy(
+                                     self_attention_maps),
+                                 tokens=self.attn_tokens,
+                                 image_path=target_file)
 
         return target_file.as_posix(), attn_map
 
@@ -252,12 +290,16 @@ class StylizedDiffSketcherPipeline(ModelState):
         perceptual_loss_fn = None
         if self.x_cfg.perceptual.coeff > 0:
             if self.x_cfg.perceptual.name == "lpips":
+                from pytorch_svgrender.libs.metric.lpips_origin import LPIPS
+
                 lpips_loss_fn = LPIPS(net=self.x_cfg.perceptual.lpips_net).to(self.device)
                 perceptual_loss_fn = partial(lpips_loss_fn.forward, return_per_layer=False, normalize=False)
             elif self.x_cfg.perceptual.name == "dists":
+                from pytorch_svgrender.libs.metric.piq.perceptual import DISTS as DISTS_PIQ
+
                 perceptual_loss_fn = DISTS_PIQ()
 
-        style_img, feat_style = self.load_and_process_style_file(style_fpath)
+        style_img, style_stats = self.load_and_process_style_file(style_fpath)
 
         inputs, mask = self.get_target(target_file,
                                        self.x_cfg.image_size,
@@ -295,6 +337,9 @@ class StylizedDiffSketcherPipeline(ModelState):
         min_delta = 1e-6
 
         self.print(f"\ntotal optimization steps: {total_iter}")
+        # the learned RGB-to-latent proxy replaces the VAE encoder, except for the last steps
+        latent_proxy = LatentProxySwitch.from_cfg(self.x_cfg.sds.get('latent_proxy', None),
+                                                  self.x_cfg.model_id, self.diffusion, self.device)
         with tqdm(initial=self.step, total=total_iter, disable=not self.accelerator.is_main_process) as pbar:
             while self.step < total_iter:
                 raster_sketch = renderer.get_image().to(self.device)
@@ -303,63 +348,64 @@ class StylizedDiffSketcherPipeline(ModelState):
                     plot_img(raster_sketch, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                # ASDS loss
-                sds_loss, grad = torch.tensor(0), torch.tensor(0)
-                if self.step >= self.x_cfg.sds.warmup:
-                    grad_scale = self.x_cfg.sds.grad_scale if self.step > self.x_cfg.sds.warmup else 0
-                    sds_loss, grad = self.diffusion.score_distillation_sampling(
-                        raster_sketch,
-                        crop_size=self.x_cfg.sds.crop_size,
-                        augments=self.x_cfg.sds.augmentations,
-                        prompt=[prompt],
-                        negative_prompt=self.args.neg_prompt,
-                        guidance_scale=self.x_cfg.sds.guidance_scale,
-                        grad_scale=grad_scale,
-                        t_range=list(self.x_cfg.sds.t_range),
+                latent_proxy.update(self.step, total_iter)
+                with self.precision.autocast():
+                    # ASDS loss
+                    sds_loss, grad = torch.tensor(0), torch.tensor(0)
+                    if self.step >= self.x_cfg.sds.warmup:
+                        grad_scale = self.x_cfg.sds.grad_scale if self.step > self.x_cfg.sds.warmup else 0
+                        sds_loss, grad = self.diffusion.score_distillation_sampling(
+                            raster_sketch,
+                            crop_size=self.x_cfg.sds.crop_size,
+                            augments=self.x_cfg.sds.augmentations,
+                            prompt=[prompt],
+                            negative_prompt=self.args.neg_prompt,
+                            guidance_scale=self.x_cfg.sds.guidance_scale,
+                            grad_scale=grad_scale,
+                            t_range=list(self.x_cfg.sds.t_range),
+                        )
+
+                    # CLIP data augmentation
+                    raster_sketch_aug, inputs_aug = self.clip_pair_augment(
+                        raster_sketch, inputs,
+                        im_res=224,
+                        augments=self.cargs.augmentations,
+                        num_aug=self.cargs.num_aug
                     )
 
-                # CLIP data augmentation
-                raster_sketch_aug, inputs_aug = self.clip_pair_augment(
-                    raster_sketch, inputs,
-                    im_res=224,
-                    augments=self.cargs.augmentations,
-                    num_aug=self.cargs.num_aug
-                )
-
-                # clip visual loss
-                total_visual_loss = torch.tensor(0)
-                l_clip_fc, l_clip_conv, clip_conv_loss_sum = torch.tensor(0), [], torch.tensor(0)
-                if self.x_cfg.clip.vis_loss > 0:
-                    l_clip_fc, l_clip_conv = self.clip_score_fn.compute_visual_distance(
-                        raster_sketch_aug, inputs_aug, clip_norm=False
+                    # clip visual loss
+                    total_visual_loss = torch.tensor(0)
+                    l_clip_fc, l_clip_conv, clip_conv_loss_sum = torch.tensor(0), [], torch.tensor(0)
+                    if self.x_cfg.clip.vis_loss > 0:
+                        l_clip_fc, l_clip_conv = self.clip_score_fn.compute_visual_distance(
+                            raster_sketch_aug, inputs_aug, clip_norm=False
+                        )
+                        clip_conv_loss_sum = sum(l_clip_conv)
+                        total_visual_loss = self.x_cfg.clip.vis_loss * (clip_conv_loss_sum + l_clip_fc)
+
+                    # text-visual loss
+                    l_tvd = torch.tensor(0.)
+                    if self.cargs.text_visual_coeff > 0:
+                        l_tvd = self.clip_score_fn.compute_text_visual_distance(
+                            raster_sketch_aug, prompt
+                        ) * self.cargs.text_visual_coeff
+
+                    # perceptual loss
+                    l_percep = torch.tensor(0.)
+                    if perceptual_loss_fn is not None:
+                        l_perceptual = perceptual_loss_fn(raster_sketch, inputs).mean()
+                        l_percep = l_perceptual * self.x_cfg.perceptual.coeff
+
+                    # style loss
+                    feat_content = self.style_extractor(raster_sketch)
+                    xx, xy = sample_indices(feat_content[0], shuffle=True)
+                    l_style = self.x_cfg.style_strength * self.style_loss.forward(
+                        feat_content, feat_content, style_stats, [xx, xy], 0
                     )
-                    clip_conv_loss_sum = sum(l_clip_conv)
-                    total_visual_loss = self.x_cfg.clip.vis_loss * (clip_conv_loss_sum + l_clip_fc)
-
-                # text-visual loss
-                l_tvd = torch.tensor(0.)
-                if self.cargs.text_visual_coeff > 0:
-                    l_tvd = self.clip_score_fn.compute_text_visual_distance(
-                        raster_sketch_aug, prompt
-                    ) * self.cargs.text_visual_coeff
-
-                # perceptual loss
-                l_percep = torch.tensor(0.)
-                if perceptual_loss_fn is not None:
-                    l_perceptual = perceptual_loss_fn(raster_sketch, inputs).mean()
-                    l_percep = l_perceptual * self.x_cfg.perceptual.coeff
-
-                # style loss
-                feat_content = self.style_extractor(raster_sketch)
-                xx, xy = sample_indices(feat_content[0], feat_style)
-                np.random.shuffle(xx)
-                np.random.shuffle(xy)
-                l_style = self.x_cfg.style_strength * self.style_loss.forward(
-                    feat_content, feat_content, feat_style, [xx, xy], 0
-                )
-
-                # total loss
-                loss = sds_loss + total_visual_loss + l_tvd + l_percep + l_style
+
+                    # total loss
+                    loss = sds_loss + total_visual_loss + l_tvd + l_percep + l_style
+                loss = self.precision.cast(loss)
 
                 # optimization
                 optimizer.zero_grad_()
@@ -371,16 +417,9 @@ class StylizedDiffSketcherPipeline(ModelState):
                     optimizer.update_lr(self.step, self.x_cfg.decay_steps)
 
                 # records
-                pbar.set_description(
-                    f"lr: {optimizer.get_lr():.2f}, "
-                    f"l_total: {loss.item():.4f}, "
-                    f"l_clip_fc: {l_clip_fc.item():.4f}, "
-                    f"l_clip_conv({len(l_clip_conv)}): {clip_conv_loss_sum.item():.4f}, "
-                    f"l_tvd: {l_tvd.item():.4f}, "
-                    f"l_percep: {l_percep.item():.4f}, "
-                    f"l_style: {l_style.item():.4f}, "
-                    f"sds: {grad.item():.4e}"
-                )
+                self.log_metrics(pbar, lr=optimizer.get_lr(),
+                                 l_total=loss, l_clip_fc=l_clip_fc, l_clip_conv=clip_conv_loss_sum,
+                                 l_tvd=l_tvd, l_percep=l_percep, l_style=l_style, sds=grad)
 
                 # log raster and svg
                 if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
@@ -395,13 +434,14 @@ class StylizedDiffSketcherPipeline(ModelState):
                     # log svg
                     renderer.save_svg(self.svg_logs_dir.as_posix(), f"svg_iter{self.step}")
                     # log cross attn
-                    if self.x_cfg.log_cross_attn:
-                        controller = AttentionStore()
+                    if self.x_cfg.log_cross_attn and self.cross_attn_maps is not None:
+                        # the prompt is fixed, so the maps of the sampling pass are re-rendered
                         _, _ = self.diffusion.get_cross_attention([prompt],
-                                                                  controller,
+                                                                  None,
                                                                   res=self.x_cfg.cross_attn_res,
                                                                   from_where=("up", "down"),
-                                                                  save_path=self.attn_logs_dir / f"iter{self.step}.png")
+                                                                  save_path=self.attn_logs_dir / f"iter{self.step}.png",
+                                                                  attention_maps=self.cross_attn_maps)
 
                 # logging the best raster images and SVG
                 if self.step % self.args.eval_step == 0 and self.accelerator.is_main_process:
@@ -481,15 +521,11 @@ class StylizedDiffSketcherPipeline(ModelState):
         self.print(f"load style file from: {style_path.as_posix()}")
         shutil.copy(style_fpath, self.result_path)  # copy style file
 
-        # extract style features from style image
-        feat_style = None
-        for i in range(5):
-            with torch.no_grad():
-                # r is region of interest (mask)
-                feat_e = self.style_extractor.forward_samples_hypercolumn(style_img, samps=1000)
-                feat_style = feat_e if feat_style is None else torch.cat((feat_style, feat_e), dim=2)
+        # extract style features from style image, and the statistics of the style loss
+        style_stats = load_style_statistics(self.style_extractor, self.style_loss, style_img,
+                                            cache_dir=self.x_cfg.get('style_cache_dir', None))
 
-        return style_img, feat_style
+        return style_img, style_stats
 
     def style_file_preprocess(self, style_path):
         process_comp = transforms.Compose([
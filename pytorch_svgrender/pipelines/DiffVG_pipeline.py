@@ -7,7 +7,7 @@
 import shutil
 from pathlib import Path
 from functools import partial
-from typing import AnyStr
+from typing import AnyStr, List
 from PIL import Image
 
 from tqdm.auto import tqdm
@@ -15,9 +15,9 @@ import torch
 from torchvision import transforms
 
 from pytorch_svgrender.libs.engine import ModelState
-from pytorch_svgrender.libs.metric.lpips_origin import LPIPS
 from pytorch_svgrender.painter.diffvg import Painter, PainterOptimizer
 from pytorch_svgrender.plt import plot_img, plot_couple
+from pytorch_svgrender.utils.target_images import batch_img2svg
 
 
 class DiffVGPipeline(ModelState):
@@ -55,6 +55,28 @@ class DiffVGPipeline(ModelState):
         target_img = target_img.to(self.device)
         return target_img
 
+    def get_recon_loss_fn(self):
+        """reconstruction loss of `x.loss_type`, returns one loss per sample"""
+        perceptual_loss_fn = None
+        if self.x_cfg.loss_type in ['lpips', 'l2+lpips']:
+            from pytorch_svgrender.libs.metric.lpips_origin import LPIPS
+
+            lpips_loss_fn = LPIPS(net=self.x_cfg.perceptual.lpips_net).to(self.device)
+            perceptual_loss_fn = partial(lpips_loss_fn.forward, return_per_layer=False, normalize=False)
+
+        def recon_loss_fn(raster_img, target_img):
+            if self.x_cfg.loss_type == 'l1':
+                return (raster_img - target_img).abs().mean(dim=(1, 2, 3))
+            elif self.x_cfg.loss_type == 'lpips':
+                return perceptual_loss_fn(raster_img, target_img).flatten(1).mean(1)
+
+            loss_mse = ((raster_img - target_img) ** 2).mean(dim=(1, 2, 3))
+            if self.x_cfg.loss_type == 'l2+lpips':
+                return loss_mse + perceptual_loss_fn(raster_img, target_img).flatten(1).mean(1)
+            return loss_mse  # default: MSE loss
+
+        return recon_loss_fn
+
     def painterly_rendering(self, img_path: AnyStr):
         # load target file
         target_file = Path(img_path)
@@ -81,9 +103,8 @@ class DiffVGPipeline(ModelState):
         optimizer.init_optimizer()
 
         # Set Loss
-        if self.x_cfg.loss_type in ['lpips', 'l2+lpips']:
-            lpips_loss_fn = LPIPS(net=self.x_cfg.perceptual.lpips_net).to(self.device)
-            perceptual_loss_fn = partial(lpips_loss_fn.forward, return_per_layer=False, normalize=False)
+        recon_loss_fn = self.get_recon_loss_fn()
+        svg_traj = self.trajectory_writer(self.svg_logs_dir / "trajectory")
 
         with tqdm(initial=self.step, total=num_iter, disable=not self.accelerator.is_main_process) as pbar:
             while self.step < num_iter:
@@ -94,24 +115,12 @@ class DiffVGPipeline(ModelState):
                     self.frame_idx += 1
 
                 # Reconstruction Loss
-                if self.x_cfg.loss_type == 'l1':
-                    loss_recon = torch.nn.functional.l1_loss(raster_img, target_img)
-                elif self.x_cfg.loss_type == 'lpips':
-                    loss_recon = perceptual_loss_fn(raster_img, target_img).mean()
-                elif self.x_cfg.loss_type == 'l2':  # default: MSE loss
-                    loss_recon = torch.nn.functional.mse_loss(raster_img, target_img)
-                elif self.x_cfg.loss_type == 'l2+lpips':  # default: MSE loss
-                    lpips = perceptual_loss_fn(raster_img, target_img).mean()
-                    loss_mse = torch.nn.functional.mse_loss(raster_img, target_img)
-                    loss_recon = loss_mse + lpips
+                loss_recon = recon_loss_fn(raster_img, target_img).mean()
 
                 # total loss
                 loss = loss_recon
 
-                pbar.set_description(
-                    f"lr: {optimizer.get_lr():.4f}, "
-                    f"L_recon: {loss_recon.item():.4f}"
-                )
+                self.log_metrics(pbar, lr=optimizer.get_lr(), L_recon=loss_recon)
 
                 # optimization
                 optimizer.zero_grad_()
@@ -129,12 +138,17 @@ class DiffVGPipeline(ModelState):
                                 self.step,
                                 output_dir=self.png_logs_dir.as_posix(),
                                 fname=f"iter{self.step}")
-                    renderer.save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
+                    if svg_traj is not None:
+                        svg_traj.append(self.step, renderer)
+                    else:
+                        renderer.save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
 
                 self.step += 1
                 pbar.update(1)
 
         # end rendering
+        if svg_traj is not None:
+            svg_traj.close()
         renderer.save_svg(self.result_path / "final_render.svg")
 
         if self.make_video:
@@ -148,3 +162,44 @@ class DiffVGPipeline(ModelState):
             ])
 
         self.close(msg="painterly rendering complete.")
+
+    def fit_group(self, target_imgs: List[torch.Tensor], recon_loss_fn):
+        """optimize one SVG per target in lockstep, the targets share the canvas size"""
+        renderers, optimizers = [], []
+        for target_img in target_imgs:
+            renderer = Painter(target_img,
+                               self.args.diffvg,
+                               canvas_size=[target_img.shape[3], target_img.shape[2]],
+                               path_type=self.x_cfg.path_type,
+                               max_width=self.x_cfg.max_width,
+                               device=self.device)
+            renderer.init_image(num_paths=self.x_cfg.num_paths)
+            optimizer = PainterOptimizer(renderer, self.x_cfg.num_iter, self.x_cfg.lr_base,
+                                         trainable_stroke=self.x_cfg.path_type == 'unclosed')
+            optimizer.init_optimizer()
+            renderers.append(renderer)
+            optimizers.append(optimizer)
+
+        targets = torch.cat(target_imgs, dim=0)
+
+        for step in tqdm(range(self.x_cfg.num_iter), disable=not self.accelerator.is_main_process):
+            raster_imgs = torch.cat([r.get_image(step).to(self.device) for r in renderers], dim=0)
+            # the scenes are independent, summing keeps the per-image gradients
+            losses = recon_loss_fn(raster_imgs, targets)
+
+            for optimizer in optimizers:
+                optimizer.zero_grad_()
+            losses.sum().backward()
+            for renderer, optimizer in zip(renderers, optimizers):
+                optimizer.step_()
+                renderer.clip_curve_shape()
+                if self.x_cfg.lr_schedule:
+                    optimizer.update_lr()
+
+        return renderers, raster_imgs.split(1), losses.tolist()
+
+    def batch_rendering(self, target: AnyStr):
+        """vectorize all images of a directory or manifest, see `batch_img2svg`"""
+        fit_group = partial(self.fit_group, recon_loss_fn=self.get_recon_loss_fn())
+        batch_img2svg(self, target, image_size=self.x_cfg.batch.image_size, fit_group=fit_group)
+        self.close(msg="batch rendering complete.")
@@ -6,7 +6,7 @@
 
 import shutil
 from pathlib import Path
-from typing import AnyStr
+from typing import AnyStr, List
 from PIL import Image
 
 from tqdm.auto import tqdm
@@ -16,6 +16,7 @@ from torchvision import transforms
 from pytorch_svgrender.libs.engine import ModelState
 from pytorch_svgrender.painter.live import Painter, PainterOptimizer, xing_loss_fn
 from pytorch_svgrender.plt import plot_img, plot_couple
+from pytorch_svgrender.utils.target_images import batch_img2svg
 
 
 class LIVEPipeline(ModelState):
@@ -61,6 +62,14 @@ class LIVEPipeline(ModelState):
         target_img = target_img.to(self.device)
         return target_img
 
+    def recon_loss(self, raster_img, target_img, loss_weight):
+        # UDF Loss for Reconstruction
+        if self.x_cfg.use_l1_loss:
+            return torch.nn.functional.l1_loss(raster_img, target_img)
+        # default: MSE loss
+        loss_mse = ((raster_img - target_img) ** 2)
+        return (loss_mse.sum(1) * loss_weight).mean()
+
     def painterly_rendering(self, img_path: AnyStr):
         # load target file
         target_file = Path(img_path)
@@ -95,6 +104,7 @@ class LIVEPipeline(ModelState):
         ]
 
         pathn_record = []
+        svg_traj = self.trajectory_writer(self.svg_logs_dir / "trajectory")
         loss_weight_keep = 0
         loss_weight = 1
 
@@ -109,6 +119,9 @@ class LIVEPipeline(ModelState):
                 plot_img(img, self.result_path, fname=f"init_img_{path_idx}")
                 # rebuild optimizer
                 optimizer_list[path_idx].init_optimizers()
+                # with `freeze_previous_groups`, the previous path groups are not optimized any more
+                active_groups = [path_idx] if self.x_cfg.get('freeze_previous_groups', False) else range(path_idx + 1)
+                renderer.set_active_parameters(p for i in active_groups for p in optimizer_list[i].parameters())
 
                 pbar.write(f"=> adding {pathn} paths, n_path: {sum(pathn_record)}, "
                            f"path_schedule: {self.x_cfg.path_schedule}")
@@ -124,37 +137,29 @@ class LIVEPipeline(ModelState):
                         loss_weight = renderer.calc_distance_weight(loss_weight_keep)
 
                     # UDF Loss for Reconstruction
-                    if self.x_cfg.use_l1_loss:
-                        loss_recon = torch.nn.functional.l1_loss(raster_img, target_img)
-                    else:  # default: MSE loss
-                        loss_mse = ((raster_img - target_img) ** 2)
-                        loss_recon = (loss_mse.sum(1) * loss_weight).mean()
+                    loss_recon = self.recon_loss(raster_img, target_img, loss_weight)
 
                     # Xing Loss for Self-Interaction Problem
                     loss_xing = xing_loss_fn(renderer.get_point_parameters()) * self.x_cfg.xing_loss_weight
                     # total loss
                     loss = loss_recon + loss_xing
 
-                    pbar.set_description(
-                        f"lr: {optimizer_list[path_idx].get_lr():.4f}, "
-                        f"L_total: {loss.item():.4f}, "
-                        f"L_recon: {loss_recon.item():.4f}, "
-                        f"L_xing: {loss_xing.item()}"
-                    )
+                    self.log_metrics(pbar, lr=optimizer_list[path_idx].get_lr(),
+                                     L_total=loss, L_recon=loss_recon, L_xing=loss_xing)
 
                     # optimization
-                    for i in range(path_idx + 1):
+                    for i in active_groups:
                         optimizer_list[i].zero_grad_()
 
                     loss.backward()
 
-                    for i in range(path_idx + 1):
+                    for i in active_groups:
                         optimizer_list[i].step_()
 
                     renderer.clip_curve_shape()
 
                     if self.x_cfg.lr_schedule:
-                        for i in range(path_idx + 1):
+                        for i in active_groups:
                             optimizer_list[i].update_lr()
 
                     if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
@@ -163,7 +168,10 @@ class LIVEPipeline(ModelState):
                                     self.step,
                                     output_dir=self.png_logs_dir.as_posix(),
                                     fname=f"iter{self.step}")
-                        renderer.save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
+                        if svg_traj is not None:
+                            svg_traj.append(self.step, renderer)
+                        else:
+                            renderer.save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
 
                     self.step += 1
                     pbar.update(1)
@@ -174,6 +182,8 @@ class LIVEPipeline(ModelState):
                 # recalculate the coordinates for the new join path
                 renderer.component_wise_path_init(pred=raster_img, init_type=self.x_cfg.coord_init)
 
+        if svg_traj is not None:
+            svg_traj.close()
         renderer.save_svg(self.result_path / "final_render.svg")
 
         if self.make_video:
@@ -187,3 +197,74 @@ class LIVEPipeline(ModelState):
             ])
 
         self.close(msg="painterly rendering complete.")
+
+    def fit_group(self, target_imgs: List[torch.Tensor]):
+        """optimize one SVG per target in lockstep, following the same path schedule"""
+        path_schedule = self.get_path_schedule(self.x_cfg.schedule_each)
+        num_iter = self.x_cfg.num_iter
+        n = len(target_imgs)
+
+        renderers, optimizer_lists = [], []
+        for target_img in target_imgs:
+            renderer = Painter(target_img,
+                               self.args.diffvg,
+                               self.x_cfg.num_segments,
+                               self.x_cfg.segment_init,
+                               self.x_cfg.radius,
+                               canvas_size=self.x_cfg.image_size,
+                               trainable_bg=self.x_cfg.trainable_bg,
+                               stroke=self.x_cfg.train_stroke,
+                               stroke_width=self.x_cfg.width,
+                               device=self.device)
+            renderer.component_wise_path_init(pred=None, init_type=self.x_cfg.coord_init)
+            renderers.append(renderer)
+            optimizer_lists.append([
+                PainterOptimizer(renderer, num_iter, self.x_cfg.lr_base,
+                                 self.x_cfg.train_stroke, self.x_cfg.trainable_bg)
+                for _ in range(len(path_schedule))
+            ])
+
+        loss_weight_keep = [0] * n
+        loss_weight = [1] * n
+        for path_idx, pathn in enumerate(path_schedule):
+            # with `freeze_previous_groups`, the previous path groups are not optimized any more
+            active_groups = [path_idx] if self.x_cfg.get('freeze_previous_groups', False) else range(path_idx + 1)
+            for renderer, optimizer_list in zip(renderers, optimizer_lists):
+                renderer.init_image(num_paths=pathn)
+                optimizer_list[path_idx].init_optimizers()
+                renderer.set_active_parameters(p for i in active_groups for p in optimizer_list[i].parameters())
+
+            for t in tqdm(range(num_iter), disable=not self.accelerator.is_main_process):
+                raster_imgs, losses = [], []
+                for k, (renderer, target_img) in enumerate(zip(renderers, target_imgs)):
+                    raster_img = renderer.get_image(step=t).to(self.device)
+                    if self.x_cfg.use_distance_weighted_loss:
+                        loss_weight[k] = renderer.calc_distance_weight(loss_weight_keep[k])
+                    loss_recon = self.recon_loss(raster_img, target_img, loss_weight[k])
+                    loss_xing = xing_loss_fn(renderer.get_point_parameters()) * self.x_cfg.xing_loss_weight
+                    raster_imgs.append(raster_img)
+                    losses.append(loss_recon + loss_xing)
+
+                for optimizer_list in optimizer_lists:
+                    for i in active_groups:
+                        optimizer_list[i].zero_grad_()
+                # the scenes are independent, summing keeps the per-image gradients
+                torch.stack(losses).sum().backward()
+                for renderer, optimizer_list in zip(renderers, optimizer_lists):
+                    for i in active_groups:
+                        optimizer_list[i].step_()
+                        if self.x_cfg.lr_schedule:
+                            optimizer_list[i].update_lr()
+                    renderer.clip_curve_shape()
+
+            for k, renderer in enumerate(renderers):
+                if self.x_cfg.use_distance_weighted_loss:
+                    loss_weight_keep[k] = loss_weight[k].detach().cpu().numpy() * 1
+                renderer.component_wise_path_init(pred=raster_imgs[k], init_type=self.x_cfg.coord_init)
+
+        return renderers, raster_imgs, [loss.item() for loss in losses]
+
+    def batch_rendering(self, target: AnyStr):
+        """vectorize all images of a directory or manifest, see `batch_img2svg`"""
+        batch_img2svg(self, target, image_size=self.x_cfg.image_size, fit_group=self.fit_group)
+        self.close(msg="batch rendering complete.")
@@ -3,6 +3,7 @@
 # Author: XiMing Xing
 # Description:
 import pathlib
+from contextlib import nullcontext
 from PIL import Image
 from typing import AnyStr
 
@@ -18,13 +19,16 @@ from pytorch_svgrender.libs.solver.optim import get_optimizer
 from pytorch_svgrender.painter.svgdreamer import Painter, PainterOptimizer
 from pytorch_svgrender.painter.svgdreamer.painter_params import CosineWithWarmupLRLambda
 from pytorch_svgrender.painter.live import xing_loss_fn
-from pytorch_svgrender.painter.svgdreamer import VectorizedParticleSDSPipeline
+from pytorch_svgrender.painter.svgdreamer import VectorizedParticleSDSPipeline, PhiWarmStart
 from pytorch_svgrender.plt import plot_img
 from pytorch_svgrender.utils.color_attrs import init_tensor_with_color
 from pytorch_svgrender.token2attn.ptp_utils import view_images
-from pytorch_svgrender.model_helper import model2res
+from pytorch_svgrender.model_helper import model2res, StageOffloadManager, DiffVGState, SVGScene, LatentProxySwitch
+from pytorch_svgrender.utils.prompt_index import PromptWarmStart
+from pytorch_svgrender.libs.utils import lazy
 
-import ImageReward as RM
+# only needed by ReFL
+RM = lazy.load('ImageReward')
 
 
 class SVGDreamerPipeline(ModelState):
@@ -34,9 +38,12 @@ class SVGDreamerPipeline(ModelState):
         assert args.x.guidance.n_particle >= args.x.guidance.vsd_n_particle
         assert args.x.guidance.n_particle >= args.x.guidance.phi_n_particle
         assert args.x.guidance.n_phi_sample >= 1
+        # the SIVE initialization is not part of this implementation
+        assert args.x.skip_sive, "SIVE is not supported, set `x.skip_sive=True` to optimize with VPSD from scratch " \
+                                 "(or start from an SVG with `x.path_svg=<file>.svg`)."
 
         logdir_ = f"sd{args.seed}" \
-                  f"-{'vpsd' if args.x.skip_sive else 'sive'}" \
+                  "-vpsd" \
                   f"-{args.x.model_id}" \
                   f"-{args.x.style}" \
                   f"-P{args.x.num_paths}" \
@@ -81,6 +88,32 @@ class SVGDreamerPipeline(ModelState):
         if self.x_cfg.guidance.phi_ReFL:
             self.reward_model = RM.load("ImageReward-v1.0", device=self.device, download_root=self.x_cfg.reward_path)
 
+        # stage-aware offloading: the reward model is only used every `phi_sample_step` steps
+        self.offload = None
+        if self.reward_model is not None and self.x_cfg.get('stage_offload', None) is not None:
+            self.offload = StageOffloadManager(self.device,
+                                               target=self.x_cfg.stage_offload,
+                                               offload_dir=self.result_path / "offload")
+            self.offload.register('reward_model', self.reward_model)
+            self.offload.declare_stage('vpsd', needs=[])
+            self.offload.declare_stage('reward', needs=['reward_model'])
+            self.offload.enter('vpsd')
+
+        # warm start from the result of the most similar previous prompt
+        self.warm_start = None
+        if self.x_cfg.get('warm_start', None) is not None and self.x_cfg.warm_start.enable:
+            self.warm_start = PromptWarmStart(self.x_cfg.warm_start,
+                                              method=f"{self.x_cfg.method}-{self.x_cfg.style}",
+                                              device=self.device)
+        # warm start the phi model from the one trained for the most similar previous prompt
+        self.phi_warm_start = None
+        if self.x_cfg.get('phi_warm_start', None) is not None and self.x_cfg.phi_warm_start.enable:
+            self.phi_warm_start = PhiWarmStart(self.x_cfg.phi_warm_start,
+                                               style=self.x_cfg.style,
+                                               device=self.device,
+                                               model_id=self.x_cfg.model_id,
+                                               guidance_cfg=self.x_cfg.guidance)
+
         self.style = self.x_cfg.style
         if self.style == "pixelart":
             self.x_cfg.lr_stage_one.lr_schedule = False
@@ -98,10 +131,6 @@ class SVGDreamerPipeline(ModelState):
         target_img = target_img.to(self.device)
         return target_img
 
-    def SIVE_stage(self, text_prompt: str):
-        # TODO: SIVE implementation
-        pass
-
     def painterly_rendering(self, text_prompt: str, target_file: AnyStr = None):
         # log prompts
         self.print(f"prompt: {text_prompt}")
@@ -114,9 +143,19 @@ class SVGDreamerPipeline(ModelState):
         total_step = self.x_cfg.guidance.num_iter
         path_reinit = self.x_cfg.path_reinit
 
+        # `x.path_svg` is the SVG to fine-tune, unless the caller passes one
+        target_file = target_file or self.x_cfg.get('path_svg', None)
         init_from_target = True if (target_file and pathlib.Path(target_file).exists()) else False
+        if not init_from_target and self.warm_start is not None:
+            warm_hit = self.warm_start.lookup(text_prompt)
+            if warm_hit is not None:
+                # fine-tune the nearest previous result with a shortened schedule
+                similarity, target_file = warm_hit
+                init_from_target = True
+                total_step = self.warm_start.shorten(total_step)
+                self.print(f"warm start from `{target_file}`, prompt similarity: {similarity:.3f}")
         # switch mode
-        if self.x_cfg.skip_sive and not init_from_target:
+        if not init_from_target:
             # mode 1: optimization with VPSD from scratch
             # randomly init
             self.print("optimization with VPSD from scratch...")
@@ -129,36 +168,29 @@ class SVGDreamerPipeline(ModelState):
 
             # log init target_img
             plot_img(target_img, self.result_path, fname='init_target_img')
-            final_svg_path = None
-        elif init_from_target:
+            scene = None
+        else:
             # mode 2: load the SVG file and finetune it
             self.print(f"load svg from {target_file} ...")
             self.print(f"SVG fine-tuning via VPSD...")
-            final_svg_path = target_file
+            # parsed once, then shared by all particles
+            scene = SVGScene(*DiffVGState.load_svg(target_file))
             if self.x_cfg.color_init == 'target_randn':
                 # special order: init newly paths color use random color
                 target_img = torch.randn(1, 3, im_size, im_size)
                 self.print("color: randomly init")
             else:
-                # load the SVG and init newly paths color use target_img
-                # note: the target will be converted to png via pydiffvg when load_renderer called
+                # init newly paths color use the rasterized SVG, see `scene_target`
                 target_img = None
-        else:
-            # mode 3: text-to-img-to-svg (two stage)
-            target_img, final_svg_path = self.SIVE_stage(text_prompt)
-            self.x_cfg.path_svg = final_svg_path
-            self.print("\n SVG fine-tuning via VPSD...")
-            plot_img(target_img, self.result_path, fname='init_target_img')
 
         # create svg renderer
-        renderers = [self.load_renderer(final_svg_path) for _ in range(n_particle)]
+        renderers = [self.load_renderer(scene=scene) for _ in range(n_particle)]
 
         # randomly initialize the particles
-        if self.x_cfg.skip_sive or init_from_target:
-            if target_img is None:
-                target_img = self.target_file_preprocess(self.result_path / 'target_img.png')
-            for render in renderers:
-                render.component_wise_path_init(gt=target_img, pred=None, init_type='random')
+        if target_img is None:
+            target_img = self.scene_target(renderers[0], scene)
+        for render in renderers:
+            render.component_wise_path_init(gt=target_img, pred=None, init_type='random')
 
         # log init images
         for i, r in enumerate(renderers):
@@ -170,12 +202,22 @@ class SVGDreamerPipeline(ModelState):
         for renderer in renderers:
             optim_ = PainterOptimizer(renderer,
                                       self.style,
-                                      guidance_cfg.num_iter,
+                                      total_step,
                                       self.x_cfg.lr_stage_two,
                                       self.x_cfg.trainable_bg)
             optim_.init_optimizers()
             optimizers.append(optim_)
 
+        # load the phi model of the most similar previous prompt
+        phi_warmup_steps = guidance_cfg.phi_schedule.warmup_steps
+        if self.phi_warm_start is not None:
+            phi_hit = self.phi_warm_start.lookup(text_prompt)
+            if phi_hit is not None:
+                similarity, phi_path = phi_hit
+                self.pipeline.load_phi_state_dict(torch.load(phi_path, map_location='cpu'))
+                phi_warmup_steps = self.phi_warm_start.shorten_warmup(phi_warmup_steps)
+                self.print(f"phi model warm start from `{phi_path}`, prompt similarity: {similarity:.3f}")
+
         # init phi_model optimizer
         phi_optimizer = get_optimizer('adamW',
                                       self.pipeline.phi_params,
@@ -186,7 +228,7 @@ class SVGDreamerPipeline(ModelState):
         schedule_cfg = guidance_cfg.phi_schedule
         if schedule_cfg.use:
             phi_lr_lambda = CosineWithWarmupLRLambda(num_steps=schedule_cfg.total_step,
-                                                     warmup_steps=schedule_cfg.warmup_steps,
+                                                     warmup_steps=phi_warmup_steps,
                                                      warmup_start_lr=schedule_cfg.warmup_start_lr,
                                                      warmup_end_lr=schedule_cfg.warmup_end_lr,
                                                      cosine_end_lr=schedule_cfg.cosine_end_lr)
@@ -199,7 +241,12 @@ class SVGDreamerPipeline(ModelState):
         L_reward = torch.tensor(0.)
 
         self.step = 0  # reset global step
+        svg_trajs = [self.trajectory_writer(self.ft_svg_logs_dir / f"trajectory_p{i}") for i in range(n_particle)]
+
         self.print(f"\ntotal VPSD optimization steps: {total_step}")
+        # the learned RGB-to-latent proxy replaces the VAE encoder, except for the last steps
+        latent_proxy = LatentProxySwitch.from_cfg(self.x_cfg.guidance.get('latent_proxy', None),
+                                                  self.x_cfg.model_id, self.pipeline, self.device)
         with tqdm(initial=self.step, total=total_step, disable=not self.accelerator.is_main_process) as pbar:
             while self.step < total_step:
                 # set particles
@@ -210,6 +257,7 @@ class SVGDreamerPipeline(ModelState):
                     plot_img(raster_imgs, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
+                latent_proxy.update(self.step, total_step)
                 L_guide, grad, latents, t_step = self.pipeline.variational_score_distillation(
                     raster_imgs.to(self.weight_dtype),
                     self.step,
@@ -245,6 +293,10 @@ class SVGDreamerPipeline(ModelState):
 
                 # reward learning
                 if guidance_cfg.phi_ReFL and self.step % guidance_cfg.phi_sample_step == 0:
+                    # load the reward model while sampling from the phi model
+                    if self.offload is not None:
+                        self.offload.prefetch('reward')
+
                     with torch.no_grad():
                         phi_outputs = []
                         phi_sample_paths = []
@@ -263,7 +315,9 @@ class SVGDreamerPipeline(ModelState):
                                     num_rows=max(len(phi_outputs) // 6, 1),
                                     fp=self.phi_samples_dir / f'samples_iter{self.step}.png')
 
-                    ranking, rewards = self.reward_model.inference_rank(text_prompt, phi_sample_paths)
+                    reward_stage = self.offload.stage('reward') if self.offload is not None else nullcontext()
+                    with reward_stage:
+                        ranking, rewards = self.reward_model.inference_rank(text_prompt, phi_sample_paths)
                     self.print(f"ranking: {ranking}, reward score: {rewards}")
 
                     for k in range(guidance_cfg.n_phi_sample):
@@ -297,23 +351,12 @@ class SVGDreamerPipeline(ModelState):
                     for opt_ in optimizers:
                         opt_.update_lr()
 
-                # log pretrained model lr
-                lr_str = ""
-                for k, lr in optimizers[0].get_lr().items():
-                    lr_str += f"{k}_lr: {lr:.4f}, "
-                # log phi model lr
-                cur_phi_lr = phi_optimizer.param_groups[0]['lr']
-                lr_str += f"phi_lr: {cur_phi_lr:.3e}, "
-
-                pbar.set_description(
-                    lr_str +
-                    f"t: {t_step.item():.2f}, "
-                    f"L_total: {loss.item():.4f}, "
-                    f"L_add: {L_add.item():.4e}, "
-                    f"L_lora: {L_lora.item():.4f}, "
-                    f"L_reward: {L_reward.item():.4f}, "
-                    f"vpsd: {grad.item():.4e}"
-                )
+                # log pretrained model lr and phi model lr
+                lrs = {f"{k}_lr": lr for k, lr in optimizers[0].get_lr().items()}
+                lrs['phi_lr'] = phi_optimizer.param_groups[0]['lr']
+
+                self.log_metrics(pbar, **lrs,
+                                 t=t_step, L_total=loss, L_add=L_add, L_lora=L_lora, L_reward=L_reward, vpsd=grad)
 
                 if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
                     # save png
@@ -322,17 +365,31 @@ class SVGDreamerPipeline(ModelState):
 
                     # save svg
                     for i, r in enumerate(renderers):
-                        r.pretty_save_svg(self.ft_svg_logs_dir / f"svg_iter{self.step}_p{i}.svg")
+                        if svg_trajs[i] is not None:
+                            svg_trajs[i].append(self.step, r)
+                        else:
+                            r.pretty_save_svg(self.ft_svg_logs_dir / f"svg_iter{self.step}_p{i}.svg")
 
                 self.step += 1
                 pbar.update(1)
 
+        for svg_traj in svg_trajs:
+            if svg_traj is not None:
+                svg_traj.close()
+
         # save final
         for i, r in enumerate(renderers):
             final_svg_path = self.result_path / f"finetune_final_p_{i}.svg"
             r.pretty_save_svg(final_svg_path)
         # save SVGs
         torchvision.utils.save_image(raster_imgs, fp=self.result_path / f'all_particles.png')
+        if self.warm_start is not None and self.accelerator.is_main_process:
+            self.warm_start.register(text_prompt, self.result_path / "finetune_final_p_0.svg",
+                                     meta={'seed': self.args.seed})
+        if self.phi_warm_start is not None and self.phi_warm_start.cfg.register and self.accelerator.is_main_process:
+            phi_path = self.result_path / "phi_model.pt"
+            torch.save(self.pipeline.phi_state_dict(), phi_path)
+            self.phi_warm_start.register(text_prompt, phi_path, meta={'seed': self.args.seed, 'step': self.step})
 
         if self.make_video:
             from subprocess import call
@@ -344,9 +401,11 @@ class SVGDreamerPipeline(ModelState):
                 (self.result_path / "svgdreamer_rendering.mp4").as_posix()
             ])
 
+        if self.offload is not None:
+            self.offload.close()
         self.close(msg="painterly rendering complete.")
 
-    def load_renderer(self, path_svg=None):
+    def load_renderer(self, path_svg=None, scene: SVGScene = None):
         renderer = Painter(self.args.diffvg,
                            self.style,
                            self.x_cfg.num_segments,
@@ -357,12 +416,14 @@ class SVGDreamerPipeline(ModelState):
                            self.x_cfg.trainable_bg,
                            self.x_cfg.width,
                            path_svg=path_svg,
+                           init_scene=scene,
                            device=self.device)
-
-        # if load a svg file, then rasterize it
-        save_path = self.result_path / 'target_img.png'
-        if path_svg is not None and (not save_path.exists()):
-            canvas_width, canvas_height, shapes, shape_groups = renderer.load_svg(path_svg)
-            render_img = renderer.render_image(canvas_width, canvas_height, shapes, shape_groups)
-            torchvision.utils.save_image(render_img, fp=save_path)
         return renderer
+
+    def scene_target(self, renderer: Painter, scene: SVGScene):
+        """rasterize the initial scene in memory, `target_img.png` is only written as a log"""
+        with torch.no_grad():
+            render_img = renderer.render_image(*scene)
+        torchvision.utils.save_image(render_img, fp=self.result_path / 'target_img.png')
+        resize = transforms.Resize(size=(self.x_cfg.image_size, self.x_cfg.image_size), antialias=True)
+        return resize(render_img)
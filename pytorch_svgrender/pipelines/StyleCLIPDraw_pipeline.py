@@ -10,11 +10,10 @@ import torch
 from torchvision import transforms
 import clip
 from tqdm.auto import tqdm
-import numpy as np
 
 from pytorch_svgrender.libs.engine import ModelState
 from pytorch_svgrender.painter.style_clipdraw import (
-    Painter, PainterOptimizer, VGG16Extractor, StyleLoss, sample_indices
+    Painter, PainterOptimizer, VGG16Extractor, StyleLoss, sample_indices, load_style_statistics
 )
 from pytorch_svgrender.plt import plot_img, plot_couple
 
@@ -88,13 +87,9 @@ class StyleCLIPDrawPipeline(ModelState):
         style_img = self.style_file_preprocess(style_pil)
         shutil.copy(style_fpath, self.result_path)  # copy style file
 
-        # extract style features from style image
-        feat_style = None
-        for i in range(5):
-            with torch.no_grad():
-                # r is region of interest (mask)
-                feat_e = self.style_extractor.forward_samples_hypercolumn(style_img, samps=1000)
-                feat_style = feat_e if feat_style is None else torch.cat((feat_style, feat_e), dim=2)
+        # extract style features from style image, and the statistics of the style loss
+        style_stats = load_style_statistics(self.style_extractor, self.style_loss, style_img,
+                                            cache_dir=self.x_cfg.get('style_cache_dir', None))
 
         # text prompt encoding
         self.print(f"prompt: {prompt}")
@@ -126,33 +121,28 @@ class StyleCLIPDrawPipeline(ModelState):
                     plot_img(rendering, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                rendering_aug = self.drawing_augment(rendering)
+                with self.precision.autocast():
+                    rendering_aug = self.drawing_augment(rendering)
 
-                loss = torch.tensor(0., device=self.device)
+                    loss = torch.tensor(0., device=self.device)
 
-                # do clip optimization
-                if self.step < 0.9 * total_step:
-                    for n in range(self.x_cfg.num_aug):
-                        loss -= torch.cosine_similarity(text_features, rendering_aug[n:n + 1], dim=1).mean()
+                    # do clip optimization
+                    if self.step < 0.9 * total_step:
+                        for n in range(self.x_cfg.num_aug):
+                            loss -= torch.cosine_similarity(text_features, rendering_aug[n:n + 1], dim=1).mean()
 
-                # do style optimization
-                # extract style features based on the approach from STROTSS [Kolkin et al., 2019].
-                feat_content = self.style_extractor(rendering)
+                    # do style optimization
+                    # extract style features based on the approach from STROTSS [Kolkin et al., 2019].
+                    feat_content = self.style_extractor(rendering)
 
-                xx, xy = sample_indices(feat_content[0], feat_style)
+                    xx, xy = sample_indices(feat_content[0], shuffle=True)
 
-                np.random.shuffle(xx)
-                np.random.shuffle(xy)
+                    L_style = self.style_loss.forward(feat_content, feat_content, style_stats, [xx, xy], 0)
 
-                L_style = self.style_loss.forward(feat_content, feat_content, feat_style, [xx, xy], 0)
+                    loss += L_style * style_weight
+                loss = self.precision.cast(loss)
 
-                loss += L_style * style_weight
-
-                pbar.set_description(
-                    f"lr: {optimizer.get_lr():.3f}, "
-                    f"L_train: {loss.item():.4f}, "
-                    f"L_style: {L_style.item():.4f}"
-                )
+                self.log_metrics(pbar, lr=optimizer.get_lr(), L_train=loss, L_style=L_style)
 
                 # optimization
                 optimizer.zero_grad_()
@@ -3,6 +3,7 @@
 # Author: XiMing Xing
 # Description:
 
+import pathlib
 from PIL import Image
 from typing import Union, AnyStr, List
 
@@ -12,6 +13,7 @@ import numpy as np
 from tqdm.auto import tqdm
 import torch
 from torchvision import transforms
+from accelerate.utils import set_seed
 import clip
 
 from pytorch_svgrender.libs.engine import ModelState
@@ -20,7 +22,9 @@ from pytorch_svgrender.painter.vectorfusion import channel_saturation_penalty_lo
 from pytorch_svgrender.painter.live import xing_loss_fn
 from pytorch_svgrender.plt import plot_img, plot_couple
 from pytorch_svgrender.token2attn.ptp_utils import view_images
-from pytorch_svgrender.model_helper import init_StableDiffusion_pipeline, model2res
+from pytorch_svgrender.model_helper import (init_StableDiffusion_pipeline, model2res, StageOffloadManager, SVGScene,
+                                            LatentProxySwitch)
+from pytorch_svgrender.utils.prompt_index import PromptWarmStart
 
 
 class VectorFusionPipeline(ModelState):
@@ -37,22 +41,7 @@ class VectorFusionPipeline(ModelState):
         super().__init__(args, log_path_suffix=logdir_)
 
         # create log dir
-        self.png_logs_dir = self.result_path / "png_logs"
-        self.svg_logs_dir = self.result_path / "svg_logs"
-        self.ft_png_logs_dir = self.result_path / "ft_png_logs"
-        self.ft_svg_logs_dir = self.result_path / "ft_svg_logs"
-        self.sd_sample_dir = self.result_path / 'sd_samples'
-        self.reinit_dir = self.result_path / "reinit_logs"
-
-        if self.accelerator.is_main_process:
-            self.png_logs_dir.mkdir(parents=True, exist_ok=True)
-            self.svg_logs_dir.mkdir(parents=True, exist_ok=True)
-            self.ft_png_logs_dir.mkdir(parents=True, exist_ok=True)
-            self.ft_svg_logs_dir.mkdir(parents=True, exist_ok=True)
-            self.sd_sample_dir.mkdir(parents=True, exist_ok=True)
-            self.reinit_dir.mkdir(parents=True, exist_ok=True)
-
-        self.select_fpth = self.result_path / 'select_sample.png'
+        self.set_log_dirs(self.result_path)
 
         # make video log
         self.make_video = self.args.mv
@@ -91,6 +80,25 @@ class VectorFusionPipeline(ModelState):
 
         self.g_device = torch.Generator(device=self.device).manual_seed(args.seed)
 
+        # stage-aware offloading: LIVE stage only needs the rasterizer
+        self.offload = None
+        if self.x_cfg.get('stage_offload', None) is not None:
+            self.offload = StageOffloadManager(self.device,
+                                               target=self.x_cfg.stage_offload,
+                                               offload_dir=self.result_path / "offload")
+            self.offload.register_pipeline(self.diffusion)
+            sd_modules = list(self.offload.modules.keys())
+            self.offload.declare_stage('sampling', needs=sd_modules)
+            self.offload.declare_stage('live', needs=[])
+            self.offload.declare_stage('sds', needs=[n for n in sd_modules if n != 'safety_checker'])
+
+        # warm start from the result of the most similar previous prompt
+        self.warm_start = None
+        if self.x_cfg.get('warm_start', None) is not None and self.x_cfg.warm_start.enable:
+            self.warm_start = PromptWarmStart(self.x_cfg.warm_start,
+                                              method=f"{self.x_cfg.method}-{self.x_cfg.style}",
+                                              device=self.device)
+
         self.style = self.x_cfg.style
         if self.style in ["pixelart", "low-poly"]:
             self.x_cfg.path_schedule = 'list'
@@ -100,6 +108,34 @@ class VectorFusionPipeline(ModelState):
             self.x_cfg.lr_stage_one.lr_schedule = False
             self.x_cfg.lr_stage_two.lr_schedule = False
 
+    def set_log_dirs(self, job_dir: pathlib.Path):
+        """all logs of a job are written under `job_dir`"""
+        self.job_dir = job_dir
+        self.png_logs_dir = job_dir / "png_logs"
+        self.svg_logs_dir = job_dir / "svg_logs"
+        self.ft_png_logs_dir = job_dir / "ft_png_logs"
+        self.ft_svg_logs_dir = job_dir / "ft_svg_logs"
+        self.sd_sample_dir = job_dir / 'sd_samples'
+        self.reinit_dir = job_dir / "reinit_logs"
+
+        if self.accelerator.is_main_process:
+            self.png_logs_dir.mkdir(parents=True, exist_ok=True)
+            self.svg_logs_dir.mkdir(parents=True, exist_ok=True)
+            self.ft_png_logs_dir.mkdir(parents=True, exist_ok=True)
+            self.ft_svg_logs_dir.mkdir(parents=True, exist_ok=True)
+            self.sd_sample_dir.mkdir(parents=True, exist_ok=True)
+            self.reinit_dir.mkdir(parents=True, exist_ok=True)
+
+        self.select_fpth = job_dir / 'select_sample.png'
+
+    def enter_stage(self, stage: str):
+        if self.offload is not None:
+            self.offload.enter(stage)
+
+    def prefetch_stage(self, stage: str):
+        if self.offload is not None:
+            self.offload.prefetch(stage)
+
     def get_path_schedule(self, schedule_each: Union[int, List]):
         if self.x_cfg.path_schedule == 'repeat':
             return int(self.x_cfg.num_paths / schedule_each) * [schedule_each]
@@ -167,9 +203,13 @@ class VectorFusionPipeline(ModelState):
     def LIVE_rendering(self, text_prompt: AnyStr):
         select_fpth = self.select_fpth
         # sampling K images
+        self.enter_stage('sampling')
         diffusion_samples = self.diffusion_sampling(text_prompt)
         # rejection sampling
         select_target = self.rejection_sampling(text_prompt, diffusion_samples)
+        # the diffusion model is idle until SDS fine-tuning
+        self.enter_stage('live')
+        self.start_metric_stage('live')
         select_target_pil = Image.fromarray(np.asarray(select_target))  # numpy to PIL
         select_target_pil.save(select_fpth)
 
@@ -192,6 +232,7 @@ class VectorFusionPipeline(ModelState):
 
         pathn_record = []
         loss_weight_keep = 0
+        svg_traj = self.trajectory_writer(self.svg_logs_dir / "trajectory")
 
         total_step = len(path_schedule) * self.x_cfg.num_iter
         with tqdm(initial=self.step, total=total_step, disable=not self.accelerator.is_main_process) as pbar:
@@ -200,9 +241,15 @@ class VectorFusionPipeline(ModelState):
                 pathn_record.append(pathn)
                 # init graphic
                 img = renderer.init_image(stage=0, num_paths=pathn)
-                plot_img(img, self.result_path, fname=f"init_img_{path_idx}")
+                plot_img(img, self.job_dir, fname=f"init_img_{path_idx}")
                 # rebuild optimizer
                 optimizer_list[path_idx].init_optimizers(pid_delta=int(path_idx * pathn))
+                # with `freeze_previous_groups`, the previous path groups are not optimized any more
+                active_groups = [path_idx] if self.x_cfg.get('freeze_previous_groups', False) else range(path_idx + 1)
+                renderer.set_active_parameters(p for i in active_groups for p in optimizer_list[i].parameters())
+                # the last path group, bring the diffusion model back while optimizing it
+                if path_idx == len(path_schedule) - 1:
+                    self.prefetch_stage('sds')
 
                 pbar.write(f"=> adding {pathn} paths, n_path: {sum(pathn_record)}, "
                            f"n_points: {len(renderer.get_point_parameters())}, "
@@ -233,30 +280,22 @@ class VectorFusionPipeline(ModelState):
                     # total loss
                     loss = loss_recon + loss_xing
 
-                    lr_str = ""
-                    for k, lr in optimizer_list[path_idx].get_lr().items():
-                        lr_str += f"{k}_lr: {lr:.4f}, "
-
-                    pbar.set_description(
-                        lr_str +
-                        f"L_total: {loss.item():.4f}, "
-                        f"L_recon: {loss_recon.item():.4f}, "
-                        f"L_xing: {loss_xing.item():.4e}"
-                    )
+                    lrs = {f"{k}_lr": lr for k, lr in optimizer_list[path_idx].get_lr().items()}
+                    self.log_metrics(pbar, **lrs, L_total=loss, L_recon=loss_recon, L_xing=loss_xing)
 
                     # optimization
-                    for i in range(path_idx + 1):
+                    for i in active_groups:
                         optimizer_list[i].zero_grad_()
 
                     loss.backward()
 
-                    for i in range(path_idx + 1):
+                    for i in active_groups:
                         optimizer_list[i].step_()
 
                     renderer.clip_curve_shape()
 
                     if self.x_cfg.lr_stage_one.lr_schedule:
-                        for i in range(path_idx + 1):
+                        for i in active_groups:
                             optimizer_list[i].update_lr()
 
                     if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
@@ -266,7 +305,10 @@ class VectorFusionPipeline(ModelState):
                                     prompt=text_prompt,
                                     output_dir=self.png_logs_dir.as_posix(),
                                     fname=f"iter{self.step}")
-                        renderer.pretty_save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
+                        if svg_traj is not None:
+                            svg_traj.append(self.step, renderer)
+                        else:
+                            renderer.pretty_save_svg(self.svg_logs_dir / f"svg_iter{self.step}.svg")
 
                     self.step += 1
                     pbar.update(1)
@@ -277,9 +319,12 @@ class VectorFusionPipeline(ModelState):
                 # recalculate the coordinates for the new join path
                 renderer.component_wise_path_init(target_img, raster_img)
 
-        # end LIVE
-        final_svg_fpth = self.result_path / "live_stage_one_final.svg"
-        renderer.pretty_save_svg(final_svg_fpth)
+        if svg_traj is not None:
+            svg_traj.close()
+        # end LIVE, the fine-tuning stage takes the scene over in memory
+        live_scene = renderer.export_scene()
+        if self.x_cfg.save_stage_svg:  # only a log artifact
+            renderer.pretty_save_svg(self.job_dir / "live_stage_one_final.svg")
 
         if self.make_video:
             from subprocess import call
@@ -291,34 +336,49 @@ class VectorFusionPipeline(ModelState):
                 (self.result_path / "VF_rendering_stage1.mp4").as_posix()
             ])
 
-        return target_img, final_svg_fpth
+        return target_img, live_scene
 
     def painterly_rendering(self, text_prompt: AnyStr):
+        if self.x_cfg.get('n_jobs', 1) > 1 or self.x_cfg.get('job_seeds', None):
+            return self.multi_job_rendering(text_prompt)
+
         # log prompts
         self.print(f"prompt: {text_prompt}")
         self.print(f"negative_prompt: {self.args.neg_prompt}\n")
 
-        if self.x_cfg.skip_live:
+        total_step = self.x_cfg.sds.num_iter
+        warm_hit = self.warm_start.lookup(text_prompt) if self.warm_start is not None else None
+        if warm_hit is not None:
+            # init from the nearest previous result with a shortened schedule
+            similarity, final_svg_fpth = warm_hit
+            target_img, live_scene = None, None
+            total_step = self.warm_start.shorten(total_step)
+            self.print(f"warm start from `{final_svg_fpth}`, prompt similarity: {similarity:.3f}")
+            self.print("fine-tune SVG via Score Distillation Sampling...")
+        elif self.x_cfg.skip_live:
             target_img = torch.randn(1, 3, self.x_cfg.image_size, self.x_cfg.image_size)
-            final_svg_fpth = None
+            final_svg_fpth, live_scene = None, None
             self.print("from scratch with Score Distillation Sampling...")
         else:
             # text-to-img-to-svg
-            target_img, final_svg_fpth = self.LIVE_rendering(text_prompt)
+            target_img, live_scene = self.LIVE_rendering(text_prompt)
+            final_svg_fpth = None
             torch.cuda.empty_cache()
-            self.x_cfg.path_svg = final_svg_fpth
             self.print("\nfine-tune SVG via Score Distillation Sampling...")
 
-        renderer = self.load_renderer(path_svg=final_svg_fpth)
+        self.enter_stage('sds')
+        renderer = self.load_renderer(path_svg=final_svg_fpth, scene=live_scene)
 
-        if self.x_cfg.skip_live:
+        if self.x_cfg.skip_live and warm_hit is None:
             renderer.component_wise_path_init(target_img, pred=None, init_type='random')
 
         img = renderer.init_image(stage=0, num_paths=self.x_cfg.num_paths)
         plot_img(img, self.result_path, fname=f"init_img_stage_two")
+        if target_img is None:  # warm start
+            target_img = img.detach()
 
         optimizer = PainterOptimizer(renderer, self.style,
-                                     self.x_cfg.sds.num_iter,
+                                     total_step,
                                      self.x_cfg.lr_stage_two,
                                      self.x_cfg.trainable_bg)
         optimizer.init_optimizers()
@@ -328,10 +388,14 @@ class VectorFusionPipeline(ModelState):
         self.print(f"-> Painter width Params: {len(renderer.get_width_parameters())}")
 
         self.step = 0  # reset global step
-        total_step = self.x_cfg.sds.num_iter
+        self.start_metric_stage('sds')
         path_reinit = self.x_cfg.path_reinit
+        svg_traj = self.trajectory_writer(self.ft_svg_logs_dir / "trajectory")
 
         self.print(f"\ntotal sds optimization steps: {total_step}")
+        # the learned RGB-to-latent proxy replaces the VAE encoder, except for the last steps
+        latent_proxy = LatentProxySwitch.from_cfg(self.x_cfg.sds.get('latent_proxy', None),
+                                                  self.x_cfg.model_id, self.diffusion, self.device)
         with tqdm(initial=self.step, total=total_step, disable=not self.accelerator.is_main_process) as pbar:
             while self.step < total_step:
                 raster_img = renderer.get_image(step=self.step).to(self.device)
@@ -340,16 +404,19 @@ class VectorFusionPipeline(ModelState):
                     plot_img(raster_img, self.frame_log_dir, fname=f"iter{self.frame_idx}")
                     self.frame_idx += 1
 
-                L_sds, grad = self.diffusion.score_distillation_sampling(
-                    raster_img,
-                    im_size=self.x_cfg.sds.im_size,
-                    prompt=[text_prompt],
-                    negative_prompt=[self.args.neg_prompt],
-                    guidance_scale=self.x_cfg.sds.guidance_scale,
-                    input_augment=self.x_cfg.sds.x_aug,
-                    grad_scale=self.x_cfg.sds.grad_scale,
-                    t_range=list(self.x_cfg.sds.t_range),
-                )
+                latent_proxy.update(self.step, total_step)
+                with self.precision.autocast():
+                    L_sds, grad = self.diffusion.score_distillation_sampling(
+                        raster_img,
+                        im_size=self.x_cfg.sds.im_size,
+                        prompt=[text_prompt],
+                        negative_prompt=[self.args.neg_prompt],
+                        guidance_scale=self.x_cfg.sds.guidance_scale,
+                        input_augment=self.x_cfg.sds.x_aug,
+                        grad_scale=self.x_cfg.sds.grad_scale,
+                        t_range=list(self.x_cfg.sds.t_range),
+                    )
+                L_sds = self.precision.cast(L_sds)
 
                 # Xing Loss for Self-Interaction Problem
                 L_add = torch.tensor(0.)
@@ -381,16 +448,8 @@ class VectorFusionPipeline(ModelState):
                 if self.x_cfg.lr_stage_two.lr_schedule:
                     optimizer.update_lr()
 
-                lr_str = ""
-                for k, lr in optimizer.get_lr().items():
-                    lr_str += f"{k}_lr: {lr:.4f}, "
-
-                pbar.set_description(
-                    lr_str +
-                    f"L_total: {loss.item():.4f}, "
-                    f"L_add: {L_add.item():.4e}, "
-                    f"sds: {grad.item():.5e}"
-                )
+                lrs = {f"{k}_lr": lr for k, lr in optimizer.get_lr().items()}
+                self.log_metrics(pbar, **lrs, L_total=loss, L_add=L_add, sds=grad)
 
                 if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
                     plot_couple(target_img,
@@ -399,13 +458,20 @@ class VectorFusionPipeline(ModelState):
                                 prompt=text_prompt,
                                 output_dir=self.ft_png_logs_dir.as_posix(),
                                 fname=f"iter{self.step}")
-                    renderer.pretty_save_svg(self.ft_svg_logs_dir / f"svg_iter{self.step}.svg")
+                    if svg_traj is not None:
+                        svg_traj.append(self.step, renderer)
+                    else:
+                        renderer.pretty_save_svg(self.ft_svg_logs_dir / f"svg_iter{self.step}.svg")
 
                 self.step += 1
                 pbar.update(1)
 
+        if svg_traj is not None:
+            svg_traj.close()
         final_svg_fpth = self.result_path / "finetune_final.svg"
         renderer.pretty_save_svg(final_svg_fpth)
+        if self.warm_start is not None and self.accelerator.is_main_process:
+            self.warm_start.register(text_prompt, final_svg_fpth, meta={'seed': self.args.seed})
 
         if self.make_video:
             from subprocess import call
@@ -417,9 +483,162 @@ class VectorFusionPipeline(ModelState):
                 (self.result_path / "VF_rendering_stage2.mp4").as_posix()
             ])
 
+        if self.offload is not None:
+            self.offload.close()
+        self.close(msg="painterly rendering complete.")
+
+    def multi_job_rendering(self, text_prompt: AnyStr):
+        """
+        Optimize `n_jobs` independent SVGs in lockstep.
+        Job k uses the seed `job_seeds[k]` (default: `seed + k`) and, optionally, its own prompt from `job_prompts`.
+        Stage one (LIVE) runs per job, then the rasters of all jobs are stacked into one batch,
+        so that each fine-tuning step calls the UNet once with per-sample timesteps and noise.
+        The timesteps, noise and augmentations of job k are drawn from its own generator,
+        so its result does not depend on the other jobs of the batch.
+        """
+        job_seeds = self.x_cfg.get('job_seeds', None)
+        n_jobs = len(job_seeds) if job_seeds else self.x_cfg.n_jobs
+        seeds = list(job_seeds) if job_seeds else [self.args.seed + k for k in range(n_jobs)]
+        prompts = list(self.x_cfg.job_prompts) if self.x_cfg.get('job_prompts', None) else [text_prompt] * n_jobs
+        assert len(prompts) == n_jobs, f"got {len(prompts)} prompts for {n_jobs} jobs."
+
+        if self.make_video:
+            self.make_video = False
+            self.print("=> warning: video logging is not supported in multi-job mode.")
+
+        jobs = []
+        for k, (prompt, seed) in enumerate(zip(prompts, seeds)):
+            set_seed(seed)
+            self.g_device.manual_seed(seed)
+            self.set_log_dirs(self.result_path / f"job{k}-sd{seed}")
+            self.print(f"\n-> job {k}: seed: {seed}, prompt: {prompt}")
+
+            if self.x_cfg.skip_live:
+                target_img = torch.randn(1, 3, self.x_cfg.image_size, self.x_cfg.image_size)
+                live_scene = None
+            else:
+                self.step = 0
+                target_img, live_scene = self.LIVE_rendering(prompt)
+                torch.cuda.empty_cache()
+
+            renderer = self.load_renderer(scene=live_scene)
+            if self.x_cfg.skip_live:
+                renderer.component_wise_path_init(target_img, pred=None, init_type='random')
+            img = renderer.init_image(stage=0, num_paths=self.x_cfg.num_paths)
+            plot_img(img, self.job_dir, fname=f"init_img_stage_two")
+
+            optimizer = PainterOptimizer(renderer, self.style,
+                                         self.x_cfg.sds.num_iter,
+                                         self.x_cfg.lr_stage_two,
+                                         self.x_cfg.trainable_bg)
+            optimizer.init_optimizers()
+
+            jobs.append({
+                "prompt": prompt,
+                "target_img": target_img,
+                "renderer": renderer,
+                "optimizer": optimizer,
+                "job_dir": self.job_dir,
+                "ft_png_logs_dir": self.ft_png_logs_dir,
+                "ft_svg_logs_dir": self.ft_svg_logs_dir,
+                "svg_traj": self.trajectory_writer(self.ft_svg_logs_dir / "trajectory"),
+                "reinit_dir": self.reinit_dir,
+                "generator": torch.Generator().manual_seed(seed),
+            })
+
+        self.enter_stage('sds')
+        self.step = 0  # reset global step
+        self.start_metric_stage('sds')
+        total_step = self.x_cfg.sds.num_iter
+        path_reinit = self.x_cfg.path_reinit
+        negative_prompts = [self.args.neg_prompt] * n_jobs
+
+        self.print(f"\ntotal sds optimization steps: {total_step}, jobs: {n_jobs}")
+        # the learned RGB-to-latent proxy replaces the VAE encoder, except for the last steps
+        latent_proxy = LatentProxySwitch.from_cfg(self.x_cfg.sds.get('latent_proxy', None),
+                                                  self.x_cfg.model_id, self.diffusion, self.device)
+        with tqdm(initial=self.step, total=total_step, disable=not self.accelerator.is_main_process) as pbar:
+            while self.step < total_step:
+                raster_imgs = [job["renderer"].get_image(step=self.step).to(self.device) for job in jobs]
+
+                # one UNet call for all jobs, the gradient of each sample flows back to its own renderer
+                latent_proxy.update(self.step, total_step)
+                with self.precision.autocast():
+                    L_sds, grad = self.diffusion.score_distillation_sampling(
+                        torch.cat(raster_imgs, dim=0),
+                        im_size=self.x_cfg.sds.im_size,
+                        prompt=prompts,
+                        negative_prompt=negative_prompts,
+                        guidance_scale=self.x_cfg.sds.guidance_scale,
+                        input_augment=self.x_cfg.sds.x_aug,
+                        grad_scale=self.x_cfg.sds.grad_scale,
+                        t_range=list(self.x_cfg.sds.t_range),
+                        generator=[job["generator"] for job in jobs],
+                    )
+                L_sds = self.precision.cast(L_sds)
+
+                L_add = torch.tensor(0.)
+                for job, raster_img in zip(jobs, raster_imgs):
+                    # Xing Loss for Self-Interaction Problem
+                    if self.style == "iconography":
+                        L_add = L_add + xing_loss_fn(job["renderer"].get_point_parameters()) * self.x_cfg.xing_loss_weight
+                    # pixel_penalty_loss to combat oversaturation
+                    if self.style in ["pixelart", "low-poly"]:
+                        L_add = L_add + pixel_penalty_loss(raster_img) * self.x_cfg.penalty_weight
+
+                loss = L_sds + L_add
+
+                # optimization
+                for job in jobs:
+                    job["optimizer"].zero_grad_()
+                loss.backward()
+                for job in jobs:
+                    job["optimizer"].step_()
+                    job["renderer"].clip_curve_shape()
+
+                for job in jobs:
+                    # re-init paths
+                    if path_reinit.use and self.step % path_reinit.freq == 0 and self.step < path_reinit.stop_step and self.step != 0:
+                        extra_point_params, extra_color_params, extra_width_params = \
+                            job["renderer"].reinitialize_paths(f"Step {self.step}",
+                                                               job["reinit_dir"] / f"reinit-{self.step}.svg",
+                                                               path_reinit.opacity_threshold,
+                                                               path_reinit.area_threshold)
+                        job["optimizer"].add_params(extra_point_params, extra_color_params, extra_width_params)
+
+                    # update lr
+                    if self.x_cfg.lr_stage_two.lr_schedule:
+                        job["optimizer"].update_lr()
+
+                lrs = {f"{k}_lr": lr for k, lr in jobs[0]["optimizer"].get_lr().items()}
+                self.log_metrics(pbar, **lrs, L_total=loss, L_add=L_add, sds=grad)
+
+                if self.step % self.args.save_step == 0 and self.accelerator.is_main_process:
+                    for job, raster_img in zip(jobs, raster_imgs):
+                        plot_couple(job["target_img"],
+                                    raster_img,
+                                    self.step,
+                                    prompt=job["prompt"],
+                                    output_dir=job["ft_png_logs_dir"].as_posix(),
+                                    fname=f"iter{self.step}")
+                        if job["svg_traj"] is not None:
+                            job["svg_traj"].append(self.step, job["renderer"])
+                        else:
+                            job["renderer"].pretty_save_svg(job["ft_svg_logs_dir"] / f"svg_iter{self.step}.svg")
+
+                self.step += 1
+                pbar.update(1)
+
+        for job in jobs:
+            job["renderer"].pretty_save_svg(job["job_dir"] / "finetune_final.svg")
+            if job["svg_traj"] is not None:
+                job["svg_traj"].close()
+
+        if self.offload is not None:
+            self.offload.close()
         self.close(msg="painterly rendering complete.")
 
-    def load_renderer(self, path_svg=None):
+    def load_renderer(self, path_svg=None, scene: SVGScene = None):
         renderer = Painter(self.args.diffvg,
                            self.style,
                            self.x_cfg.num_segments,
@@ -430,5 +649,6 @@ class VectorFusionPipeline(ModelState):
                            self.x_cfg.trainable_bg,
                            self.x_cfg.width,
                            path_svg=path_svg,
+                           init_scene=scene,
                            device=self.device)
         return renderer
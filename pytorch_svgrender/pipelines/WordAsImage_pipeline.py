@@ -13,7 +13,7 @@ from pytorch_svgrender.painter.wordasimage import Painter, PainterOptimizer
 from pytorch_svgrender.painter.wordasimage.losses import ToneLoss, ConformalLoss
 from pytorch_svgrender.painter.vectorfusion import LSDSPipeline
 from pytorch_svgrender.plt import plot_img, plot_couple
-from pytorch_svgrender.model_helper import init_StableDiffusion_pipeline
+from pytorch_svgrender.model_helper import init_StableDiffusion_pipeline, LatentProxySwitch
 from pytorch_svgrender.svgtools import FONT_LIST
 
 
@@ -81,7 +81,8 @@ class WordAsImagePipeline(ModelState):
                                  optimized_letter,
                                  self.x_cfg.level_of_cc,
                                  self.font_path,
-                                 self.result_path.as_posix())
+                                 self.result_path.as_posix(),
+                                 cache_dir=self.x_cfg.get('glyph_cache_dir', None))
 
         # init letter shape
         img_init = renderer.init_shape(self.target_letter)
@@ -106,8 +107,13 @@ class WordAsImagePipeline(ModelState):
         if self.x_cfg.conformal.use:
             conformal_loss = ConformalLoss(renderer.get_point_parameters(),
                                            renderer.shape_groups,
-                                           optimized_letter, self.device)
+                                           optimized_letter, self.device,
+                                           cache_dir=self.x_cfg.conformal.get('cache_dir', None),
+                                           cache_key=(self.font, word, optimized_letter, self.x_cfg.level_of_cc))
 
+        # the learned RGB-to-latent proxy replaces the VAE encoder, except for the last steps
+        latent_proxy = LatentProxySwitch.from_cfg(self.x_cfg.sds.get('latent_proxy', None),
+                                                  self.x_cfg.model_id, self.diffusion, self.device)
         with tqdm(initial=self.step, total=n_iter, disable=not self.accelerator.is_main_process) as pbar:
             for i in range(n_iter):
 
@@ -116,6 +122,7 @@ class WordAsImagePipeline(ModelState):
                 if self.make_video and (i % self.args.framefreq == 0 or i == n_iter - 1):
                     plot_img(raster_img, self.frame_log_dir, fname=f"iter{self.step}")
 
+                latent_proxy.update(i, n_iter)
                 L_sds, grad = self.diffusion.score_distillation_sampling(
                     raster_img,
                     im_size=self.x_cfg.sds.im_size,
@@ -137,11 +144,8 @@ class WordAsImagePipeline(ModelState):
                     loss_angles = self.x_cfg.conformal.angeles_w * loss_angles
                     loss = loss + loss_angles
 
-                pbar.set_description(
-                    f"n_params: {len(renderer.get_point_parameters())}, "
-                    f"lr: {optimizer.get_lr():.4f}, "
-                    f"L_total: {loss.item():.4f}, "
-                )
+                self.log_metrics(pbar, n_params=len(renderer.get_point_parameters()),
+                                 lr=optimizer.get_lr(), L_total=loss)
 
                 # optimization
                 optimizer.zero_grad_()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: local rendering service
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'job_queue': ['Job', 'JobQueue', 'BATCHABLE_METHODS'],
+        'worker': ['JobWorker', 'PIPELINES'],
+        'server': ['JobRequestHandler', 'make_server']
+    }
+)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: priority job queue of the local rendering service
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import time
+import uuid
+import heapq
+import itertools
+import threading
+from typing import Any, Dict, List, Optional
+
+# methods whose pipeline can optimize several jobs in one batch (`x.n_jobs`)
+BATCHABLE_METHODS = {'vectorfusion'}
+
+
+class Job:
+    """
+    A rendering request: a method, its inputs and Hydra-style config overrides (e.g. "x.num_paths=128").
+    The seed of the job is kept apart from the overrides (a "seed=..." override is moved to `seed`),
+    so that jobs with different seeds can still be coalesced.
+    Progress lines and the final result files are appended to `events`, which can be followed
+    with `wait_events`.
+    """
+
+    def __init__(self,
+                 method: str,
+                 prompt: str = None,
+                 target: str = None,
+                 overrides: List[str] = None,
+                 priority: int = 0,
+                 seed: int = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.prompt = prompt
+        self.target = target
+        self.overrides = []
+        for override in overrides or []:
+            if override.startswith('seed='):
+                seed = int(override[len('seed='):]) if seed is None else seed
+            else:
+                self.overrides.append(override)
+        self.seed = int(seed) if seed is not None else None
+        self.priority = priority
+
+        self.status = 'queued'  # queued -> running -> done / failed
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.batch_id: Optional[str] = None
+        self.output_dir: Optional[str] = None
+        self.files: List[str] = []
+        self.error: Optional[str] = None
+
+        self.events: List[Dict[str, Any]] = []
+        self._cond = threading.Condition()
+
+    @property
+    def batch_key(self):
+        """jobs with the same key can be coalesced into one batched optimization"""
+        if self.method not in BATCHABLE_METHODS or self.target is not None:
+            return None
+        return self.method, tuple(sorted(self.overrides))
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ['done', 'failed']
+
+    def emit(self, kind: str, **data):
+        with self._cond:
+            self.events.append({'seq': len(self.events), 'time': time.time(), 'kind': kind, **data})
+            self._cond.notify_all()
+
+    def set_status(self, status: str, **data):
+        self.status = status
+        if status == 'running':
+            self.started = time.time()
+        elif status in ['done', 'failed']:
+            self.finished = time.time()
+        self.emit('status', status=status, **data)
+
+    def wait_events(self, start: int, timeout: float = 1.0) -> List[Dict[str, Any]]:
+        """events from index `start`, blocks until there is a new one or the timeout"""
+        with self._cond:
+            if len(self.events) <= start and not self.is_finished:
+                self._cond.wait(timeout)
+            return self.events[start:]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'method': self.method,
+            'prompt': self.prompt,
+            'target': self.target,
+            'overrides': self.overrides,
+            'seed': self.seed,
+            'priority': self.priority,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'batch_id': self.batch_id,
+            'output_dir': self.output_dir,
+            'files': self.files,
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """
+    Thread-safe priority queue, higher `priority` first, then first in first out.
+    `pop_batch` coalesces the compatible queued jobs (same `batch_key`) with the head job.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, job: Job) -> Job:
+        with self._cond:
+            self.jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job.id))
+            job.emit('status', status='queued')
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id, None)
+
+    def pending(self) -> List[Job]:
+        with self._cond:
+            return [self.jobs[jid] for _, _, jid in sorted(self._heap)]
+
+    def pop_batch(self, max_batch: int = 1, timeout: float = None) -> List[Job]:
+        """block until a job is queued, return it with up to `max_batch - 1` compatible jobs"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._heap) > 0 or self._closed, timeout):
+                return []
+            if self._closed and len(self._heap) == 0:
+                return []
+
+            _, _, head_id = heapq.heappop(self._heap)
+            batch = [self.jobs[head_id]]
+            key = batch[0].batch_key
+            if key is not None and max_batch > 1:
+                remain = []
+                for item in sorted(self._heap):
+                    job = self.jobs[item[2]]
+                    if len(batch) < max_batch and job.batch_key == key:
+                        batch.append(job)
+                    else:
+                        remain.append(item)
+                self._heap = remain
+                heapq.heapify(self._heap)
+            return batch
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
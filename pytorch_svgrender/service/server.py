@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: stdlib HTTP front end of the local rendering service
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import os
+import json
+import socketserver
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .job_queue import Job, JobQueue
+from .worker import PIPELINES
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints:
+        POST /jobs                  {"method", "prompt", "target", "overrides": [...], "priority"} -> job
+        GET  /jobs                  all jobs
+        GET  /jobs/<id>             one job
+        GET  /jobs/<id>/events      progress stream, one json event per line until the job is finished
+                                    (`?start=N` to resume from the N-th event)
+    """
+
+    # HTTP/1.0: the event stream ends when the connection is closed
+    protocol_version = "HTTP/1.0"
+
+    @property
+    def queue(self) -> JobQueue:
+        return self.server.queue
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status: HTTPStatus = HTTPStatus.OK):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        return parts, parse_qs(url.query)
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            return self._send_json({'error': 'not found'}, HTTPStatus.NOT_FOUND)
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            method = request['method']
+            assert method in PIPELINES, f"{method} is not currently supported!"
+            overrides = request.get('overrides', [])
+            assert isinstance(overrides, list), "`overrides` must be a list of 'key=value' strings"
+            job = Job(method,
+                      prompt=request.get('prompt', None),
+                      target=request.get('target', None),
+                      overrides=overrides,
+                      priority=int(request.get('priority', 0)),
+                      seed=request.get('seed', None))
+        except (KeyError, ValueError, AssertionError) as e:
+            return self._send_json({'error': f"bad request: {e}"}, HTTPStatus.BAD_REQUEST)
+
+        self.queue.put(job)
+        self._send_json(job.to_dict(), HTTPStatus.CREATED)
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['jobs']:
+            return self._send_json([j.to_dict() for j in self.queue.jobs.values()])
+        if len(parts) < 2 or parts[0] != 'jobs' or self.queue.get(parts[1]) is None:
+            return self._send_json({'error': 'not found'}, HTTPStatus.NOT_FOUND)
+
+        job = self.queue.get(parts[1])
+        if len(parts) == 2:
+            return self._send_json(job.to_dict())
+        if len(parts) == 3 and parts[2] == 'events':
+            return self._stream_events(job, start=int(query.get('start', [0])[0]))
+        self._send_json({'error': 'not found'}, HTTPStatus.NOT_FOUND)
+
+    def _stream_events(self, job: Job, start: int = 0):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            while True:
+                events = job.wait_events(start, timeout=1.0)
+                for event in events:
+                    self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                start += len(events)
+                if job.is_finished and start >= len(job.events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):  # client went away
+            pass
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(queue: JobQueue, host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None):
+    """a threaded HTTP server, on a TCP port or on a Unix socket if `unix_socket` is given"""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _ThreadingUnixHTTPServer(unix_socket, JobRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.queue = queue
+    return server
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: job worker of the local rendering service
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import gc
+import os
+import sys
+import pathlib
+import importlib
+import threading
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from typing import List
+
+from omegaconf import open_dict
+
+from pytorch_svgrender.utils import AnyPath, collect_artifacts
+from .job_queue import Job, JobQueue
+
+# method -> (pipeline module, pipeline class, args of `painterly_rendering`), same as `svg_render.py`
+PIPELINES = {
+    'diffvg': ('DiffVG_pipeline', 'DiffVGPipeline', lambda cfg: ((cfg.target,), {})),
+    'live': ('LIVE_pipeline', 'LIVEPipeline', lambda cfg: ((cfg.target,), {})),
+    'vectorfusion': ('VectorFusion_pipeline', 'VectorFusionPipeline', lambda cfg: ((cfg.prompt,), {})),
+    'svgdreamer': ('SVGDreamer_pipeline', 'SVGDreamerPipeline', lambda cfg: ((cfg.prompt,), {})),
+    'wordasimage': ('WordAsImage_pipeline', 'WordAsImagePipeline',
+                    lambda cfg: ((cfg.x.word, cfg.prompt, cfg.x.optim_letter), {})),
+    'clipasso': ('CLIPasso_pipeline', 'CLIPassoPipeline', lambda cfg: ((cfg.target,), {})),
+    'clipascene': ('CLIPascene_pipeline', 'CLIPascenePipeline', lambda cfg: ((cfg.target,), {})),
+    'clipdraw': ('CLIPDraw_pipeline', 'CLIPDrawPipeline', lambda cfg: ((cfg.prompt,), {})),
+    'clipfont': ('CLIPFont_pipeline', 'CLIPFontPipeline',
+                 lambda cfg: ((), {'svg_path': cfg.target, 'prompt': cfg.prompt})),
+    'styleclipdraw': ('StyleCLIPDraw_pipeline', 'StyleCLIPDrawPipeline',
+                      lambda cfg: ((cfg.prompt,), {'style_fpath': cfg.target})),
+    'diffsketcher': ('DiffSketcher_pipeline', 'DiffSketcherPipeline', lambda cfg: ((cfg.prompt,), {})),
+    'stylediffsketcher': ('DiffSketcher_stylized_pipeline', 'StylizedDiffSketcherPipeline',
+                          lambda cfg: ((cfg.prompt,), {'style_fpath': cfg.target})),
+}
+
+
+class _ProgressStream:
+    """file-like object that forwards every printed line (and tqdm update) to the running jobs"""
+
+    def __init__(self, jobs: List[Job], echo=None):
+        self.jobs = jobs
+        self.echo = echo
+        self._buffer = ''
+
+    def write(self, s: str):
+        if self.echo is not None:
+            self.echo.write(s)
+        self._buffer += s
+        # tqdm refreshes the line with '\r'
+        *lines, self._buffer = self._buffer.replace('\r', '\n').split('\n')
+        for line in lines:
+            if line.strip():
+                for job in self.jobs:
+                    job.emit('log', line=line)
+        return len(s)
+
+    def flush(self):
+        if self.echo is not None:
+            self.echo.flush()
+
+    def isatty(self):
+        return False
+
+
+class JobWorker:
+    """
+    Run the queued jobs one batch at a time in a background thread.
+
+    The configs are composed from `conf/` with the Hydra compose API, so that a job behaves like
+    `python svg_render.py x=<method> prompt=... <overrides>`. The diffusers pipelines are kept warm
+    across jobs, and compatible jobs are coalesced into one batched optimization (`x.n_jobs`).
+    """
+
+    def __init__(self,
+                 queue: JobQueue,
+                 config_dir: AnyPath,
+                 result_root: AnyPath,
+                 max_batch: int = 4,
+                 echo: bool = True):
+        from hydra import initialize_config_dir
+        from hydra.core.global_hydra import GlobalHydra
+        from pytorch_svgrender.model_helper import keep_pipelines_warm
+
+        self.queue = queue
+        self.result_root = pathlib.Path(result_root).absolute()
+        self.max_batch = max_batch
+        self.echo = echo
+
+        GlobalHydra.instance().clear()
+        initialize_config_dir(config_dir=str(pathlib.Path(config_dir).absolute()), version_base=None)
+        keep_pipelines_warm(True)
+
+        self._thread = threading.Thread(target=self._loop, name="svgrender-worker", daemon=True)
+        self._stop = threading.Event()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.queue.close()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            jobs = self.queue.pop_batch(self.max_batch, timeout=1.0)
+            if len(jobs) > 0:
+                self.run(jobs)
+
+    def compose(self, job: Job):
+        from hydra import compose
+
+        # the seeds of batched jobs are passed with `x.job_seeds`
+        seed = [f"seed={job.seed}"] if job.seed is not None and job.batch_key is None else []
+        cfg = compose(config_name='config',
+                      overrides=[f"x={job.method}"] + job.overrides + seed,
+                      return_hydra_config=True)
+        with open_dict(cfg):
+            if job.prompt is not None:
+                cfg.prompt = job.prompt
+            if job.target is not None:
+                cfg.target = job.target
+        return cfg
+
+    def run(self, jobs: List[Job]):
+        from hydra.core.hydra_config import HydraConfig
+        from accelerate.utils import set_seed
+
+        head = jobs[0]
+        # a batchable job always goes through the batched path, even alone, so that its result
+        # does not depend on how it was coalesced with other jobs
+        batched = head.batch_key is not None
+        batch_id = head.id if len(jobs) == 1 else f"batch-{head.id}"
+        output_dir = self.result_root / f"{head.method}-{batch_id}"
+        for job in jobs:
+            job.batch_id = batch_id
+            job.output_dir = output_dir.as_posix()
+            job.set_status('running', batch_size=len(jobs))
+
+        stream = _ProgressStream(jobs, echo=sys.__stdout__ if self.echo else None)
+        try:
+            assert head.method in PIPELINES, f"{head.method} is not currently supported!"
+            cfg = self.compose(head)
+            if batched:  # one batched optimization, each job with its own seed and generator
+                with open_dict(cfg):
+                    cfg.x.n_jobs = len(jobs)
+                    cfg.x.job_prompts = [j.prompt for j in jobs]
+                    cfg.x.job_seeds = [j.seed if j.seed is not None else cfg.seed for j in jobs]
+
+            # what `hydra.main` would do: the runtime output dir, then drop the hydra node
+            with open_dict(cfg):
+                cfg.hydra.runtime.output_dir = output_dir.as_posix()
+                cfg.hydra.runtime.cwd = os.getcwd()
+            HydraConfig.instance().set_config(cfg)
+            with open_dict(cfg):
+                cfg.pop('hydra')
+
+            module_name, class_name, rendering_args = PIPELINES[head.method]
+            with redirect_stdout(stream), redirect_stderr(stream):
+                set_seed(cfg.seed)
+                module = importlib.import_module(f"pytorch_svgrender.pipelines.{module_name}")
+                pipe = getattr(module, class_name)(cfg)
+                args, kwargs = rendering_args(cfg)
+                pipe.painterly_rendering(*args, **kwargs)
+                del pipe
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            for job in jobs:
+                job.error = error
+                job.emit('log', line=traceback.format_exc())
+                job.set_status('failed', error=error)
+            return
+        finally:
+            gc.collect()
+            _empty_cuda_cache()
+
+        files = collect_artifacts(output_dir) if output_dir.exists() else []
+        for k, job in enumerate(jobs):
+            if batched:  # the results of job k are written under `job{k}-sd{seed}/`
+                job_files = [f for f in files if any(p.startswith(f"job{k}-") for p in f.parts)]
+            else:
+                job_files = files
+            job.files = [(output_dir / f).as_posix() for f in job_files]
+            job.set_status('done', files=job.files)
+
+
+def _empty_cuda_cache():
+    if 'torch' in sys.modules:
+        import torch
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
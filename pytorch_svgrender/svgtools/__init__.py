@@ -3,14 +3,17 @@
 # Copyright (c) 2023, XiMing Xing.
 # License: MIT License
 
-from .tff import FONT_LIST
-from .type import is_valid_svg
-from .merge import merge_svg_files
-from .process import delete_empty_path, add_def_tag
+from pytorch_svgrender.libs.utils import lazy
 
-__all__ = [
-    'is_valid_svg',
-    'merge_svg_files',
-    'FONT_LIST',
-    'delete_empty_path', 'add_def_tag'
-]
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'tff': ['FONT_LIST'],
+        'type': ['is_valid_svg'],
+        'merge': ['merge_svg_files'],
+        'process': ['delete_empty_path', 'add_def_tag'],
+        'compact': ['compact_svg', 'compact_svg_dir', 'raster_diff'],
+        'glyph_cache': ['GlyphCache']
+    }
+)
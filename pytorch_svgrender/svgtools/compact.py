@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: SVG compaction - quantize, prune, simplify and group the rendered SVGs
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import io
+import re
+import math
+import pathlib
+from typing import AnyStr, Dict, List, Optional, Tuple
+import xml.etree.ElementTree as ET
+
+SVG_NS = "http://www.w3.org/2000/svg"
+
+# inherited presentation attributes and their SVG defaults
+STYLE_DEFAULTS = {
+    'fill': 'black',
+    'fill-opacity': '1',
+    'stroke': 'none',
+    'stroke-width': '1',
+    'stroke-opacity': '1',
+    'stroke-linecap': 'butt',
+    'stroke-linejoin': 'miter',
+}
+# only used by the strokes
+STROKE_ATTRS = ('stroke-width', 'stroke-opacity', 'stroke-linecap', 'stroke-linejoin')
+# numeric geometry attributes of the basic shapes
+NUMERIC_ATTRS = ('x', 'y', 'width', 'height', 'cx', 'cy', 'r', 'rx', 'ry', 'x1', 'y1', 'x2', 'y2', 'stroke-width')
+SHAPE_TAGS = ('path', 'circle', 'ellipse', 'rect', 'polygon', 'polyline', 'line')
+
+_PATH_TOKEN = re.compile(r"([MLQCZmlqcz])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+_PATH_UNSUPPORTED = re.compile(r"[AaHhVvSsTtlqcm]")
+_NUMBER = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_RGB = re.compile(r"rgb\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)")
+_N_ARGS = {'M': 2, 'L': 2, 'Q': 4, 'C': 6, 'Z': 0}
+
+
+def _tag(element: ET.Element) -> str:
+    return element.tag.split('}')[-1]
+
+
+def fmt_number(v: float, precision: int) -> str:
+    """the shortest string of `v` rounded to `precision` decimals, e.g. 0.50 -> '.5'"""
+    s = f"{round(v, precision):.{precision}f}".rstrip('0').rstrip('.') if precision > 0 else f"{round(v):d}"
+    if s in ('-0', ''):
+        return '0'
+    if s.startswith('0.'):
+        return s[1:]
+    if s.startswith('-0.'):
+        return '-' + s[2:]
+    return s
+
+
+def _short_color(color: str) -> str:
+    color = {'black': '#000', 'white': '#fff'}.get(color.strip(), color)
+    m = _RGB.fullmatch(color.strip())
+    if m is None:
+        return color
+    h = ''.join(f"{min(255, int(c)):02x}" for c in m.groups())
+    if h[0::2] == h[1::2]:
+        return '#' + h[0::2]
+    return '#' + h
+
+
+def parse_path(d: str) -> Optional[List]:
+    """
+    Parse the absolute M/L/Q/C/Z commands written by `pydiffvg` and `DiffVGState.save_svg`.
+    Returns a list of subpaths [start, segments, closed], with segments (cmd, [points]),
+    or None if the path uses other commands.
+    """
+    if _PATH_UNSUPPORTED.search(d):
+        return None
+    tokens = _PATH_TOKEN.findall(d)
+    subpaths, cmd, args = [], None, []
+
+    def emit(cmd, args):
+        pts = [(args[i], args[i + 1]) for i in range(0, len(args), 2)]
+        if cmd == 'M':
+            subpaths.append([pts[0], [], False])
+            # the extra pairs of a moveto are lineto
+            subpaths[-1][1].extend(('L', [p]) for p in pts[1:])
+        elif len(subpaths) == 0:
+            raise ValueError("path does not start with a moveto")
+        else:
+            subpaths[-1][1].append((cmd, pts))
+
+    for c, num in tokens:
+        if c:
+            if c in 'zZ':
+                if len(subpaths) == 0:
+                    return None
+                subpaths[-1][2] = True
+                cmd = None
+                continue
+            cmd, args = c.upper(), []
+            continue
+        if cmd is None:
+            return None
+        args.append(float(num))
+        if len(args) == _N_ARGS[cmd]:
+            emit(cmd, args)
+            args = []
+            if cmd == 'M':
+                cmd = 'L'
+    return subpaths
+
+
+def _collinear(a, b, c, tol: float) -> bool:
+    """b lies on the segment a -> c within `tol`"""
+    dx, dy = c[0] - a[0], c[1] - a[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return math.hypot(b[0] - a[0], b[1] - a[1]) <= tol
+    dist = abs(dx * (b[1] - a[1]) - dy * (b[0] - a[0])) / length
+    proj = (dx * (b[0] - a[0]) + dy * (b[1] - a[1])) / length
+    return dist <= tol and -tol <= proj <= length + tol
+
+
+def simplify_path(subpaths: List, precision: int, flat_tol: float) -> Tuple[List, int, int]:
+    """quantize the points, drop the degenerate segments, turn flat curves into lines and merge collinear lines"""
+    q = lambda p: (round(p[0], precision), round(p[1], precision))
+    out, n_in, n_out = [], 0, 0
+    for start, segments, closed in subpaths:
+        cur = start = q(start)
+        new_segments = []
+        for cmd, pts in segments:
+            n_in += 1
+            pts = [q(p) for p in pts]
+            end = pts[-1]
+            if all(p == cur for p in pts):  # zero length
+                continue
+            if cmd in ('Q', 'C') and all(_collinear(cur, p, end, flat_tol) for p in pts[:-1]) and end != cur:
+                cmd, pts = 'L', [end]
+            if cmd == 'L' and len(new_segments) > 0 and new_segments[-1][0] == 'L':
+                prev_start = new_segments[-2][1][-1] if len(new_segments) > 1 else start
+                prev_end = new_segments[-1][1][0]
+                same_direction = ((prev_end[0] - prev_start[0]) * (end[0] - prev_end[0]) +
+                                  (prev_end[1] - prev_start[1]) * (end[1] - prev_end[1])) > 0
+                if same_direction and _collinear(prev_start, prev_end, end, flat_tol):
+                    new_segments[-1] = ('L', [end])
+                    cur = end
+                    continue
+            new_segments.append((cmd, pts))
+            cur = end
+        n_out += len(new_segments)
+        out.append([start, new_segments, closed])
+    return out, n_in, n_out
+
+
+def path_to_d(subpaths: List, precision: int) -> str:
+    parts, last_cmd = [], None
+    for start, segments, closed in subpaths:
+        parts.append('M' + ' '.join(fmt_number(v, precision) for v in start))
+        last_cmd = 'M'
+        for cmd, pts in segments:
+            coords = ' '.join(fmt_number(v, precision) for p in pts for v in p)
+            # a repeated command letter can be omitted, and so can L after M
+            if cmd == last_cmd or (cmd == 'L' and last_cmd == 'M'):
+                parts.append(' ' + coords)
+            else:
+                parts.append(cmd + coords)
+            last_cmd = cmd if cmd != 'M' else 'L'
+        if closed:
+            parts.append('Z')
+    return ''.join(parts).replace(' -', '-')
+
+
+def _path_extent(subpaths: List) -> float:
+    pts = [p for start, segments, _ in subpaths for p in [start] + [p for _, ps in segments for p in ps]]
+    if len(pts) == 0:
+        return 0.
+    xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+    return max(max(xs) - min(xs), max(ys) - min(ys))
+
+
+def _float(v: Optional[str], default: float) -> float:
+    try:
+        return float(v) if v is not None else default
+    except ValueError:
+        return default
+
+
+class _Stats:
+
+    def __init__(self):
+        self.shapes_in = self.shapes_out = 0
+        self.removed_invisible = self.removed_tiny = 0
+        self.segments_in = self.segments_out = 0
+        self.groups = 0
+
+
+def _compact_element(element: ET.Element, inherited: Dict, opacity: float,
+                     precision: int, min_opacity: float, min_size: float, flat_tol: float, stats: _Stats):
+    """compact the children of `element` in place"""
+    for child in list(element):
+        tag = _tag(child)
+        child.text = child.text.strip() if child.text and child.text.strip() else None
+        child.tail = None
+        if tag in ('defs', 'g', 'svg'):
+            style = dict(inherited)
+            style.update({k: v for k, v in child.attrib.items() if k in STYLE_DEFAULTS})
+            _compact_element(child, style, opacity * _float(child.get('opacity'), 1.),
+                             precision, min_opacity, min_size, flat_tol, stats)
+            if tag != 'svg' and len(child) == 0 and not child.text:
+                element.remove(child)  # empty <g/> or <defs/>
+            continue
+        if tag not in SHAPE_TAGS or 'style' in child.attrib:
+            continue  # unknown content or css: left as it is
+
+        stats.shapes_in += 1
+        style = dict(inherited)
+        style.update({k: v for k, v in child.attrib.items() if k in STYLE_DEFAULTS})
+        alpha = opacity * _float(child.get('opacity'), 1.)
+        stroke_width = _float(style['stroke-width'], 1.)
+        has_fill = style['fill'] != 'none' and alpha * _float(style['fill-opacity'], 1.) >= min_opacity
+        has_stroke = style['stroke'] != 'none' and stroke_width > 0 and \
+                     alpha * _float(style['stroke-opacity'], 1.) >= min_opacity
+        if not has_fill and not has_stroke:
+            stats.removed_invisible += 1
+            element.remove(child)
+            continue
+
+        if tag == 'path':
+            subpaths = parse_path(child.get('d', ''))
+            if subpaths is not None:
+                subpaths, n_in, n_out = simplify_path(subpaths, precision, flat_tol)
+                subpaths = [sp for sp in subpaths if len(sp[1]) > 0]
+                extent = _path_extent(subpaths) + (stroke_width if has_stroke else 0.)
+                if len(subpaths) == 0 or extent < min_size:
+                    stats.removed_tiny += 1
+                    element.remove(child)
+                    continue
+                stats.segments_in += n_in
+                stats.segments_out += n_out
+                child.set('d', path_to_d(subpaths, precision))
+            else:
+                child.set('d', _NUMBER.sub(lambda m: fmt_number(float(m.group()), precision), child.get('d')))
+        elif tag in ('polygon', 'polyline'):
+            child.set('points', _NUMBER.sub(lambda m: fmt_number(float(m.group()), precision), child.get('points', '')))
+        for k in NUMERIC_ATTRS:
+            if child.get(k) is not None and _NUMBER.fullmatch(child.get(k).strip()):
+                child.set(k, fmt_number(float(child.get(k)), precision))
+
+        # an invisible fill or stroke is turned off, its attributes are no longer needed
+        if not has_fill:
+            child.set('fill', 'none')
+            child.attrib.pop('fill-opacity', None)
+        if not has_stroke:
+            child.set('stroke', 'none')
+            for k in STROKE_ATTRS:
+                child.attrib.pop(k, None)
+
+        # attribute defaulting: drop what the element would inherit anyway
+        if child.get('opacity') is not None and _float(child.get('opacity'), 0.) >= 1:
+            del child.attrib['opacity']
+        for k in ('fill', 'stroke'):
+            if child.get(k) is not None:
+                child.set(k, _short_color(child.get(k)))
+        for k in STYLE_DEFAULTS:
+            v = child.get(k)
+            if v is None:
+                continue
+            if v == _short_color(inherited[k]) or \
+                    (k.endswith('opacity') and _float(v, 0.) >= 1 and _float(inherited[k], 0.) >= 1):
+                del child.attrib[k]
+            elif k.endswith('opacity'):
+                child.set(k, fmt_number(float(v), max(precision, 3)))
+        stats.shapes_out += 1
+
+    _group_shared_style(element, stats)
+
+
+def _group_shared_style(element: ET.Element, stats: _Stats, min_run: int = 2):
+    """wrap runs of sibling shapes with the same style in a <g> carrying it, the painting order is unchanged"""
+    def key(child):
+        if _tag(child) not in SHAPE_TAGS or 'style' in child.attrib:
+            return None
+        # `opacity` is not inherited, it is left on the shapes
+        k = tuple(sorted((a, v) for a, v in child.attrib.items() if a in STYLE_DEFAULTS))
+        return k if len(k) > 0 else None
+
+    children = list(element)
+    runs, i = [], 0
+    while i < len(children):
+        k, j = key(children[i]), i + 1
+        while k is not None and j < len(children) and key(children[j]) == k:
+            j += 1
+        if k is not None and j - i >= min_run:
+            runs.append((i, j, k))
+        i = j
+
+    for i, j, k in reversed(runs):
+        group = ET.Element(f"{{{SVG_NS}}}g" if children[i].tag.startswith('{') else 'g', dict(k))
+        for child in children[i:j]:
+            for a, _ in k:
+                del child.attrib[a]
+            element.remove(child)
+            group.append(child)
+        element.insert(i, group)
+        stats.groups += 1
+
+
+def _rasterize(svg_bytes: bytes, width: int, height: int):
+    import cairosvg
+    import numpy as np
+    from PIL import Image
+
+    png = cairosvg.svg2png(bytestring=svg_bytes, output_width=width, output_height=height)
+    img = Image.open(io.BytesIO(png)).convert('RGBA')
+    background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+    return np.asarray(Image.alpha_composite(background, img).convert('RGB'), dtype=np.float32) / 255.
+
+
+def raster_diff(svg_a: bytes, svg_b: bytes, size: Tuple[int, int]) -> float:
+    """mean absolute difference of two rasterized SVGs, in [0, 1]"""
+    import numpy as np
+    return float(np.abs(_rasterize(svg_a, *size) - _rasterize(svg_b, *size)).mean())
+
+
+def compact_svg(input_svg: AnyStr,
+                output_svg: AnyStr,
+                precision: int = 2,
+                min_opacity: float = 1 / 255,
+                min_size: float = 0.5,
+                flat_tol: float = 0.05,
+                verify: bool = True,
+                tolerance: float = 2e-3) -> Dict:
+    """
+    Write a smaller, equivalent SVG:
+        - coordinates rounded to `precision` decimals and written in the shortest form,
+        - invisible shapes (opacity below `min_opacity`) and paths smaller than `min_size` px removed,
+        - zero length segments dropped, flat curves and collinear lines merged,
+        - attributes equal to the inherited or default value dropped, colors as hex,
+        - runs of shapes with the same style grouped under one <g>.
+    If `verify`, both SVGs are rasterized and the compacted one is only written if the mean absolute
+    difference is within `tolerance`, otherwise the input is copied unchanged.
+
+    Returns:
+        a report with the bytes saved and the pass statistics.
+    """
+    raw = pathlib.Path(input_svg).read_bytes()
+    ET.register_namespace("", SVG_NS)
+    root = ET.fromstring(raw)
+
+    stats = _Stats()
+    style = {k: root.get(k, v) for k, v in STYLE_DEFAULTS.items()}
+    _compact_element(root, style, _float(root.get('opacity'), 1.),
+                     precision, min_opacity, min_size, flat_tol, stats)
+    root.text = None
+    out = ET.tostring(root, encoding='utf-8')
+
+    report = {
+        'input': str(input_svg),
+        'bytes_in': len(raw),
+        'bytes_out': len(out),
+        'shapes_in': stats.shapes_in,
+        'shapes_out': stats.shapes_out,
+        'removed_invisible': stats.removed_invisible,
+        'removed_tiny': stats.removed_tiny,
+        'segments_in': stats.segments_in,
+        'segments_out': stats.segments_out,
+        'style_groups': stats.groups,
+        'raster_diff': None,
+        'verified': not verify,
+    }
+
+    if verify:
+        size = (max(1, int(_float(root.get('width'), 512))), max(1, int(_float(root.get('height'), 512))))
+        report['raster_diff'] = raster_diff(raw, out, size)
+        report['verified'] = report['raster_diff'] <= tolerance
+        if not report['verified']:
+            print(f"compact_svg: raster diff {report['raster_diff']:.4f} > {tolerance} for '{input_svg}', "
+                  f"the input is kept unchanged.")
+            out = raw
+            report['bytes_out'] = len(raw)
+
+    pathlib.Path(output_svg).write_bytes(out)
+    report['saved_bytes'] = report['bytes_in'] - report['bytes_out']
+    report['saved_ratio'] = report['saved_bytes'] / max(1, report['bytes_in'])
+    return report
+
+
+# the final SVGs of the methods: `final_*.svg`, `finetune_final*.svg`, `live_stage_one_final.svg`
+# and the `best_iter.svg` of CLIPasso/CLIPascene
+FINAL_SVG_PATTERNS = ('final*.svg', '*_final.svg', 'finetune_final*.svg', 'best_iter.svg')
+
+
+def compact_svg_dir(result_dir: AnyStr,
+                    patterns: Tuple[str, ...] = FINAL_SVG_PATTERNS,
+                    suffix: str = '.min.svg',
+                    **kwargs) -> List[Dict]:
+    """compact the final SVGs found under `result_dir`, written next to them as `<name>{suffix}`"""
+    files = sorted({f for p in patterns for f in pathlib.Path(result_dir).rglob(p) if not f.name.endswith(suffix)})
+    return [compact_svg(f, f.with_name(f.stem + suffix), **kwargs) for f in files]
+
+
+if __name__ == '__main__':
+    """
+    python -m pytorch_svgrender.svgtools.compact -tar ./xx.svg -save ./xx.min.svg
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-tar", "--target_file", type=str, help="the path of SVG file place.")
+    parser.add_argument("-save", "--save_path", type=str, help="the path of compacted SVG file place.")
+    parser.add_argument("--precision", type=int, default=2)
+    parser.add_argument("--tolerance", type=float, default=2e-3)
+    parser.add_argument("--no-verify", action='store_true')
+    args = parser.parse_args()
+
+    report = compact_svg(args.target_file, args.save_path,
+                         precision=args.precision, verify=not args.no_verify, tolerance=args.tolerance)
+    print(report)
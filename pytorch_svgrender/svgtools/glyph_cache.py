@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: persistent cache of the preprocessed glyph outlines
+# Copyright (c) 2023, XiMing Xing.
+# License: MIT License
+
+import json
+import hashlib
+import pathlib
+from typing import Dict, Optional
+
+import numpy as np
+
+from pytorch_svgrender.utils.misc import AnyPath
+from pytorch_svgrender.utils.result_cache import file_digest
+from pytorch_svgrender.utils.trajectory_log import encode_scene, decode_scene
+
+
+class GlyphCache:
+    """
+    The normalized glyph scenes of a text, one compressed `.npz` per (font file, text, size,
+    target control points, subdivision threshold).
+
+    An entry maps the names of the `*_scaled.svg` files of the font preprocessing to their scenes,
+    the Bézier control points are stored as flat float32 arrays.
+    """
+
+    version = 1
+
+    def __init__(self, cache_dir: AnyPath):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self,
+            font_path: AnyPath,
+            text: str,
+            size: int = 30,
+            spacing: float = 1.0,
+            target_control: Optional[Dict[str, int]] = None,
+            subdivision_thresh: Optional[float] = None,
+            **extra) -> str:
+        payload = {
+            'version': self.version,
+            'font': file_digest(font_path),
+            'text': text,
+            'size': size,
+            'spacing': spacing,
+            # only the letters of the text change the outlines
+            'target_control': None if target_control is None else
+            {c: target_control[c] for c in sorted(set(text)) if c in target_control},
+            'subdivision_thresh': subdivision_thresh,
+            **extra
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f"{key}.npz"
+
+    def load(self, key: str) -> Optional[Dict]:
+        """{file name: SVGScene}, or None on a miss"""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        with np.load(path) as f:
+            meta = json.loads(f['meta'].tobytes().decode('utf-8'))
+            return {name: decode_scene(spec, f[f"flat_{i}"])
+                    for i, (name, spec) in enumerate(zip(meta['names'], meta['specs']))}
+
+    def save(self, key: str, scenes: Dict) -> None:
+        names, specs, arrays = [], [], {}
+        for i, (name, (canvas_width, canvas_height, shapes, shape_groups)) in enumerate(scenes.items()):
+            spec, flat = encode_scene(canvas_width, canvas_height, shapes, shape_groups)
+            names.append(name)
+            specs.append(spec)
+            arrays[f"flat_{i}"] = flat.astype(np.float32)
+        meta = np.frombuffer(json.dumps({'names': names, 'specs': specs}).encode('utf-8'), dtype=np.uint8)
+
+        path = self._path(key)
+        tmp_path = path.with_suffix('.tmp.npz')
+        np.savez_compressed(tmp_path, meta=meta, **arrays)
+        tmp_path.replace(path)
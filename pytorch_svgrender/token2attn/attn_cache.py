@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) XiMing Xing. All rights reserved.
+# Author: XiMing Xing
+# Description: cache of aggregated LDM attention maps
+
+import json
+import shutil
+import hashlib
+import pathlib
+from typing import AnyStr, Dict, List, Optional, Union
+
+import torch
+
+
+class AttentionCache:
+    """
+    Cache the aggregated cross/self attention maps of an LDM sampling pass.
+
+    Entries are kept in memory for the current process and, if `cache_dir` is given,
+    persisted on disk so that later runs with the same prompt, seed and model can skip
+    the sampling pass entirely. Each entry stores the full token axis of the cross-attention
+    maps, thus a different `token_ind` still hits the same entry.
+
+    Layout of a persisted entry::
+
+        {cache_dir}/{key}/attn.pt                    # cross_attn, self_attn, tokens, meta
+        {cache_dir}/{key}/ldm_generated_image.png    # image sampled by the LDM
+    """
+
+    attn_fname = "attn.pt"
+    image_fname = "ldm_generated_image.png"
+
+    def __init__(self, cache_dir: Optional[Union[AnyStr, pathlib.Path]] = None):
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._memory: Dict[str, Dict] = {}
+
+    @staticmethod
+    def make_key(prompt: str,
+                 negative_prompt: str,
+                 seed: int,
+                 model_id: str,
+                 resolution: int,
+                 num_inference_steps: int,
+                 guidance_scale: float,
+                 cross_attn_res: int,
+                 self_attn_res: int) -> str:
+        meta = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "seed": int(seed),
+            "model_id": model_id,
+            "resolution": int(resolution),
+            "num_inference_steps": int(num_inference_steps),
+            "guidance_scale": float(guidance_scale),
+            "cross_attn_res": int(cross_attn_res),
+            "self_attn_res": int(self_attn_res),
+        }
+        return hashlib.sha1(json.dumps(meta, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> Optional[pathlib.Path]:
+        return None if self.cache_dir is None else self.cache_dir / key
+
+    def load(self, key: str) -> Optional[Dict]:
+        """return a dict with `cross_attn`, `self_attn`, `tokens` and `image_path`, or None if missing"""
+        if key in self._memory:
+            return self._memory[key]
+
+        entry_dir = self._entry_dir(key)
+        if entry_dir is None or not (entry_dir / self.attn_fname).exists():
+            return None
+
+        entry = torch.load(entry_dir / self.attn_fname, map_location="cpu")
+        image_path = entry_dir / self.image_fname
+        entry["image_path"] = image_path if image_path.exists() else None
+        self._memory[key] = entry
+        return entry
+
+    def save(self,
+             key: str,
+             cross_attn: Optional[torch.Tensor],
+             self_attn: Optional[torch.Tensor],
+             tokens: Optional[List[int]],
+             image_path: Optional[Union[AnyStr, pathlib.Path]] = None) -> Dict:
+        entry = {
+            "cross_attn": None if cross_attn is None else cross_attn.detach().cpu(),
+            "self_attn": None if self_attn is None else self_attn.detach().cpu(),
+            "tokens": None if tokens is None else list(tokens),
+            "image_path": None if image_path is None else pathlib.Path(image_path),
+        }
+
+        entry_dir = self._entry_dir(key)
+        if entry_dir is not None:
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            if image_path is not None:
+                shutil.copyfile(image_path, entry_dir / self.image_fname)
+                entry["image_path"] = entry_dir / self.image_fname
+            torch.save({k: v for k, v in entry.items() if k != "image_path"}, entry_dir / self.attn_fname)
+
+        self._memory[key] = entry
+        return entry
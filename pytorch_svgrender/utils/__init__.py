@@ -4,5 +4,19 @@
 # Copyright (c) 2023, XiMing Xing.
 # License: MPL-2.0 License
 
-from .misc import *
-from .color_attrs import get_rgb_from_color
+from pytorch_svgrender.libs.utils import lazy
+
+__getattr__, __dir__, __all__ = lazy.attach(
+    __name__,
+    submodules={},
+    submod_attrs={
+        'misc': ['AnyPath', 'AnyList', 'AnyDict', 'render_batch_wrap', 'get_seed_range'],
+        'color_attrs': ['get_rgb_from_color'],
+        'result_cache': ['ResultCache', 'collect_artifacts'],
+        'prompt_index': ['PromptIndex', 'PromptWarmStart'],
+        'multirun': ['render_batch_parallel', 'worker_resources', 'pin_worker', 'SeedScheduler'],
+        'target_images': ['is_batch_target', 'list_target_images', 'batch_img2svg'],
+        'trajectory_log': ['TrajectoryWriter', 'TrajectoryReader', 'build_trajectory_writer', 'encode_scene',
+                           'decode_scene']
+    }
+)
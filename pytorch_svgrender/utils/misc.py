@@ -21,6 +21,15 @@ def render_batch_wrap(cfg: omegaconf.DictConfig,
                       seed_range: List,
                       pipeline: Any,
                       **pipe_args):
+    n_workers = cfg.get('n_workers', 1)
+    if n_workers > 1:  # shard the seeds across processes
+        from .multirun import render_batch_parallel
+
+        return render_batch_parallel(cfg, seed_range, pipeline, n_workers,
+                                     worker_threads=cfg.get('worker_threads', None),
+                                     max_retries=cfg.get('max_retries', 1),
+                                     **pipe_args)
+
     start_time = datetime.now()
     for idx, seed in enumerate(seed_range):
         cfg.seed = seed  # update seed
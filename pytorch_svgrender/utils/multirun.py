@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: multi-process execution of a multirun seed range
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import os
+import json
+import queue
+import itertools
+import pathlib
+import traceback
+import multiprocessing as mp
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import omegaconf
+
+
+def _split(items: List, n: int) -> List[List]:
+    """split `items` into `n` contiguous chunks of (almost) equal size"""
+    k, m = divmod(len(items), n)
+    return [items[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
+
+
+def worker_resources(n_workers: int, threads: Optional[int]) -> List[Dict]:
+    """CPU cores, torch threads and CUDA device of each worker"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    core_chunks = _split(cores, n_workers) if len(cores) >= n_workers else [cores] * n_workers
+
+    import torch
+
+    devices = []
+    if torch.cuda.is_available():
+        visible = os.environ.get('CUDA_VISIBLE_DEVICES', None)
+        devices = visible.split(',') if visible else [str(i) for i in range(torch.cuda.device_count())]
+
+    return [{
+        'cores': core_chunks[i],
+        'threads': threads or max(1, len(core_chunks[i])),
+        'device': devices[i % len(devices)] if len(devices) > 0 else None,
+    } for i in range(n_workers)]
+
+
+def pin_worker(resources: Dict, hydra_cfg: omegaconf.DictConfig = None) -> None:
+    """pin the current process to its cores, device and thread budget, before CUDA is initialized"""
+    if resources['device'] is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = resources['device']
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, resources['cores'])
+
+    import torch
+    torch.set_num_threads(resources['threads'])
+
+    if hydra_cfg is not None:
+        from hydra.core.hydra_config import HydraConfig
+        HydraConfig.instance().set_config(hydra_cfg)
+
+
+class SeedScheduler:
+    """
+    The seed accounting of `render_batch_parallel`, kept on the parent side.
+
+    A seed is handed to one worker at a time and stays in flight until that worker reports it,
+    so the seed of a worker that died, at any point, is known and can be retried.
+    Each assignment has its own token, echoed back with the result: a late report of a dead
+    worker never completes the retry of the same seed, even on the same worker index.
+    """
+
+    def __init__(self, seed_range: List, max_retries: int = 1):
+        self.seed_range = list(seed_range)
+        self.max_retries = max_retries
+        self.pending = deque(self.seed_range)
+        self.in_flight: Dict[int, Tuple[int, Any]] = {}  # worker -> (token, seed)
+        self._tokens = itertools.count()
+        self.attempts = {seed: 0 for seed in self.seed_range}
+        self.done: Dict[Any, int] = {}
+        self.failed: Dict[Any, str] = {}
+
+    @property
+    def finished(self) -> bool:
+        return len(self.done) + len(self.failed) >= len(self.seed_range)
+
+    def assign(self, idx: int) -> Optional[Tuple[int, Any]]:
+        """the next (token, seed) of the idle worker `idx`, None if there is nothing to do"""
+        if self.in_flight.get(idx, None) is not None or len(self.pending) == 0:
+            return None
+        self.in_flight[idx] = (next(self._tokens), self.pending.popleft())
+        return self.in_flight[idx]
+
+    def on_result(self, idx: int, token: int, seed: Any, ok: bool, error: str = None):
+        if self.in_flight.get(idx, None) != (token, seed):
+            return  # late report of a worker that was already reaped, the seed was rescheduled
+        self.in_flight[idx] = None
+        if ok:
+            self.done[seed] = idx
+        else:
+            self.on_failure(seed, error)
+
+    def on_worker_exit(self, idx: int, exitcode: int = None):
+        """a worker that died took its in-flight seed with it"""
+        assignment = self.in_flight.pop(idx, None)
+        if assignment is not None:
+            self.on_failure(assignment[1], f"worker {idx} exited with code {exitcode}")
+
+    def on_failure(self, seed: Any, error: str):
+        self.attempts[seed] += 1
+        if self.attempts[seed] <= self.max_retries:
+            print(f"-> seed {seed} failed, retry {self.attempts[seed]}/{self.max_retries}")
+            self.pending.append(seed)
+        else:
+            print(f"-> seed {seed} failed after {self.max_retries} retries:\n{error}")
+            self.failed[seed] = error
+
+    def abort(self, error: str):
+        """fail every seed that is not finished, e.g. when no worker is left"""
+        for seed in list(self.pending) + [a[1] for a in self.in_flight.values() if a is not None]:
+            self.failed[seed] = error
+        self.pending.clear()
+        self.in_flight.clear()
+
+
+def _seed_worker(idx: int,
+                 resources: Dict,
+                 cfg: omegaconf.DictConfig,
+                 hydra_cfg: omegaconf.DictConfig,
+                 pipeline: Any,
+                 pipe_args: Dict,
+                 task_queue: mp.Queue,
+                 result_queue: mp.Queue):
+    # pin the worker before CUDA and the thread pools are initialized
+    pin_worker(resources, hydra_cfg)
+
+    import torch
+    from accelerate.utils import set_seed
+    from pytorch_svgrender.model_helper import keep_pipelines_warm
+
+    keep_pipelines_warm(True)  # the diffusion models are loaded once per worker
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        token, seed = task
+        try:
+            cfg.seed = seed
+            set_seed(seed)  # the same RNG state as a sequential run of this seed
+            pipe = pipeline(cfg)
+            pipe.painterly_rendering(**pipe_args)
+            del pipe
+            result_queue.put(('ok', idx, token, seed, None))
+        except Exception:
+            result_queue.put(('error', idx, token, seed, traceback.format_exc()))
+        finally:
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+
+def render_batch_parallel(cfg: omegaconf.DictConfig,
+                          seed_range: List,
+                          pipeline: Any,
+                          n_workers: int,
+                          worker_threads: Optional[int] = None,
+                          max_retries: int = 1,
+                          **pipe_args) -> Dict[str, Dict]:
+    """
+    Render `seed_range` with `n_workers` processes on one host.
+
+    Each worker is pinned to its own share of the CPU cores (and `worker_threads` torch threads),
+    and to one CUDA device in round-robin. Seeds are handed out one at a time to the idle workers,
+    so the workers stay busy when some seeds are slower than others, and the diffusion models stay
+    warm in each worker. All results are written under the current Hydra output dir. A failed seed,
+    or a seed whose worker crashed, is retried up to `max_retries` times; a crashed worker is restarted,
+    and the remaining seeds fail when the workers keep crashing.
+
+    Returns:
+        {'done': {seed: worker}, 'failed': {seed: error}}
+    """
+    from hydra.core.hydra_config import HydraConfig
+
+    ctx = mp.get_context('spawn')  # CUDA can not be used in forked processes
+    result_queue = ctx.Queue()
+
+    resources = worker_resources(n_workers, worker_threads)
+    hydra_cfg = HydraConfig.instance().cfg
+
+    def spawn(idx):
+        # a fresh task queue, a seed left in the queue of a dead worker must not run twice
+        task_queue = ctx.Queue()
+        p = ctx.Process(target=_seed_worker,
+                        args=(idx, resources[idx], cfg, hydra_cfg, pipeline, pipe_args, task_queue, result_queue),
+                        name=f"seed-worker-{idx}",
+                        daemon=True)
+        p.start()
+        print(f"-> worker {idx}: cores {resources[idx]['cores']}, "
+              f"threads {resources[idx]['threads']}, device {resources[idx]['device']}")
+        return p, task_queue
+
+    workers = {idx: spawn(idx) for idx in range(n_workers)}
+    restarts, max_restarts = 0, n_workers * (max_retries + 1)
+    scheduler = SeedScheduler(seed_range, max_retries)
+    start_time = datetime.now()
+
+    try:
+        while not scheduler.finished:
+            for idx, (_, task_queue) in workers.items():
+                task = scheduler.assign(idx)
+                if task is not None:
+                    task_queue.put(task)
+
+            try:
+                kind, idx, token, seed, info = result_queue.get(timeout=1.0)
+                scheduler.on_result(idx, token, seed, ok=kind == 'ok', error=info)
+                if kind == 'ok':
+                    print(f"\n-> [{len(scheduler.done) + len(scheduler.failed)}/{len(seed_range)}], "
+                          f"seed {seed} done by worker {idx}, current time: {datetime.now() - start_time}\n")
+                continue
+            except queue.Empty:
+                pass
+
+            for idx, (p, _) in list(workers.items()):
+                if p.is_alive():
+                    continue
+                scheduler.on_worker_exit(idx, p.exitcode)
+                del workers[idx]
+                if restarts < max_restarts:
+                    restarts += 1
+                    workers[idx] = spawn(idx)
+            if len(workers) == 0 and not scheduler.finished:
+                scheduler.abort(f"seed workers keep crashing, {restarts} restarts.")
+    finally:
+        for _, task_queue in workers.values():
+            task_queue.put(None)
+        for p, _ in workers.values():
+            p.join(timeout=60)
+            if p.is_alive():
+                p.terminate()
+
+    summary = {
+        'done': {str(s): w for s, w in scheduler.done.items()},
+        'failed': {str(s): e for s, e in scheduler.failed.items()},
+    }
+    output_dir = pathlib.Path(HydraConfig.get().runtime.output_dir)
+    with open(output_dir / "multirun_summary.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"-> multirun: {len(scheduler.done)} done, {len(scheduler.failed)} failed, "
+          f"total time: {datetime.now() - start_time}")
+    return summary
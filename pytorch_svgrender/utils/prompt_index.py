@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: index of previous results keyed by CLIP text embeddings
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import os
+import json
+import shutil
+import hashlib
+import pathlib
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import omegaconf
+import torch
+
+from .misc import AnyPath
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def _file_lock(path: pathlib.Path):
+    """an exclusive advisory lock between the processes writing the same index"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class PromptIndex:
+    """
+    A local vector index of final SVGs, keyed by the normalized CLIP text embedding of their prompt.
+
+    The search is exact (a single matrix product over the stored embeddings), which stays
+    fast for tens of thousands of entries. One index is kept per CLIP model, since the
+    embeddings of different models are not comparable.
+
+    Layout::
+
+        {index_dir}/{clip_model}/embeddings.pt   # [N, D] normalized text embeddings
+        {index_dir}/{clip_model}/entries.json    # prompt, method and svg file of each row
+        {index_dir}/{clip_model}/svg/{id}.svg    # copies of the indexed SVGs
+
+    Other files than SVGs (e.g. model weights) are indexed the same way with another `file_dir`.
+    """
+
+    def __init__(self, index_dir: AnyPath, clip_model_name: str, file_dir: str = "svg"):
+        self.root = pathlib.Path(index_dir) / clip_model_name.replace('/', '-')
+        self.file_dir = file_dir
+        self.svg_dir = self.root / file_dir
+        self.svg_dir.mkdir(parents=True, exist_ok=True)
+
+        self.lock_path = self.root / "index.lock"
+
+        self.entries: List[Dict] = []
+        self.embeddings: Optional[torch.Tensor] = None
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        if not (self.root / "entries.json").exists() or not (self.root / "embeddings.pt").exists():
+            self.entries, self.embeddings = [], None
+            return
+        with open(self.root / "entries.json", 'r') as f:
+            self.entries = json.load(f)
+        self.embeddings = torch.load(self.root / "embeddings.pt", map_location='cpu')
+
+        # rows are only appended, after an interrupted save the common prefix is still consistent
+        n_embeddings = 0 if self.embeddings is None else self.embeddings.shape[0]
+        if n_embeddings != len(self.entries):
+            n = min(n_embeddings, len(self.entries))
+            print(f"-> prompt index '{self.root}': {len(self.entries)} entries but {n_embeddings} embeddings, "
+                  f"keep the first {n}")
+            self.entries = self.entries[:n]
+            self.embeddings = self.embeddings[:n] if n > 0 else None
+
+    def add(self, prompt: str, embedding: torch.Tensor, svg_path: AnyPath, method: str, meta: Dict = None):
+        embedding = embedding.detach().float().cpu().reshape(1, -1)
+        with _file_lock(self.lock_path):
+            # other processes may have added entries since this index was loaded
+            self.load()
+            entry_id = hashlib.sha1(f"{method}-{prompt}-{len(self)}".encode("utf-8")).hexdigest()[:16]
+            suffix = pathlib.Path(svg_path).suffix
+            shutil.copyfile(svg_path, self.svg_dir / f"{entry_id}{suffix}")
+
+            self.entries.append({
+                'id': entry_id,
+                'prompt': prompt,
+                'method': method,
+                self.file_dir: f"{self.file_dir}/{entry_id}{suffix}",
+                'meta': meta or {},
+            })
+            self.embeddings = embedding if self.embeddings is None else torch.cat([self.embeddings, embedding])
+            self._write()
+
+    def search(self, embedding: torch.Tensor, k: int = 1, method: str = None) -> List[Tuple[float, Dict]]:
+        """return the `k` nearest entries as (cosine similarity, entry), restricted to `method` if given"""
+        if len(self) == 0:
+            return []
+
+        sims = self.embeddings @ embedding.detach().float().cpu().reshape(-1)
+        if method is not None:
+            mask = torch.tensor([e['method'] == method for e in self.entries])
+            sims = sims.masked_fill(~mask, float('-inf'))
+
+        scores, indices = sims.topk(min(k, len(self)))
+        return [
+            (s, dict(self.entries[i], **{self.file_dir: (self.root / self.entries[i][self.file_dir]).as_posix()}))
+            for s, i in zip(scores.tolist(), indices.tolist()) if s != float('-inf')
+        ]
+
+    def save(self):
+        with _file_lock(self.lock_path):
+            self._write()
+
+    def _write(self):
+        # each file is replaced atomically, the embeddings first: a reader never sees entries without embeddings
+        tmp = self.root / "embeddings.pt.tmp"
+        torch.save(self.embeddings, tmp)
+        os.replace(tmp, self.root / "embeddings.pt")
+        tmp = self.root / "entries.json.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp, self.root / "entries.json")
+
+
+class PromptWarmStart:
+    """
+    Warm start a text2svg run from the result of the most similar previous prompt.
+
+    Examples:
+        >>> warm_start = PromptWarmStart(cfg.x.warm_start, method='vectorfusion', device=device)
+        >>> hit = warm_start.lookup(prompt)  # None, or (similarity, svg path)
+        >>> ...
+        >>> warm_start.register(prompt, final_svg_path)
+    """
+
+    def __init__(self, cfg: omegaconf.DictConfig, method: str, device: torch.device, index: PromptIndex = None):
+        import hydra
+
+        self.cfg = cfg
+        self.method = method
+        self.device = device
+        self.index = index if index is not None else \
+            PromptIndex(hydra.utils.to_absolute_path(cfg.index_dir), cfg.clip_model)
+        self._clip = None
+
+    @property
+    def clip(self):
+        if self._clip is None:
+            from pytorch_svgrender.libs.metric.clip_score import CLIPScoreWrapper
+
+            self._clip = CLIPScoreWrapper(self.cfg.clip_model, device=self.device)
+        return self._clip
+
+    @torch.no_grad()
+    def embed(self, prompt: str) -> torch.Tensor:
+        return self.clip.encode_text(prompt, norm=True)
+
+    def lookup(self, prompt: str) -> Optional[Tuple[float, str]]:
+        if len(self.index) == 0:
+            return None
+        results = self.index.search(self.embed(prompt), k=1, method=self.method)
+        if len(results) == 0 or results[0][0] < self.cfg.min_similarity:
+            return None
+        similarity, entry = results[0]
+        return similarity, entry[self.index.file_dir]
+
+    def shorten(self, num_iter: int) -> int:
+        return max(1, int(num_iter * self.cfg.iter_ratio))
+
+    def register(self, prompt: str, svg_path: AnyPath, meta: Dict = None):
+        if not self.cfg.register or not pathlib.Path(svg_path).exists():
+            return
+        self.index.add(prompt, self.embed(prompt), svg_path, self.method, meta)
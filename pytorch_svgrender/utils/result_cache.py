@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: content-addressed cache of rendering results
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import pathlib
+from typing import Dict, List, Optional
+
+import omegaconf
+
+from .misc import AnyPath
+
+# intermediate outputs are not worth caching
+_SKIP_DIRS = {'sd_samples', 'offload', 'runs'}
+_ARTIFACT_SUFFIXES = {'.svg', '.png', '.mp4'}
+
+
+def file_digest(fpath: AnyPath, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# the config keys that do not change the results, all the others are part of the cache key
+_NON_SEMANTIC_KEYS = [
+    'result_path', 'result_cache', 'hydra',
+    'state.wandb', 'state.tensorboard', 'metric_log',
+    'diffuser.download', 'diffuser.force_download', 'diffuser.resume_download',
+    'diffvg.print_timing',
+    'n_workers', 'worker_threads', 'max_retries',
+]
+
+
+def _index_digest(index_dir: AnyPath) -> Optional[str]:
+    """the entries of a warm start index, a new entry can change the result of a warm started run"""
+    import hydra
+    index_dir = pathlib.Path(hydra.utils.to_absolute_path(str(index_dir)))
+    if not index_dir.exists():
+        return None
+    h = hashlib.sha1()
+    for fpath in sorted(index_dir.rglob('entries.json')):
+        h.update(fpath.relative_to(index_dir).as_posix().encode("utf-8"))
+        h.update(file_digest(fpath).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _is_artifact(rel_path: pathlib.Path) -> bool:
+    if rel_path.suffix.lower() not in _ARTIFACT_SUFFIXES:
+        return False
+    return not any(p.endswith('logs') or p in _SKIP_DIRS for p in rel_path.parts[:-1])
+
+
+def collect_artifacts(output_dir: AnyPath) -> List[pathlib.Path]:
+    """final SVGs and key PNGs of a run (outside of the `*logs` folders), relative to `output_dir`"""
+    output_dir = pathlib.Path(output_dir)
+    return sorted(
+        p.relative_to(output_dir) for p in output_dir.rglob('*')
+        if p.is_file() and _is_artifact(p.relative_to(output_dir))
+    )
+
+
+class ResultCache:
+    """
+    Content-addressed cache of the final outputs of `svg_render.py`.
+
+    The key hashes the whole resolved config except `_NON_SEMANTIC_KEYS` (logging, paths and
+    the cache settings), with the bytes of the input files and the entries of the enabled
+    warm start indexes. The final SVGs and key PNGs
+    (everything outside of the `*logs` folders) of a run are stored under the key;
+    a later run with the same key copies them into its output dir instead of rendering.
+
+    Layout::
+
+        {cache_dir}/manifest.json              # key -> files, size, last access time
+        {cache_dir}/objects/{key}/...          # artifacts, relative to the output dir
+
+    The cache is bounded by `max_size_gb`, the least recently used entries are evicted first.
+    """
+
+    manifest_fname = "manifest.json"
+
+    def __init__(self, cache_dir: AnyPath, max_size_gb: float = 10):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.manifest: Dict[str, Dict] = self._read_manifest()
+
+    @staticmethod
+    def make_key(cfg: omegaconf.DictConfig) -> str:
+        meta = omegaconf.OmegaConf.to_container(cfg, resolve=True)
+        for dotted in _NON_SEMANTIC_KEYS:
+            *parents, name = dotted.split('.')
+            node = meta
+            for k in parents:
+                node = node.get(k, None) if isinstance(node, dict) else None
+            if isinstance(node, dict):
+                node.pop(name, None)
+
+        # the inputs and the warm start indexes by content
+        for name in ['target', 'style_file']:
+            fpath = meta.get(name, None)
+            if fpath is not None and os.path.isfile(str(fpath)):
+                meta[name] = file_digest(fpath)
+        meta['warm_start_indexes'] = {
+            name: _index_digest(cfg.x[name].index_dir)
+            for name in ['warm_start', 'phi_warm_start']
+            if cfg.x.get(name, None) is not None and cfg.x[name].get('enable', False)
+        }
+        return hashlib.sha1(json.dumps(meta, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def restore(self, key: str, output_dir: AnyPath) -> Optional[List[pathlib.Path]]:
+        """copy the cached artifacts of `key` into `output_dir`, return None on a miss"""
+        entry = self.manifest.get(key, None)
+        if entry is None:
+            return None
+
+        entry_dir = self.objects_dir / key
+        if not all((entry_dir / f).exists() for f in entry['files']):  # broken entry
+            self._remove(key)
+            self._write_manifest()
+            return None
+
+        output_dir = pathlib.Path(output_dir)
+        restored = []
+        for f in entry['files']:
+            dst = output_dir / f
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(entry_dir / f, dst)
+            restored.append(dst)
+
+        entry['last_access'] = time.time()
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._write_manifest()
+        return restored
+
+    def store(self, key: str, output_dir: AnyPath, meta: Optional[Dict] = None) -> List[str]:
+        """store the artifacts of a finished run, then evict entries beyond the size limit"""
+        output_dir = pathlib.Path(output_dir)
+        files = collect_artifacts(output_dir)
+        if len(files) == 0:
+            return []
+
+        entry_dir = self.objects_dir / key
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir)
+        for f in files:
+            (entry_dir / f).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(output_dir / f, entry_dir / f)
+
+        now = time.time()
+        self.manifest[key] = {
+            'files': [f.as_posix() for f in files],
+            'bytes': sum((entry_dir / f).stat().st_size for f in files),
+            'created': now,
+            'last_access': now,
+            'hits': 0,
+            'meta': meta or {},
+        }
+        self.evict()
+        self._write_manifest()
+        return self.manifest[key]['files'] if key in self.manifest else []
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(e['bytes'] for e in self.manifest.values())
+
+    def evict(self):
+        """drop the least recently used entries until the cache fits in `max_bytes`"""
+        lru = sorted(self.manifest.keys(), key=lambda k: self.manifest[k]['last_access'])
+        total = self.total_bytes
+        for key in lru:
+            if total <= self.max_bytes:
+                break
+            total -= self.manifest[key]['bytes']
+            self._remove(key)
+
+    def _remove(self, key: str):
+        self.manifest.pop(key, None)
+        shutil.rmtree(self.objects_dir / key, ignore_errors=True)
+
+    def _read_manifest(self) -> Dict[str, Dict]:
+        fpath = self.cache_dir / self.manifest_fname
+        if not fpath.exists():
+            return {}
+        try:
+            with open(fpath, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:  # interrupted write, start over
+            return {}
+
+    def _write_manifest(self):
+        fpath = self.cache_dir / self.manifest_fname
+        tmp = fpath.with_suffix('.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp, fpath)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: streaming of target images for batch img2svg
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import json
+import time
+import pathlib
+from typing import Callable, Dict, List, Optional
+
+import torch
+from torch.utils.data import Dataset, DataLoader
+from torchvision import transforms
+from torchvision.utils import save_image
+from PIL import Image
+
+from .misc import AnyPath
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+MANIFEST_EXTENSIONS = ('.txt', '.json')
+
+
+def is_batch_target(target: Optional[AnyPath]) -> bool:
+    """a directory of images or a manifest file (.txt: one path per line, .json: a list of paths)"""
+    if target is None:
+        return False
+    target = pathlib.Path(target)
+    return target.is_dir() or (target.is_file() and target.suffix.lower() in MANIFEST_EXTENSIONS)
+
+
+def list_target_images(target: AnyPath) -> List[pathlib.Path]:
+    target = pathlib.Path(target)
+    if target.is_dir():
+        return sorted(p for p in target.rglob('*') if p.suffix.lower() in IMG_EXTENSIONS)
+
+    if target.suffix.lower() == '.json':
+        with open(target, 'r') as f:
+            items = json.load(f)
+        # a list of paths, or a list of {"target": path, ...}
+        paths = [item['target'] if isinstance(item, dict) else item for item in items]
+    else:
+        with open(target, 'r') as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    # relative paths are relative to the manifest
+    return [p if p.is_absolute() else target.parent / p for p in map(pathlib.Path, paths)]
+
+
+class TargetImageDataset(Dataset):
+
+    def __init__(self, files: List[pathlib.Path], image_size: Optional[int] = None):
+        self.files = files
+        comps = [transforms.Resize(size=(image_size, image_size))] if image_size else []
+        self.transform = transforms.Compose(comps + [transforms.ToTensor()])
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, idx):
+        fpath = self.files[idx]
+        try:
+            image = self.transform(Image.open(fpath).convert("RGB"))
+            error = None
+        except Exception as e:  # a broken file must not stop the batch
+            image, error = None, f"{type(e).__name__}: {e}"
+        return {'index': idx, 'path': fpath.as_posix(), 'image': image, 'error': error}
+
+
+def _collate_targets(items: List[Dict]) -> List[Dict]:
+    # the images may differ in size, they are kept as a list
+    return items
+
+
+def build_target_loader(files: List[pathlib.Path],
+                        image_size: Optional[int] = None,
+                        group_size: int = 1,
+                        num_workers: int = 4,
+                        prefetch_factor: int = 2) -> DataLoader:
+    """decode and resize the next groups of targets in background workers"""
+    return DataLoader(TargetImageDataset(files, image_size),
+                      batch_size=group_size,
+                      shuffle=False,
+                      num_workers=num_workers,
+                      collate_fn=_collate_targets,
+                      pin_memory=torch.cuda.is_available(),
+                      prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                      persistent_workers=num_workers > 0)
+
+
+def batch_img2svg(pipe, target: AnyPath, image_size: Optional[int], fit_group: Callable) -> List[Dict]:
+    """
+    Vectorize every image of a directory or manifest with `pipe`.
+
+    Targets are decoded ahead of time by the DataLoader workers. Images of the same size, with a canvas
+    not larger than `x.batch.small_canvas`, are optimized together (up to `x.batch.concurrent`) by
+    `fit_group(target_imgs) -> (renderers, raster_imgs, losses)`, larger images one at a time.
+    The results are listed in `{result_path}/batch_manifest.json`, updated after each group.
+    """
+    batch_cfg = pipe.x_cfg.batch
+    files = list_target_images(target)
+    pipe.print(f"batch img2svg: {len(files)} images from '{target}'")
+
+    out_dir = pipe.result_path / "batch"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = pipe.result_path / "batch_manifest.json"
+    manifest = []
+    if len(files) == 0:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+    loader = build_target_loader(files, image_size, batch_cfg.concurrent, batch_cfg.num_workers)
+    for items in loader:
+        for item in items:
+            if item['error'] is not None:
+                pipe.print(f"skip '{item['path']}': {item['error']}")
+                manifest.append({'target': item['path'], 'svg': None, 'error': item['error']})
+
+        items = [item for item in items if item['error'] is None]
+        if len(items) == 0:
+            continue
+
+        # the images of a group must share the canvas size, and large canvases are optimized one at a time
+        groups = {}
+        for item in items:
+            groups.setdefault(tuple(item['image'].shape), []).append(item)
+        groups = [g for shape, group in groups.items()
+                  for g in ([group] if max(shape[1:]) <= batch_cfg.small_canvas else [[item] for item in group])]
+
+        for group in groups:
+            start = time.time()
+            target_imgs = [item['image'].unsqueeze(0).to(pipe.device, non_blocking=True) for item in group]
+            try:
+                renderers, raster_imgs, losses = fit_group(target_imgs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                pipe.print(f"failed: {[item['path'] for item in group]}, {error}")
+                manifest.extend({'target': item['path'], 'svg': None, 'error': error} for item in group)
+                continue
+            seconds = (time.time() - start) / len(group)
+
+            for item, renderer, raster_img, loss in zip(group, renderers, raster_imgs, losses):
+                stem = f"{item['index']:05d}-{pathlib.Path(item['path']).stem}"
+                svg_path = out_dir / f"{stem}.svg"
+                renderer.save_svg(svg_path)
+                png_path = None
+                if batch_cfg.save_png:
+                    png_path = out_dir / f"{stem}.png"
+                    save_image(raster_img.detach(), png_path)
+                manifest.append({
+                    'target': item['path'],
+                    'svg': svg_path.as_posix(),
+                    'png': None if png_path is None else png_path.as_posix(),
+                    'loss': loss,
+                    'seconds': seconds,
+                    'error': None,
+                })
+
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        pipe.print(f"-> {len(manifest)}/{len(files)} images done")
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
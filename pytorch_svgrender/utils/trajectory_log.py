@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: compact binary log of the SVG parameters during optimization
+#   A trajectory is a directory with three files:
+#     - `topology.json`: the structure of the scenes (shape classes, segments, group ids ...), written once
+#                        per distinct topology, and the dtype of the deltas.
+#     - `data.bin`: append-only zlib chunks. A chunk holds consecutive steps of one topology, the first step
+#                   as float32 key frame, the next ones as deltas to the previous (decoded) step.
+#     - `index.bin`: one fixed-size record per step, memory-mapped for random access.
+#   A random access decodes at most one chunk.
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+
+import json
+import zlib
+import pathlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import omegaconf
+
+from .misc import AnyPath
+
+INDEX_DTYPE = np.dtype([('step', '<i8'), ('topology', '<i4'), ('row', '<i4'), ('offset', '<i8'), ('nbytes', '<i8')])
+
+
+def _encode(obj: Any, params: List) -> Dict:
+    """describe `obj` as a json spec, its float tensors are appended to `params`"""
+    import torch
+
+    if torch.is_tensor(obj):
+        if obj.is_floating_point():
+            params.append(obj.detach().reshape(-1).float().cpu())
+            return {'param': list(obj.shape)}
+        return {'const': obj.tolist(), 'dtype': str(obj.dtype).replace('torch.', '')}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return {'value': obj}
+    if isinstance(obj, (list, tuple)):
+        return {'list': [_encode(o, params) for o in obj]}
+    # pydiffvg shapes, groups and gradients
+    return {'cls': type(obj).__name__, 'attrs': {k: _encode(v, params) for k, v in vars(obj).items()}}
+
+
+def _decode(spec: Dict, flat: np.ndarray, offset: int) -> Tuple[Any, int]:
+    import torch
+    import pydiffvg
+
+    if 'param' in spec:
+        n = int(np.prod(spec['param']))
+        t = torch.from_numpy(flat[offset:offset + n].copy()).reshape(spec['param'])
+        return t, offset + n
+    if 'const' in spec:
+        return torch.tensor(spec['const'], dtype=getattr(torch, spec['dtype'])), offset
+    if 'value' in spec:
+        return spec['value'], offset
+    if 'list' in spec:
+        items = []
+        for s in spec['list']:
+            item, offset = _decode(s, flat, offset)
+            items.append(item)
+        return items, offset
+    cls = getattr(pydiffvg, spec['cls'])
+    obj = cls.__new__(cls)
+    for k, s in spec['attrs'].items():
+        v, offset = _decode(s, flat, offset)
+        setattr(obj, k, v)
+    return obj, offset
+
+
+def encode_scene(canvas_width: int, canvas_height: int, shapes: List, shape_groups: List) -> Tuple[Dict, np.ndarray]:
+    """the json spec of a scene and its float parameters as one flat float32 array"""
+    import torch
+
+    params = []
+    spec = {
+        'canvas': [int(canvas_width), int(canvas_height)],
+        'shapes': _encode(list(shapes), params),
+        'groups': _encode(list(shape_groups), params),
+    }
+    flat = torch.cat(params).numpy() if len(params) > 0 else np.zeros(0, dtype=np.float32)
+    return spec, flat
+
+
+def decode_scene(spec: Dict, flat: np.ndarray):
+    """inverse of `encode_scene`, a `SVGScene`"""
+    from pytorch_svgrender.model_helper import SVGScene
+
+    shapes, offset = _decode(spec['shapes'], flat, 0)
+    shape_groups, _ = _decode(spec['groups'], flat, offset)
+    return SVGScene(*spec['canvas'], shapes, shape_groups)
+
+
+class TrajectoryWriter:
+    """
+    Append the parameters of a scene every `save_step`, instead of writing `svg_iter{step}.svg`.
+
+    Args:
+        log_dir: the trajectory directory.
+        dtype: dtype of the deltas between steps, 'float16' or 'float32'.
+            The deltas are taken to the decoded previous step, so float16 errors do not accumulate.
+        chunk_size: steps per compressed chunk.
+    """
+
+    def __init__(self, log_dir: AnyPath, dtype: str = 'float16', chunk_size: int = 64, compress_level: int = 6):
+        self.log_dir = pathlib.Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+
+        self.topologies, self._signatures = [], {}
+        self._data = open(self.log_dir / "data.bin", 'wb')
+        self._index = open(self.log_dir / "index.bin", 'wb')
+        self._rows, self._steps, self._topology = [], [], None
+
+    def append(self, step: int, scene) -> None:
+        """`scene`: anything with `canvas_width`, `canvas_height`, `shapes`, `shape_groups`, e.g. a Painter"""
+        spec, row = encode_scene(scene.canvas_width, scene.canvas_height, scene.shapes, scene.shape_groups)
+
+        signature = json.dumps(spec, sort_keys=True)
+        topology = self._signatures.get(signature, None)
+        if topology is None:
+            topology = len(self.topologies)
+            self._signatures[signature] = topology
+            self.topologies.append(dict(spec, size=int(row.size)))
+            self._write_topology()
+
+        if topology != self._topology or len(self._rows) >= self.chunk_size:
+            self.flush()
+        self._topology = topology
+        self._rows.append(row)
+        self._steps.append(step)
+
+    def _write_topology(self):
+        with open(self.log_dir / "topology.json", 'w') as f:
+            json.dump({'dtype': self.dtype.name, 'topologies': self.topologies}, f)
+
+    def flush(self) -> None:
+        if len(self._rows) == 0:
+            return
+        key = self._rows[0].astype(np.float32)
+        prev, deltas = key, []
+        for row in self._rows[1:]:
+            delta = (row - prev).astype(self.dtype)
+            prev = prev + delta.astype(np.float32)
+            deltas.append(delta)
+        payload = key.tobytes() + b''.join(d.tobytes() for d in deltas)
+        payload = zlib.compress(payload, self.compress_level)
+
+        offset = self._data.tell()
+        self._data.write(payload)
+        records = np.zeros(len(self._rows), dtype=INDEX_DTYPE)
+        records['step'] = self._steps
+        records['topology'] = self._topology
+        records['row'] = np.arange(len(self._rows))
+        records['offset'] = offset
+        records['nbytes'] = len(payload)
+        self._index.write(records.tobytes())
+        self._data.flush()
+        self._index.flush()
+        self._rows, self._steps = [], []
+
+    def close(self) -> None:
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+class TrajectoryReader:
+    """random access to the steps of a trajectory, see `TrajectoryWriter`"""
+
+    def __init__(self, log_dir: AnyPath):
+        self.log_dir = pathlib.Path(log_dir)
+        with open(self.log_dir / "topology.json", 'r') as f:
+            meta = json.load(f)
+        self.dtype = np.dtype(meta['dtype'])
+        self.topologies = meta['topologies']
+
+        index_path, data_path = self.log_dir / "index.bin", self.log_dir / "data.bin"
+        self.index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r') \
+            if index_path.stat().st_size > 0 else np.zeros(0, dtype=INDEX_DTYPE)
+        self.data = np.memmap(data_path, dtype=np.uint8, mode='r') \
+            if data_path.stat().st_size > 0 else np.zeros(0, dtype=np.uint8)
+        self._pos = {int(s): i for i, s in enumerate(self.index['step'])}
+        self._cache = (None, None)  # the last decoded chunk
+
+    @property
+    def steps(self) -> List[int]:
+        return [int(s) for s in self.index['step']]
+
+    def _decode_chunk(self, offset: int, nbytes: int, size: int) -> np.ndarray:
+        if self._cache[0] == offset:
+            return self._cache[1]
+        payload = zlib.decompress(self.data[offset:offset + nbytes].tobytes())
+        key = np.frombuffer(payload, dtype=np.float32, count=size)
+        deltas = np.frombuffer(payload, dtype=self.dtype, offset=key.nbytes).reshape(-1, size)
+        rows, prev = [key], key
+        for delta in deltas:
+            prev = prev + delta.astype(np.float32)
+            rows.append(prev)
+        rows = np.stack(rows)
+        self._cache = (offset, rows)
+        return rows
+
+    def params(self, step: int) -> Tuple[Dict, np.ndarray]:
+        """the topology and the flat parameters of `step`"""
+        if step not in self._pos:
+            raise KeyError(f"step {step} is not in '{self.log_dir}', available: {self.steps[:3]}...")
+        record = self.index[self._pos[step]]
+        topology = self.topologies[int(record['topology'])]
+        rows = self._decode_chunk(int(record['offset']), int(record['nbytes']), topology['size'])
+        return topology, rows[int(record['row'])]
+
+    def scene(self, step: int):
+        topology, flat = self.params(step)
+        return decode_scene(topology, flat)
+
+    def _state(self):
+        import torch
+        from pytorch_svgrender.model_helper import DiffVGState
+
+        return DiffVGState(torch.device('cpu'), use_gpu=False)
+
+    def export_svg(self, step: int, fpath: AnyPath) -> None:
+        scene = self.scene(step)
+        self._state().save_svg(fpath, scene.canvas_width, scene.canvas_height, scene.shapes, scene.shape_groups)
+
+    def export_png(self, step: int, fpath: AnyPath) -> None:
+        import torch
+        import torchvision
+
+        with torch.no_grad():
+            img = self._state().render_image(*self.scene(step))
+        torchvision.utils.save_image(img, fp=fpath)
+
+
+def build_trajectory_writer(args: omegaconf.DictConfig, log_dir: AnyPath) -> Optional[TrajectoryWriter]:
+    """a writer if `trajectory_log.enable`, otherwise None and the svg snapshots are saved as before"""
+    cfg = args.get('trajectory_log', None)
+    if cfg is None or not cfg.enable:
+        return None
+    return TrajectoryWriter(log_dir, dtype=cfg.dtype, chunk_size=cfg.chunk_size)
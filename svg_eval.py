@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Author: ximing xing
+# Description: evaluate the final SVGs of many runs and write a leaderboard.
+# Copyright (c) 2024, XiMing Xing.
+
+import argparse
+import pathlib
+
+from pytorch_svgrender.evaluation import (FeatureCache, METRICS, scan_result_dirs, evaluate, reference_statistics,
+                                          leaderboard, write_table)
+
+
+def main(args):
+    items = scan_result_dirs(args.result_dirs, pattern=args.pattern)
+    print(f"-> found {len(items)} SVGs in {len(set(it['run_dir'] for it in items))} runs")
+    if len(items) == 0:
+        return
+
+    cache_dir = pathlib.Path(args.cache_dir)
+    cache = FeatureCache(cache_dir / "features.sqlite")
+    evaluate(items, args.metrics, cache,
+             raster_dir=cache_dir / "raster",
+             image_size=args.image_size,
+             batch_size=args.batch_size,
+             n_workers=args.n_workers)
+
+    cache.close()
+
+    ref_stats = None
+    if 'fid' in args.metrics:
+        assert args.fid_ref is not None, "FID needs the real images, please set `--fid-ref`."
+        ref_stats = reference_statistics(args.fid_ref, cache_dir / "fid_stats", batch_size=args.batch_size)
+
+    out_dir = pathlib.Path(args.out_dir)
+    columns = ['method', 'style', 'prompt', 'seed', 'svg', 'run_dir', 'error'] + [m for m in args.metrics if m != 'fid']
+    write_table([{k: it.get(k, None) for k in columns} for it in items], out_dir / f"eval_items.{args.format}")
+    board = leaderboard(items, args.metrics, group_by=args.group_by, ref_stats=ref_stats)
+    write_table(board, out_dir / f"leaderboard.{args.format}")
+    for row in board:
+        print(row)
+    print(f"-> leaderboard saved in '{out_dir}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("result_dirs", type=str, nargs='+', help='the roots of the Hydra run dirs.')
+    parser.add_argument("--metrics", type=str, nargs='+', default=['clip_score'], choices=list(METRICS.keys()))
+    parser.add_argument("--pattern", type=str, default='*final*.svg', help='file name pattern of the final SVGs.')
+    parser.add_argument("--group-by", type=str, nargs='+', default=['method'])
+    parser.add_argument("--fid-ref", type=str, default=None, help='a directory of real images, or a .npz of their statistics, for FID.')
+    parser.add_argument("--cache-dir", type=str, default='./workspace/.eval_cache')
+    parser.add_argument("--out-dir", type=str, default='./workspace/eval')
+    parser.add_argument("--format", type=str, default='csv', choices=['csv', 'parquet'])
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--n-workers", type=int, default=8, help='rasterization processes.')
+    args = parser.parse_args()
+
+    """
+    python svg_eval.py ./workspace --metrics clip_score image_reward --group-by method style
+    python svg_eval.py ./workspace --metrics fid --fid-ref ./data/coco_val --format parquet
+    """
+
+    main(args)
@@ -7,11 +7,10 @@ import os
 import sys
 from functools import partial
 
-from accelerate.utils import set_seed
 import hydra
 import omegaconf
 
-from pytorch_svgrender.utils import render_batch_wrap, get_seed_range
+from pytorch_svgrender.utils import render_batch_wrap, get_seed_range, ResultCache, is_batch_target
 
 METHODS = [
     'diffvg',
@@ -40,6 +39,22 @@ def main(cfg: omegaconf.DictConfig):
     flag = cfg.x.method
     assert flag in METHODS, f"{flag} is not currently supported!"
 
+    # result cache: skip the rendering if the same job has been done before
+    result_cache, cache_key = None, None
+    output_dir = hydra.core.hydra_config.HydraConfig.get().runtime.output_dir
+    if cfg.result_cache.enable and not (cfg.multirun and cfg.srange is None):
+        result_cache = ResultCache(hydra.utils.to_absolute_path(cfg.result_cache.cache_dir),
+                                   max_size_gb=cfg.result_cache.max_size_gb)
+        cache_key = ResultCache.make_key(cfg)
+        restored = result_cache.restore(cache_key, output_dir)
+        if restored is not None:
+            print(f"-> result cache hit: {cache_key}, {len(restored)} files restored to '{output_dir}'")
+            return
+
+    # the heavy dependencies are imported after the config has been parsed,
+    # and only those of the selected method
+    from accelerate.utils import set_seed
+
     # seed prepare
     set_seed(cfg.seed)
     seed_range = get_seed_range(cfg.srange) if cfg.multirun else None
@@ -51,13 +66,19 @@ def main(cfg: omegaconf.DictConfig):
         from pytorch_svgrender.pipelines.DiffVG_pipeline import DiffVGPipeline
 
         pipe = DiffVGPipeline(cfg)
-        pipe.painterly_rendering(cfg.target)
+        if is_batch_target(cfg.target):  # a directory or manifest of images
+            pipe.batch_rendering(cfg.target)
+        else:
+            pipe.painterly_rendering(cfg.target)
 
     elif flag == "live":  # img2svg
         from pytorch_svgrender.pipelines.LIVE_pipeline import LIVEPipeline
 
         pipe = LIVEPipeline(cfg)
-        pipe.painterly_rendering(cfg.target)
+        if is_batch_target(cfg.target):  # a directory or manifest of images
+            pipe.batch_rendering(cfg.target)
+        else:
+            pipe.painterly_rendering(cfg.target)
 
     elif flag == "vectorfusion":  # text2svg
         from pytorch_svgrender.pipelines.VectorFusion_pipeline import VectorFusionPipeline
@@ -140,6 +161,24 @@ def main(cfg: omegaconf.DictConfig):
         else:  # generate many SVG at once
             render_batch_fn(pipeline=StylizedDiffSketcherPipeline, prompt=cfg.prompt, style_fpath=cfg.style_file)
 
+    if cfg.svg_compact.enable:
+        import json
+        from pytorch_svgrender.svgtools import compact_svg_dir
+
+        reports = compact_svg_dir(output_dir,
+                                  patterns=tuple(cfg.svg_compact.patterns),
+                                  precision=cfg.svg_compact.precision,
+                                  min_size=cfg.svg_compact.min_size,
+                                  tolerance=cfg.svg_compact.tolerance)
+        with open(os.path.join(output_dir, "svg_compact_report.json"), 'w') as f:
+            json.dump(reports, f, indent=2)
+        saved = sum(r['saved_bytes'] for r in reports)
+        print(f"-> svg compaction: {len(reports)} files, {saved / 1024:.1f} KB saved")
+
+    if result_cache is not None:
+        stored = result_cache.store(cache_key, output_dir, meta={'method': flag, 'prompt': cfg.prompt})
+        print(f"-> result cache: {len(stored)} files stored under {cache_key}")
+
 
 if __name__ == '__main__':
     main()
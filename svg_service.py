@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Author: ximing xing
+# Description: a long-running local service for rendering jobs.
+# Copyright (c) 2024, XiMing Xing.
+
+import os
+import argparse
+
+from pytorch_svgrender.service import JobQueue, JobWorker, make_server
+
+
+def main(args):
+    if not args.online:  # only the local model files are used
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    queue = JobQueue()
+    worker = JobWorker(queue,
+                       config_dir=args.config_dir,
+                       result_root=args.result_path,
+                       max_batch=args.max_batch,
+                       echo=not args.quiet).start()
+    server = make_server(queue, host=args.host, port=args.port, unix_socket=args.unix_socket)
+
+    where = args.unix_socket if args.unix_socket else f"http://{args.host}:{args.port}"
+    print(f"-> SVGRender service listening on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", type=str, default=None, help='serve on a Unix socket instead of TCP.')
+    parser.add_argument("--config-dir", type=str, default='./conf')
+    parser.add_argument("--result-path", type=str, default='./workspace/service')
+    parser.add_argument("--max-batch", type=int, default=4, help='max number of coalesced jobs.')
+    parser.add_argument("--online", action='store_true', help='allow downloading the models.')
+    parser.add_argument("--quiet", action='store_true', help='do not echo the job logs.')
+    args = parser.parse_args()
+
+    """
+    python svg_service.py --port 8765
+    curl -X POST localhost:8765/jobs -d '{"method": "vectorfusion", "prompt": "a panda rowing a boat", "overrides": ["x.style=iconography"], "seed": 42}'
+    curl localhost:8765/jobs/<id>/events
+    """
+
+    main(args)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Author: ximing xing
+# Description: export the steps of a trajectory log to SVG or PNG.
+# Copyright (c) 2024, XiMing Xing.
+
+import argparse
+import pathlib
+
+from pytorch_svgrender.utils.trajectory_log import TrajectoryReader
+
+
+def main(args):
+    reader = TrajectoryReader(args.log_dir)
+    steps = reader.steps
+    if args.list or (args.step is None and not args.all):
+        print(f"{len(steps)} steps, {len(reader.topologies)} topologies: {steps}")
+        return
+
+    out_dir = pathlib.Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for step in (steps if args.all else [args.step]):
+        if args.svg:
+            reader.export_svg(step, out_dir / f"svg_iter{step}.svg")
+        if args.png:
+            reader.export_png(step, out_dir / f"iter{step}.png")
+        print(f"-> step {step} exported to '{out_dir}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log_dir", type=str, help='the trajectory directory, e.g. `.../svg_logs/trajectory`.')
+    parser.add_argument("--step", type=int, default=None)
+    parser.add_argument("--all", action='store_true', help='export all steps.')
+    parser.add_argument("--list", action='store_true', help='list the logged steps.')
+    parser.add_argument("--svg", action='store_true')
+    parser.add_argument("--png", action='store_true')
+    parser.add_argument("--out-dir", type=str, default='./workspace/trajectory_export')
+    args = parser.parse_args()
+
+    """
+    python svg_trajectory.py ./workspace/svgdreamer-xxx/ft_svg_logs/trajectory_p0 --list
+    python svg_trajectory.py ./workspace/svgdreamer-xxx/ft_svg_logs/trajectory_p0 --step 500 --svg --png
+    """
+
+    main(args)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the SVG compaction and its raster tolerance
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+from pytorch_svgrender.svgtools import compact
+
+SVG = b"""<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64" viewBox="0 0 64 64">
+  <path d="M 10.4444 10.4444 L 30.2222 10.4444 L 30.2222 30.6666 Z" fill="rgb(255, 0, 0)" fill-opacity="1" stroke="none"/>
+  <path d="M 40.0 40.0 L 50.0 40.0 L 50.0 50.0 Z" fill="rgb(0, 0, 255)" fill-opacity="0.0"/>
+  <circle cx="20.123456" cy="48.987654" r="6.5" fill="rgb(0, 128, 0)" stroke-width="1"/>
+</svg>
+"""
+
+
+@pytest.fixture
+def svg_file(tmp_path):
+    fpath = tmp_path / "final.svg"
+    fpath.write_bytes(SVG)
+    return fpath
+
+
+def test_compact_without_verification(svg_file, tmp_path):
+    out = tmp_path / "final.min.svg"
+    report = compact.compact_svg(svg_file, out, precision=1, verify=False)
+
+    text = out.read_text()
+    assert report['verified'] and report['raster_diff'] is None
+    assert report['bytes_out'] == len(out.read_bytes()) < len(SVG)
+    assert report['removed_invisible'] == 1 and report['shapes_out'] == 2
+    assert "10.4444" not in text and "20.123456" not in text
+    assert "rgb(" not in text
+
+
+@pytest.mark.parametrize("diff, tolerance, kept", [(1e-3, 2e-3, False), (2e-3, 2e-3, False), (3e-3, 2e-3, True)])
+def test_tolerance_decides_the_output(svg_file, tmp_path, monkeypatch, diff, tolerance, kept):
+    monkeypatch.setattr(compact, 'raster_diff', lambda a, b, size: diff)
+    out = tmp_path / "final.min.svg"
+    report = compact.compact_svg(svg_file, out, precision=1, verify=True, tolerance=tolerance)
+
+    assert report['raster_diff'] == diff
+    assert report['verified'] is not kept
+    assert (out.read_bytes() == SVG) is kept
+    assert report['saved_bytes'] == (0 if kept else len(SVG) - len(out.read_bytes()))
+
+
+def test_raster_diff_of_the_compacted_svg(svg_file, tmp_path):
+    pytest.importorskip("cairosvg")
+    pytest.importorskip("numpy")
+    pytest.importorskip("PIL")
+
+    report = compact.compact_svg(svg_file, tmp_path / "final.min.svg", precision=2, tolerance=2e-3)
+    assert report['verified'] and report['raster_diff'] <= 2e-3
+    # rounding to whole pixels moves the edges more than the tolerance allows
+    report = compact.compact_svg(svg_file, tmp_path / "final.min.svg", precision=0, tolerance=1e-5)
+    assert not report['verified']
+    assert (tmp_path / "final.min.svg").read_bytes() == SVG
+
+
+def test_dir_finds_the_final_svgs_of_every_method(tmp_path):
+    names = ['final_svg.svg', 'finetune_final_p_0.svg', 'live_stage_one_final.svg', 'best_iter.svg']
+    for name in names + ['svg_iter10.svg']:
+        (tmp_path / name).write_bytes(SVG)
+    reports = compact.compact_svg_dir(tmp_path, precision=1, verify=False)
+    assert sorted(r['input'].rsplit('/', 1)[-1] for r in reports) == sorted(names)
+    # the compacted files are not compacted again
+    assert len(compact.compact_svg_dir(tmp_path, precision=1, verify=False)) == len(names)
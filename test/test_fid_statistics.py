@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the streaming FID statistics against the one-shot mean and covariance
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+
+from pytorch_svgrender.libs.metric.pytorch_fid.fid_score import RunningStatistics
+
+
+def _features(n: int, dims: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # an offset and correlated dims, as the Inception features
+    return rng.normal(size=(n, dims)) @ rng.normal(size=(dims, dims)) + 5.0
+
+
+@pytest.mark.parametrize("batch_sizes", [[100], [1, 2, 97], [33, 0, 33, 34], [1] * 100])
+def test_update_matches_one_shot(batch_sizes):
+    act = _features(sum(batch_sizes), dims=8)
+    stats, start = RunningStatistics(dims=8), 0
+    for b in batch_sizes:
+        stats.update(act[start:start + b])
+        start += b
+
+    mu, sigma = stats.result()
+    assert np.allclose(mu, act.mean(axis=0))
+    assert np.allclose(sigma, np.cov(act, rowvar=False))
+
+
+def test_merge_matches_one_shot():
+    act = _features(120, dims=6, seed=1)
+    a = RunningStatistics(dims=6).update(act[:50])
+    b = RunningStatistics(dims=6).update(act[50:])
+    mu, sigma = a.merge(b).merge(RunningStatistics(dims=6)).result()
+    assert np.allclose(mu, act.mean(axis=0))
+    assert np.allclose(sigma, np.cov(act, rowvar=False))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the frozen layer cache of `DiffVGState.render_warp` against a full render
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pydiffvg = pytest.importorskip("pydiffvg")
+
+from pytorch_svgrender.model_helper.diffvg_helper import DiffVGState
+
+
+class _State(DiffVGState):
+
+    def clip_curve_shape(self, *args, **kwargs):
+        pass
+
+
+def _circle(x, y, r, rgba):
+    shape = pydiffvg.Circle(radius=torch.tensor(float(r)), center=torch.tensor([float(x), float(y)]))
+    color = torch.tensor(rgba, dtype=torch.float32)
+    return shape, color
+
+
+def _build(frozen_layer_cache: bool, frozen, active, size: int = 64):
+    """two path groups: `frozen` is added first, then frozen under `active`"""
+    state = _State(torch.device('cpu'), use_gpu=False, canvas_width=size, canvas_height=size,
+                   frozen_layer_cache=frozen_layer_cache)
+    params = []
+    for i, circles in enumerate([frozen, active]):
+        if i == 1 and frozen_layer_cache:
+            state.freeze_shapes()
+        for (x, y, r, rgba) in circles:
+            shape, color = _circle(x, y, r, rgba)
+            shape.center.requires_grad_(True)
+            color.requires_grad_(True)
+            state.shapes.append(shape)
+            state.shape_groups.append(pydiffvg.ShapeGroup(shape_ids=torch.tensor([len(state.shapes) - 1]),
+                                                          fill_color=color))
+            if i == 1:
+                params += [shape.center, color]
+    # only the newest group is optimized
+    state.set_active_parameters(params)
+    return state, params
+
+
+def _render_and_grad(state, params):
+    img = state.render_warp(seed=0)
+    weights = torch.linspace(0, 1, img.numel()).reshape(img.shape)
+    (img * weights).sum().backward()
+    return img.detach(), [p.grad.clone() for p in params]
+
+
+FROZEN = [(16, 16, 10, [1., 0., 0., 1.]), (48, 16, 8, [0., 1., 0., .5])]
+
+
+def test_disjoint_groups_match_full_render():
+    active = [(20, 48, 9, [0., 0., 1., .8]), (48, 48, 6, [1., 1., 0., 1.])]
+    ref_img, ref_grads = _render_and_grad(*_build(False, FROZEN, active))
+    state, params = _build(True, FROZEN, active)
+    img, grads = _render_and_grad(state, params)
+
+    assert state._frozen_key is not None  # the cache was used
+    assert torch.allclose(img, ref_img, atol=1e-5)
+    for g, ref in zip(grads, ref_grads):
+        assert torch.allclose(g, ref, atol=1e-4, rtol=1e-4)
+
+
+def test_overlapping_groups_match_full_render():
+    active = [(24, 20, 9, [0., 0., 1., .8]), (44, 20, 6, [1., 1., 0., 1.])]
+    ref_img, ref_grads = _render_and_grad(*_build(False, FROZEN, active))
+    img, grads = _render_and_grad(*_build(True, FROZEN, active))
+
+    # the anti-aliasing is composited per pixel, the edges of the overlap may differ slightly
+    assert (img - ref_img).abs().mean() < 1e-3
+    for g, ref in zip(grads, ref_grads):
+        assert torch.allclose(g, ref, atol=5e-2 * ref.abs().max().item() + 1e-4)
+
+
+def test_optimized_frozen_shape_is_rendered_every_step():
+    active = [(20, 48, 9, [0., 0., 1., .8])]
+    state, params = _build(True, FROZEN, active)
+    # a frozen tensor is still updated by an active optimizer
+    state.set_active_parameters(params + [state.shapes[0].center])
+    state.render_warp(seed=0)
+    assert state._frozen_key is None
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: import-time regression benchmark
+# Copyright (c) 2024, XiMing Xing.
+# License: MPL-2.0 License
+import argparse
+import subprocess
+import sys
+import time
+
+# (module, heavy dependencies it must not pull in)
+IMPORT_CASES = [
+    ("pytorch_svgrender", ["torch", "diffusers", "matplotlib"]),
+    ("pytorch_svgrender.utils", ["torch", "diffusers", "matplotlib"]),
+    ("pytorch_svgrender.libs", ["torch", "accelerate"]),
+    ("pytorch_svgrender.model_helper", ["torch", "diffusers", "pydiffvg"]),
+    ("pytorch_svgrender.svgtools", ["svgpathtools"]),
+    ("pytorch_svgrender.painter.vectorfusion", ["torch", "diffusers", "pydiffvg", "shapely"]),
+    ("pytorch_svgrender.painter.diffsketcher", ["torch", "diffusers", "pydiffvg"]),
+    ("pytorch_svgrender.pipelines.DiffVG_pipeline", ["diffusers", "clip", "ImageReward"]),
+    ("pytorch_svgrender.pipelines.LIVE_pipeline", ["diffusers", "clip", "ImageReward"]),
+    ("pytorch_svgrender.pipelines.CLIPDraw_pipeline", ["diffusers", "ImageReward"]),
+    ("pytorch_svgrender.pipelines.SVGDreamer_pipeline", ["ImageReward"]),
+]
+
+_PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+print(t1 - t0)
+print(','.join(sys.modules.keys()))
+"""
+
+
+def measure_import(module: str, repeat: int):
+    best, loaded = float('inf'), set()
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+        elapsed, modules = out.stdout.strip().splitlines()[-2:]
+        best = min(best, float(elapsed))
+        loaded = set(modules.split(','))
+    return best, loaded
+
+
+def measure_cli_help(repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, 'svg_render.py', '--help'], capture_output=True)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def test_import_time(args):
+    failed = []
+
+    print(f"=> import time (best of {args.repeat}), budget: {args.budget:.2f}s")
+    for module, heavy in IMPORT_CASES:
+        elapsed, loaded = measure_import(module, args.repeat)
+        if elapsed is None:  # a dependency of the module itself is missing
+            print(f"{module:<50} skipped: {loaded}")
+            continue
+
+        eager = [m for m in heavy if m in loaded]
+        status = "ok"
+        if len(eager) > 0:
+            status = f"FAIL, eagerly imports {eager}"
+            failed.append(module)
+        elif elapsed > args.budget:
+            status = "FAIL, over budget"
+            failed.append(module)
+        print(f"{module:<50} {elapsed:.3f}s {status}")
+
+    cli_time = measure_cli_help(args.repeat)
+    print(f"{'svg_render.py --help':<50} {cli_time:.3f}s")
+
+    if len(failed) > 0:
+        print(f"import-time regression: {failed}")
+        sys.exit(1)
+    print("all tests passed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3, help='number of runs per module.')
+    parser.add_argument("--budget", type=float, default=2.0, help='max import time (seconds) per module.')
+    args = parser.parse_args()
+
+    """
+    python test/test_import_time.py
+    python test/test_import_time.py --repeat 5 --budget 1.0
+    """
+
+    test_import_time(args)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the seed accounting of the multi-process multirun
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+pytest.importorskip("omegaconf")
+
+from pytorch_svgrender.utils.multirun import SeedScheduler
+
+
+def _seed(assignment):
+    return None if assignment is None else assignment[1]
+
+
+def test_all_seeds_done():
+    scheduler = SeedScheduler([1, 2, 3])
+    while not scheduler.finished:
+        for idx in range(2):
+            assignment = scheduler.assign(idx)
+            if assignment is not None:
+                scheduler.on_result(idx, *assignment, ok=True)
+    assert sorted(scheduler.done) == [1, 2, 3]
+    assert scheduler.failed == {}
+
+
+def test_idle_worker_gets_one_seed_at_a_time():
+    scheduler = SeedScheduler([1, 2, 3])
+    assert _seed(scheduler.assign(0)) == 1
+    assert scheduler.assign(0) is None  # still in flight
+    assert _seed(scheduler.assign(1)) == 2
+
+
+def test_dead_worker_seed_is_retried():
+    scheduler = SeedScheduler([1, 2], max_retries=1)
+    seed = _seed(scheduler.assign(0))
+    # the worker died before it reported anything
+    scheduler.on_worker_exit(0, exitcode=-9)
+    assert seed in scheduler.pending and seed not in scheduler.failed
+
+    # the restarted worker gets the seed again
+    first = scheduler.assign(0)
+    retry = scheduler.assign(1)
+    assert _seed(first) == 2 and _seed(retry) == seed
+    scheduler.on_result(0, *first, ok=True)
+    scheduler.on_result(1, *retry, ok=True)
+    assert scheduler.finished
+    assert scheduler.done == {2: 0, seed: 1}
+
+
+def test_dead_worker_seed_fails_after_retries():
+    scheduler = SeedScheduler([7], max_retries=1)
+    for _ in range(2):
+        assert _seed(scheduler.assign(0)) == 7
+        scheduler.on_worker_exit(0, exitcode=1)
+    assert scheduler.finished
+    assert "exited with code 1" in scheduler.failed[7]
+
+
+def test_late_report_of_a_reaped_worker_is_ignored():
+    scheduler = SeedScheduler([7], max_retries=1)
+    token, _ = scheduler.assign(0)
+    scheduler.on_worker_exit(0)
+    scheduler.on_result(0, token, 7, ok=True)  # flushed before the exit, read after it
+    assert 7 not in scheduler.done
+    assert _seed(scheduler.assign(1)) == 7
+
+
+def test_late_report_does_not_complete_the_retry_on_the_same_worker():
+    scheduler = SeedScheduler([7], max_retries=1)
+    stale_token, _ = scheduler.assign(0)
+    scheduler.on_worker_exit(0)
+    # the respawned worker 0 retries the same seed
+    retry = scheduler.assign(0)
+    assert _seed(retry) == 7
+
+    scheduler.on_result(0, stale_token, 7, ok=True)  # the report of the dead worker
+    assert 7 not in scheduler.done and not scheduler.finished
+    scheduler.on_result(0, *retry, ok=True)
+    assert scheduler.done == {7: 0}
+
+
+def test_abort_fails_the_remaining_seeds():
+    scheduler = SeedScheduler([1, 2, 3])
+    scheduler.on_result(0, *scheduler.assign(0), ok=True)
+    scheduler.assign(0)
+    scheduler.abort("no worker left")
+    assert scheduler.finished
+    assert scheduler.done == {1: 0}
+    assert scheduler.failed == {2: "no worker left", 3: "no worker left"}
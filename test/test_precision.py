@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the fp32 boundary of the autocast policy
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from pytorch_svgrender.libs.engine.precision import fp32, _autocast_enabled
+
+
+@fp32
+def _matmul(x=None):
+    if x is None:  # no tensor argument, as `render_warp(self, seed)`
+        x = torch.ones(4, 4)
+    return _autocast_enabled('cpu'), (x @ x).dtype
+
+
+@pytest.mark.parametrize("args", [(), (torch.ones(4, 4),)])
+def test_cpu_autocast_is_disabled_inside(args):
+    with torch.autocast(device_type='cpu', dtype=torch.bfloat16):
+        assert _autocast_enabled('cpu')
+        enabled, dtype = _matmul(*args)
+        assert _autocast_enabled('cpu')
+    assert not enabled and dtype == torch.float32
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the LRU eviction of the result cache
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import pytest
+
+pytest.importorskip("omegaconf")
+
+from pytorch_svgrender.utils.result_cache import ResultCache
+
+
+def _run_dir(root, name: str, n_bytes: int = 1000):
+    out = root / name
+    out.mkdir()
+    (out / "final.svg").write_bytes(b"x" * n_bytes)
+    (out / "svg_logs").mkdir()
+    (out / "svg_logs" / "svg_iter0.svg").write_bytes(b"y" * n_bytes)  # not an artifact
+    return out
+
+
+def test_store_and_restore(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    assert cache.store('a', _run_dir(tmp_path, 'a')) == ['final.svg']
+    assert cache.restore('missing', tmp_path / 'out') is None
+
+    restored = cache.restore('a', tmp_path / 'out')
+    assert [p.name for p in restored] == ['final.svg']
+    assert (tmp_path / 'out' / 'final.svg').read_bytes() == b"x" * 1000
+    assert cache.manifest['a']['hits'] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    # room for two entries of 1000 bytes
+    cache = ResultCache(tmp_path / "cache", max_size_gb=2500 / 1024 ** 3)
+    cache.store('a', _run_dir(tmp_path, 'a'))
+    cache.store('b', _run_dir(tmp_path, 'b'))
+    cache.restore('a', tmp_path / 'out')
+    cache.manifest['b']['last_access'] = cache.manifest['a']['last_access'] - 1  # `b` is the least recently used
+
+    cache.store('c', _run_dir(tmp_path, 'c'))
+    assert sorted(cache.manifest) == ['a', 'c']
+    assert not (cache.objects_dir / 'b').exists()
+    assert cache.total_bytes <= cache.max_bytes
+
+    # the manifest on disk agrees
+    assert sorted(ResultCache(tmp_path / "cache").manifest) == ['a', 'c']
+
+
+def test_entry_larger_than_the_cache_is_not_kept(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_size_gb=500 / 1024 ** 3)
+    assert cache.store('a', _run_dir(tmp_path, 'a')) == []
+    assert cache.manifest == {}
+
+
+def _cfg(**overrides):
+    import omegaconf
+    cfg = omegaconf.OmegaConf.create({
+        'x': {'method': 'diffvg', 'num_iter': 10}, 'prompt': None, 'target': None, 'seed': 1,
+        'state': {'mprec': 'no', 'autocast': False, 'wandb': False},
+        'diffvg': {'print_timing': False, 'frozen_layer_cache': False},
+        'svg_compact': {'enable': False}, 'trajectory_log': {'enable': False},
+        'result_path': './workspace', 'result_cache': {'enable': True},
+    })
+    for dotted, value in overrides.items():
+        omegaconf.OmegaConf.update(cfg, dotted.replace('__', '.'), value)
+    return cfg
+
+
+@pytest.mark.parametrize("dotted, value, same", [
+    ('result_path', './elsewhere', True),
+    ('state__wandb', True, True),
+    ('diffvg__print_timing', True, True),
+    ('svg_compact__enable', True, False),
+    ('diffvg__frozen_layer_cache', True, False),
+    ('state__autocast', True, False),
+    ('state__mprec', 'bf16', False),
+    ('trajectory_log__enable', True, False),
+    ('x__num_iter', 20, False),
+])
+def test_key_covers_the_semantic_settings(dotted, value, same):
+    assert (ResultCache.make_key(_cfg()) == ResultCache.make_key(_cfg(**{dotted: value}))) is same
+
+
+def test_key_changes_with_the_warm_start_index(tmp_path):
+    pytest.importorskip("hydra")
+    index_dir = tmp_path / "index"
+    cfg = _cfg(x__warm_start={'enable': True, 'index_dir': str(index_dir)})
+    empty = ResultCache.make_key(cfg)
+    (index_dir / "ViT-B-32").mkdir(parents=True)
+    (index_dir / "ViT-B-32" / "entries.json").write_text('[{"prompt": "a cat"}]')
+    assert ResultCache.make_key(cfg) != empty
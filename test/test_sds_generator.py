@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: the per-sample generators of the SD and SDXL score distillation
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+import inspect
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("diffusers")
+
+from pytorch_svgrender.painter.vectorfusion.LSDS_pipeline import LSDSPipeline
+from pytorch_svgrender.painter.vectorfusion.LSDS_SDXL_pipeline import LSDSSDXLPipeline
+
+PIPELINES = [LSDSPipeline, LSDSSDXLPipeline]
+
+
+def _generators(seeds):
+    return [torch.Generator().manual_seed(s) for s in seeds]
+
+
+@pytest.mark.parametrize("pipeline", PIPELINES)
+def test_sds_accepts_the_multi_job_call(pipeline):
+    # the keyword arguments of `VectorFusionPipeline.multi_job_rendering`
+    images = torch.rand(2, 3, 64, 64)
+    inspect.signature(pipeline.score_distillation_sampling).bind(
+        None, images,
+        im_size=64,
+        prompt=["a", "b"],
+        negative_prompt=["", ""],
+        guidance_scale=100,
+        input_augment=True,
+        grad_scale=1,
+        t_range=[0.05, 0.95],
+        generator=_generators([0, 1]),
+    )
+    for method in ('x_augment', 'encode_'):
+        assert 'generator' in inspect.signature(getattr(pipeline, method)).parameters
+
+
+@pytest.mark.parametrize("pipeline", PIPELINES)
+def test_augmentation_follows_the_generator_of_each_sample(pipeline):
+    x = torch.rand(2, 3, 64, 64)
+    a = pipeline.x_augment(None, x, 48, _generators([0, 1]))
+    # the same seed gives the same sample, whatever the global RNG and the other samples
+    torch.manual_seed(123)
+    b = pipeline.x_augment(None, x[:1], 48, _generators([0]))
+    c = pipeline.x_augment(None, x[1:], 48, _generators([1]))
+    assert torch.equal(a, torch.cat([b, c]))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Author: ximing
+# Description: round-trip of the binary SVG trajectory log
+# Copyright (c) 2024, XiMing Xing.
+# License: MIT License
+
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pydiffvg = pytest.importorskip("pydiffvg")
+pytest.importorskip("omegaconf")
+
+from pytorch_svgrender.utils.trajectory_log import TrajectoryWriter, TrajectoryReader
+
+
+def _scene(n_paths: int, seed: int):
+    g = torch.Generator().manual_seed(seed)
+    shapes, groups = [], []
+    for i in range(n_paths):
+        shapes.append(pydiffvg.Path(num_control_points=torch.tensor([2, 2]),
+                                    points=torch.rand(7, 2, generator=g) * 64,
+                                    stroke_width=torch.tensor(1.5),
+                                    is_closed=True))
+        groups.append(pydiffvg.ShapeGroup(shape_ids=torch.tensor([i]),
+                                          fill_color=torch.rand(4, generator=g)))
+    return SimpleNamespace(canvas_width=64, canvas_height=64, shapes=shapes, shape_groups=groups)
+
+
+def _flat(scene):
+    return torch.cat([t.reshape(-1) for s in scene.shapes for t in (s.points, s.stroke_width.reshape(1))] +
+                     [g.fill_color for g in scene.shape_groups])
+
+
+@pytest.mark.parametrize("dtype, atol", [('float32', 1e-6), ('float16', 5e-2)])
+def test_round_trip(tmp_path, dtype, atol):
+    writer = TrajectoryWriter(tmp_path / "trajectory", dtype=dtype, chunk_size=3)
+    # 5 steps of 2 paths, then the topology changes (a path reinit added one)
+    scenes = {step: _scene(2 if step < 50 else 3, seed=step) for step in range(0, 80, 10)}
+    for step, scene in scenes.items():
+        writer.append(step, scene)
+    writer.close()
+
+    reader = TrajectoryReader(tmp_path / "trajectory")
+    assert reader.steps == list(scenes)
+    assert len(reader.topologies) == 2
+    # random access, in any order
+    for step in [70, 0, 40, 10, 50]:
+        decoded = reader.scene(step)
+        expected = scenes[step]
+        assert (decoded.canvas_width, decoded.canvas_height) == (64, 64)
+        assert len(decoded.shapes) == len(expected.shapes)
+        assert [int(g.shape_ids) for g in decoded.shape_groups] == [int(g.shape_ids) for g in expected.shape_groups]
+        assert all(bool(s.is_closed) for s in decoded.shapes)
+        assert torch.allclose(_flat(decoded), _flat(expected), atol=atol)
+
+
+def test_unknown_step(tmp_path):
+    writer = TrajectoryWriter(tmp_path / "trajectory")
+    writer.append(0, _scene(1, seed=0))
+    writer.close()
+    with pytest.raises(KeyError):
+        TrajectoryReader(tmp_path / "trajectory").scene(5)